@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+"""Benchmarks for the recipe and the scripts it generates.
+
+For working sets of synthetic eggs (10, 100 and 1000 by default) and every
+kind of generated script, this times:
+
+- ``Recipe.install`` in a fresh buildout, with the time spent in each of
+  its steps;
+- ``Recipe.update`` with nothing changed and with a changed option, and in
+  the ``develop-eggs`` configuration also after editing a develop egg;
+- starting the generated manage (``bin/django check``), wsgi and asgi
+  scripts: cold (right after install, no bytecode for the project and the
+  synthetic eggs) and warm (the median of the next runs).
+
+Everything runs locally: the eggs are generated, the recipe's working set
+resolution is replaced by the synthetic working set. Django has to be
+installed to time the scripts' startup and for the configurations that run
+django at buildout time (``build-steps``).
+
+The results are written as json with sorted keys, one entry per
+(eggs, config) combination, so runs on different commits can be compared::
+
+    python benchmarks/recipe_benchmark.py --output before.json
+    git checkout other-branch
+    python benchmarks/recipe_benchmark.py --compare before.json
+
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'src'))
+
+import pkg_resources  # noqa
+import zc.buildout.easy_install  # noqa
+
+from djangorecipe import wscache  # noqa
+from djangorecipe.recipe import Recipe  # noqa
+
+FORMAT_VERSION = 1
+
+# Extra recipe options per configuration.
+CONFIGS = {
+    'manage': {},
+    'wsgi': {'wsgi': 'true'},
+    'asgi': {'asgi': 'true'},
+    'server': {'server': 'true'},
+    'module-index': {'wsgi': 'true', 'module-index': 'true'},
+    'bundle': {'wsgi': 'true', 'bundle': 'true'},
+    'compile-bytecode': {'compile-bytecode': 'true'},
+    'command-index': {'command-index': 'true'},
+    'build-steps': {'build-steps': 'templates'},
+    'develop-eggs': {'compile-bytecode': 'true'},
+    'scripts-with-settings': {'scripts-with-settings': 'django-admin'},
+    'settings-matrix': {
+        'wsgi': 'true', 'scripts-with-settings': 'django-admin',
+        'settings-matrix': '\n'.join(
+            'site%s project.settings' % number for number in range(60))},
+}
+
+# Configurations with a develop egg in the buildout, next to the eggs.
+DEVELOP_CONFIGS = ['develop-eggs']
+# Configurations that can't run without django.
+DJANGO_CONFIGS = ['build-steps']
+
+# The steps of install() whose durations are recorded.
+PHASES = ['get_working_set', 'create_module_index', 'create_manage_script',
+          'create_test_runner', 'make_wsgi_script', 'make_asgi_script',
+          'make_dispatch_script', 'create_server_script', 'create_bundle',
+          'create_scripts_with_settings', 'create_matrix_scripts',
+          'create_command_index', 'compile_bytecode', 'run_build_steps']
+
+SETTINGS = """\
+%(imports)s
+SECRET_KEY = 'benchmark'
+INSTALLED_APPS = ['django.contrib.contenttypes', 'django.contrib.auth']
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3',
+                         'NAME': ':memory:'}}
+ROOT_URLCONF = 'project.urls'
+USE_TZ = True
+"""
+
+
+def make_eggs(directory, count):
+    """Create ``count`` egg directories, return them as distributions."""
+    dists = []
+    for number in range(count):
+        name = 'benchpkg%04d' % number
+        location = os.path.join(directory, '%s-1.0-py%s.egg' % (
+            name, '%s.%s' % sys.version_info[:2]))
+        package = os.path.join(location, name)
+        os.makedirs(package)
+        os.makedirs(os.path.join(location, 'EGG-INFO'))
+        with open(os.path.join(package, '__init__.py'), 'w') as f:
+            f.write('VALUE = %s\n' % number)
+        with open(os.path.join(location, 'EGG-INFO', 'PKG-INFO'), 'w') as f:
+            f.write('Metadata-Version: 1.0\nName: %s\nVersion: 1.0\n' % name)
+        with open(os.path.join(location, 'EGG-INFO', 'top_level.txt'),
+                  'w') as f:
+            f.write(name + '\n')
+        dists.extend(pkg_resources.find_distributions(location, only=True))
+    return dists
+
+
+def real_dists():
+    """The distributions the generated scripts really need."""
+    dists = [pkg_resources.Distribution(
+        os.path.join(os.path.dirname(HERE), 'src'),
+        project_name='djangorecipe', version='0')]
+    try:
+        dists.extend(pkg_resources.working_set.resolve(
+            pkg_resources.parse_requirements('Django')))
+    except pkg_resources.DistributionNotFound:
+        pass
+    return dists
+
+
+def make_buildout(directory, egg_dists):
+    """Create a buildout directory with a small django project."""
+    for name in ('bin', 'eggs', 'develop-eggs', 'parts'):
+        os.makedirs(os.path.join(directory, name))
+    project = os.path.join(directory, 'project')
+    os.makedirs(project)
+    with open(os.path.join(project, '__init__.py'), 'w') as f:
+        f.write('')
+    # Importing some of the eggs makes the sys.path length count.
+    imports = '\n'.join('import %s' % dist.project_name
+                        for dist in egg_dists[:10])
+    with open(os.path.join(project, 'development.py'), 'w') as f:
+        f.write(SETTINGS % {'imports': imports})
+    with open(os.path.join(project, 'urls.py'), 'w') as f:
+        f.write('urlpatterns = []\n')
+
+
+def make_develop_egg(directory, modules=50):
+    """Create a develop egg like ``buildout`` does, return its dist."""
+    source = os.path.join(directory, 'src', 'benchdevelop')
+    package = os.path.join(source, 'benchdevelop')
+    os.makedirs(package)
+    for number in range(modules):
+        with open(os.path.join(package, 'module%s.py' % number), 'w') as f:
+            f.write('VALUE = %s\n' % number)
+    with open(os.path.join(package, '__init__.py'), 'w') as f:
+        f.write('')
+    egg_info = os.path.join(source, 'benchdevelop.egg-info')
+    os.makedirs(egg_info)
+    with open(os.path.join(egg_info, 'PKG-INFO'), 'w') as f:
+        f.write('Metadata-Version: 1.0\nName: benchdevelop\nVersion: 0.1\n')
+    with open(os.path.join(directory, 'develop-eggs',
+                           'benchdevelop.egg-link'), 'w') as f:
+        f.write(source + '\n.')
+    return list(pkg_resources.find_distributions(source, only=True))[0]
+
+
+def make_recipe(directory, ws, options):
+    buildout = {'buildout': {
+        'eggs-directory': os.path.join(directory, 'eggs'),
+        'develop-eggs-directory': os.path.join(directory, 'develop-eggs'),
+        'bin-directory': os.path.join(directory, 'bin'),
+        'parts-directory': os.path.join(directory, 'parts'),
+        'directory': directory,
+        'python': 'buildout',
+        'executable': sys.executable,
+        'find-links': '',
+        'allow-hosts': ''}}
+    part_options = {'recipe': 'djangorecipe'}
+    part_options.update(options)
+    recipe = Recipe(buildout, 'django', part_options)
+    # No egg resolution (and thus no network): always our working set.
+    recipe.egg.working_set = lambda extra=(): (None, ws)
+    return recipe
+
+
+def timed_phases(recipe):
+    """Wrap the recipe's steps, return the {step: seconds} they fill."""
+    phases = {}
+
+    def wrap(name):
+        method = getattr(recipe, name)
+
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                phases[name] = phases.get(name, 0) + time.time() - start
+        setattr(recipe, name, timed)
+
+    for name in PHASES:
+        if hasattr(recipe, name):
+            wrap(name)
+    return phases
+
+
+def timed(function):
+    start = time.time()
+    function()
+    return time.time() - start
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def remove_bytecode(directories):
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            if '__pycache__' in dirs:
+                shutil.rmtree(os.path.join(root, '__pycache__'))
+                dirs.remove('__pycache__')
+            for name in files:
+                if name.endswith('.pyc'):
+                    os.remove(os.path.join(root, name))
+
+
+def startup_times(command, repeat, cold_cleanup):
+    """Return {'cold': seconds, 'warm': seconds} for running command."""
+    env = dict(os.environ)
+    env.pop('DJANGO_SETTINGS_MODULE', None)
+    cold_cleanup()
+
+    def run():
+        start = time.time()
+        subprocess.check_call(command, env=env, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+        return time.time() - start
+
+    cold = run()
+    warm = median([run() for _ in range(repeat)])
+    return {'cold': round(cold, 4), 'warm': round(warm, 4)}
+
+
+def benchmark(eggs, config, repeat, startup):
+    tmp_dir = tempfile.mkdtemp('djangorecipe-benchmark')
+    try:
+        egg_dists = make_eggs(os.path.join(tmp_dir, 'egg-store'), eggs)
+        needed = real_dists()
+        ws = pkg_resources.WorkingSet([])
+        for dist in egg_dists + needed:
+            ws.add(dist)
+        has_django = 'django' in [dist.key for dist in needed]
+
+        if config in DJANGO_CONFIGS and not has_django:
+            sys.stderr.write("Skipped: %s needs django\n" % config)
+            return None
+
+        installs = []
+        phases = []
+        updates = []
+        changed_updates = []
+        develop_updates = []
+        for number in range(repeat):
+            directory = os.path.join(tmp_dir, 'buildout%s' % number)
+            make_buildout(directory, egg_dists)
+            develop_dist = None
+            if config in DEVELOP_CONFIGS:
+                develop_dist = make_develop_egg(directory)
+                ws = pkg_resources.WorkingSet([])
+                for dist in [develop_dist] + egg_dists + needed:
+                    ws.add(dist)
+            options = dict(CONFIGS[config])
+            # A fresh process would have an empty in-process cache.
+            wscache._memory.clear()
+            recipe = make_recipe(directory, ws, options)
+            recipe_phases = timed_phases(recipe)
+            installs.append(timed(recipe.install))
+            phases.append(recipe_phases)
+
+            wscache._memory.clear()
+            recipe = make_recipe(directory, ws, options)
+            updates.append(timed(recipe.update))
+
+            if develop_dist is not None:
+                # Code changes without buildout noticing.
+                with open(os.path.join(develop_dist.location, 'benchdevelop',
+                                       'module0.py'), 'a') as f:
+                    f.write('CHANGED = True\n')
+                wscache._memory.clear()
+                recipe = make_recipe(directory, ws, options)
+                develop_updates.append(timed(recipe.update))
+
+            wscache._memory.clear()
+            options['initialization'] = 'import os'
+            recipe = make_recipe(directory, ws, options)
+            changed_updates.append(timed(recipe.update))
+
+        result = {
+            'eggs': eggs,
+            'config': config,
+            'install': round(median(installs), 4),
+            'update': round(median(updates), 4),
+            'update_changed': round(median(changed_updates), 4),
+            'phases': dict(
+                (name, round(median([p.get(name, 0) for p in phases]), 4))
+                for name in sorted(set().union(*phases))),
+        }
+        if develop_updates:
+            result['update_develop_edit'] = round(median(develop_updates), 4)
+        if startup and has_django:
+            bin_dir = os.path.join(directory, 'bin')
+
+            def cleanup():
+                remove_bytecode([os.path.join(directory, 'project')] +
+                                [dist.location for dist in egg_dists])
+
+            scripts = {'manage': [os.path.join(bin_dir, 'django'), 'check']}
+            if os.path.exists(os.path.join(bin_dir, 'django.wsgi')):
+                scripts['wsgi'] = [sys.executable,
+                                   os.path.join(bin_dir, 'django.wsgi')]
+            if os.path.exists(os.path.join(bin_dir, 'django-bundle')):
+                scripts['manage-bundle'] = [
+                    os.path.join(bin_dir, 'django-bundle'), 'check']
+            if os.path.exists(os.path.join(bin_dir, 'django-bundle.wsgi')):
+                scripts['wsgi-bundle'] = [
+                    sys.executable,
+                    os.path.join(bin_dir, 'django-bundle.wsgi')]
+            if os.path.exists(os.path.join(bin_dir, 'django_asgi.py')):
+                scripts['asgi'] = [sys.executable,
+                                   os.path.join(bin_dir, 'django_asgi.py')]
+            result['startup'] = dict(
+                (name, startup_times(command, repeat, cleanup))
+                for name, command in sorted(scripts.items()))
+        return result
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=HERE, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def flatten(result, prefix=''):
+    """Yield (metric name, seconds) for a result entry."""
+    for key, value in sorted(result.items()):
+        if key in ('eggs', 'config'):
+            continue
+        if isinstance(value, dict):
+            for item in flatten(value, prefix + key + '.'):
+                yield item
+        else:
+            yield prefix + key, value
+
+
+def compare(baseline, results, out=sys.stdout):
+    """Print the change of every metric relative to the baseline."""
+    old = dict(((entry['eggs'], entry['config']), entry)
+               for entry in baseline['results'])
+    for entry in results['results']:
+        key = (entry['eggs'], entry['config'])
+        if key not in old:
+            continue
+        previous = dict(flatten(old[key]))
+        for metric, value in flatten(entry):
+            if not previous.get(metric):
+                continue
+            change = (value - previous[metric]) / previous[metric] * 100
+            out.write('%5s eggs %-22s %-40s %8.4fs %+7.1f%%\n' % (
+                key[0], key[1], metric, value, change))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--eggs', default='10,100,1000',
+                        help="Comma separated working set sizes")
+    parser.add_argument('--configs', default=','.join(sorted(CONFIGS)),
+                        help="Comma separated configurations, out of %s"
+                        % ', '.join(sorted(CONFIGS)))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Repetitions per measurement (median is used)")
+    parser.add_argument('--no-startup', action='store_true',
+                        help="Don't time the generated scripts' startup")
+    parser.add_argument('--output', help="Write the json results here")
+    parser.add_argument('--compare', help="Compare with an earlier output")
+    options = parser.parse_args(arguments)
+
+    results = {'format': FORMAT_VERSION,
+               'commit': git_commit(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'results': []}
+    for eggs in [int(size) for size in options.eggs.split(',')]:
+        for config in options.configs.split(','):
+            sys.stderr.write('%s eggs, %s...\n' % (eggs, config))
+            result = benchmark(eggs, config, options.repeat,
+                               not options.no_startup)
+            if result is not None:
+                results['results'].append(result)
+    output = json.dumps(results, indent=1, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), results)
+    elif not options.output:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
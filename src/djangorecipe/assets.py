@@ -0,0 +1,310 @@
+"""Build steps (collectstatic, compilemessages, template checks) for buildout.
+
+Running ``bin/django collectstatic``, ``bin/django compilemessages`` and a
+template check one after the other starts django three times, and every
+command scans and processes all of its files again. ``run()`` starts a
+single django process that runs the requested steps concurrently, in
+threads.
+
+Every step first hashes its inputs: the files the staticfiles finders
+list, the ``.po`` files compilemessages would compile, the files in the
+template directories, plus the settings the step depends on. When that
+hash matches the one of its last successful run and its output is still
+there, the step is skipped. The hashes of unchanged files (same mtime and
+size) are remembered in the state file, so they aren't read again.
+
+The buildout side (``run()``) doesn't import django, the django process
+runs ``main()``.
+
+"""
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+STEPS = ('collectstatic', 'compilemessages', 'templates')
+# The buildout directories that only change when buildout runs.
+BUILDOUT_DIRECTORIES = ('bin', 'develop-eggs', 'eggs', 'parts')
+STATE_VERSION = 1
+PATH_ENV = 'DJANGORECIPE_ASSETS_PATH'
+BOOTSTRAP = (
+    "import json, os, sys\n"
+    "sys.path[0:0] = json.loads(os.environ.pop(%r))\n" % PATH_ENV)
+MAIN = (
+    "from djangorecipe import assets\n"
+    "sys.exit(assets.main(sys.argv[1:]))\n")
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class BuildError(Exception):
+    """The build process couldn't run."""
+
+
+def run(steps, settings, path, state_file, initialization='',
+        python=None, cwd=None):
+    """Run the steps in a django process, return its results.
+
+    The results are a dict with the django ``setup`` time and a list of
+    ``steps``: {'step', 'skipped', 'seconds', 'output', 'error'}.
+
+    """
+    env = dict(os.environ)
+    env['DJANGO_SETTINGS_MODULE'] = settings
+    env[PATH_ENV] = json.dumps(path)
+    handle, results_file = tempfile.mkstemp(prefix='djangorecipe-assets',
+                                            suffix='.json')
+    os.close(handle)
+    try:
+        process = subprocess.Popen(
+            [python or sys.executable, '-c',
+             BOOTSTRAP + initialization + '\n' + MAIN,
+             state_file, results_file] + list(steps),
+            env=env, cwd=cwd, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode('utf-8', 'replace')
+        if process.returncode:
+            raise BuildError(output.strip() or
+                             "Exited with %s" % process.returncode)
+        with open(results_file) as f:
+            return json.load(f)
+    finally:
+        os.remove(results_file)
+
+
+# Django process side.
+
+class State(object):
+    """The hashes of the files and of the steps' last successful inputs."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = {}
+        self.steps = {}
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') == STATE_VERSION:
+            self.files = data['files']
+            self.steps = data['steps']
+
+    def file_hash(self, filename):
+        stat = os.stat(filename)
+        known = self.files.get(filename)
+        if known and known[:2] == [stat.st_mtime, stat.st_size]:
+            file_hash = known[2]
+        else:
+            file_hash = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 16), b''):
+                    file_hash.update(block)
+            file_hash = file_hash.hexdigest()
+            self.files[filename] = [stat.st_mtime, stat.st_size, file_hash]
+        return file_hash
+
+    def save(self, used):
+        # Forget the files that aren't inputs anymore.
+        files = dict((filename, self.files[filename]) for filename in used
+                     if filename in self.files)
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = '%s.%s.tmp' % (self.filename, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'version': STATE_VERSION, 'files': files,
+                       'steps': self.steps}, f)
+        os.rename(tmp, self.filename)
+
+
+def _settings(*names):
+    from django.conf import settings
+    return [(name, repr(getattr(settings, name, None))) for name in names]
+
+
+def _walk(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+
+def static_inputs():
+    """Return (settings, files, done) of collectstatic."""
+    from django.apps import apps
+    from django.conf import settings
+    from django.contrib.staticfiles.finders import get_finders
+    if not apps.is_installed('django.contrib.staticfiles'):
+        raise BuildError("django.contrib.staticfiles isn't installed")
+    ignore_patterns = apps.get_app_config('staticfiles').ignore_patterns
+    files = []
+    for finder in get_finders():
+        for path, storage in finder.list(ignore_patterns):
+            files.append(storage.path(path))
+    done = bool(settings.STATIC_ROOT) and os.path.isdir(settings.STATIC_ROOT)
+    return (_settings('STATIC_ROOT', 'STATIC_URL', 'STATICFILES_DIRS',
+                      'STATICFILES_FINDERS', 'STORAGES',
+                      'STATICFILES_STORAGE'),
+            files, done)
+
+
+def _managed(directory):
+    """Return whether the directory is hidden or managed by buildout."""
+    relative = os.path.relpath(os.path.abspath(directory))
+    parts = relative.split(os.sep)
+    if parts[0] == os.pardir:
+        # compilemessages only looks in the current directory.
+        return True
+    return parts[0] in BUILDOUT_DIRECTORIES or any(
+        part.startswith('.') for part in parts)
+
+
+def locale_inputs():
+    """Return (settings, files, done) of compilemessages.
+
+    compilemessages looks for locale directories in the whole current
+    directory, which is the buildout directory with all its eggs and parts.
+    Walking all that for every build is too slow: only ``conf/locale``,
+    ``locale``, the LOCALE_PATHS and the installed apps' locale directories
+    are hashed. Not those of apps in hidden directories or in directories
+    buildout manages: eggs only change when buildout installs others.
+
+    """
+    from django.apps import apps
+    from django.conf import settings
+    basedirs = [os.path.join('conf', 'locale'), 'locale']
+    basedirs.extend(str(path) for path in settings.LOCALE_PATHS)
+    basedirs.extend(
+        directory for directory in (
+            os.path.join(app_config.path, 'locale')
+            for app_config in apps.get_app_configs())
+        if not _managed(directory))
+    files = []
+    done = True
+    for basedir in sorted(set(os.path.abspath(basedir)
+                              for basedir in basedirs
+                              if os.path.isdir(basedir))):
+        for filename in _walk(basedir):
+            if filename.endswith('.po'):
+                files.append(filename)
+                done = done and os.path.exists(filename[:-3] + '.mo')
+    return _settings('LOCALE_PATHS'), files, done
+
+
+def template_files():
+    """Yield (engine, filename) for the files in the template dirs."""
+    from django.template import engines
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            for filename in _walk(str(directory)):
+                yield engine, filename
+
+
+def template_inputs():
+    """Return (settings, files, done) of the template check."""
+    return (_settings('TEMPLATES'),
+            [filename for _, filename in template_files()], True)
+
+
+def collectstatic(stdout):
+    from django.core.management import call_command
+    call_command('collectstatic', interactive=False, verbosity=1,
+                 stdout=stdout, stderr=stdout)
+
+
+def compilemessages(stdout):
+    from django.core.management import call_command
+    call_command('compilemessages', verbosity=1, stdout=stdout,
+                 stderr=stdout)
+
+
+def check_templates(stdout):
+    """Run the template checks and compile every template."""
+    from django.core.management import call_command
+    call_command('check', tags=['templates'], stdout=stdout, stderr=stdout)
+    errors = []
+    checked = 0
+    for engine, filename in template_files():
+        try:
+            with io.open(filename, encoding='utf-8') as f:
+                source = f.read()
+        except UnicodeDecodeError:
+            # Not a template.
+            continue
+        checked += 1
+        try:
+            engine.from_string(source)
+        except Exception as e:
+            errors.append('%s: %s' % (filename, e))
+    if errors:
+        raise BuildError('\n'.join(errors))
+    stdout.write('%s templates compiled.\n' % checked)
+
+
+INPUTS = {'collectstatic': static_inputs,
+          'compilemessages': locale_inputs,
+          'templates': template_inputs}
+RUNNERS = {'collectstatic': collectstatic,
+           'compilemessages': compilemessages,
+           'templates': check_templates}
+
+
+def run_step(step, state, used):
+    """Run the step unless its inputs didn't change, return its result."""
+    import django
+    start = timer()
+    result = {'step': step, 'skipped': False, 'output': '', 'error': None}
+    try:
+        settings, files, done = INPUTS[step]()
+        used.update(files)
+        key = hashlib.sha1()
+        key.update(repr((step, django.get_version(), settings)).encode(
+            'utf-8'))
+        for filename in files:
+            key.update(('%s\0%s\0' % (filename, state.file_hash(filename))
+                        ).encode('utf-8'))
+        key = key.hexdigest()
+        if done and state.steps.get(step) == key:
+            result['skipped'] = True
+        else:
+            stdout = io.StringIO()
+            try:
+                RUNNERS[step](stdout)
+            finally:
+                result['output'] = stdout.getvalue()
+            state.steps[step] = key
+    except Exception as e:
+        state.steps.pop(step, None)
+        result['error'] = str(e) or e.__class__.__name__
+    result['seconds'] = timer() - start
+    return result
+
+
+def main(argv):
+    state_file, results_file, steps = argv[0], argv[1], argv[2:]
+    start = timer()
+    import django
+    django.setup()
+    setup = timer() - start
+    state = State(state_file)
+    used = set()
+    results = {}
+    threads = []
+    for step in steps:
+        thread = threading.Thread(
+            target=lambda step=step: results.__setitem__(
+                step, run_step(step, state, used)))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    state.save(used)
+    with open(results_file, 'w') as f:
+        json.dump({'setup': setup,
+                   'steps': [results[step] for step in steps]}, f)
+    return 0
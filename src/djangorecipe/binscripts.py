@@ -1,61 +1,398 @@
 import os
 import sys
 
-from django.core import management
+from djangorecipe import trace
 
 
-def manage(settings_file):
+def manage(settings_file, forkserver_directory=None, forkserver_timeout=900,
+           memory_snapshots=None, memory_frames=1, memory_signal='USR2',
+           command_index=None):
+    if command_index and _answer_from_index(settings_file, command_index):
+        return 0
+    if forkserver_directory:
+        code = _forkserver(settings_file, forkserver_directory,
+                           forkserver_timeout)
+        if code is not None:
+            return code
+    if memory_snapshots:
+        _install_memory_snapshots(memory_snapshots, memory_frames,
+                                  memory_signal)
+    trace.enter()
+    # Imported here, so the fork server client doesn't have to.
+    from django.core import management
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_file)
-    management.execute_from_command_line(sys.argv)
+    trace.setup_django()
+    with trace.phase('command'):
+        management.execute_from_command_line(sys.argv)
 
 
-def test(settings_file, coverage_functions, *apps):
+def _answer_from_index(settings_file, index_file):
+    """Answer help and completion from the command index, without django.
+
+    Returns False when the command line needs django after all.
+
+    """
+    from djangorecipe import commands
+    if not commands.is_index_request(sys.argv, os.environ):
+        return False
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_file)
+    settings_module = os.environ['DJANGO_SETTINGS_MODULE']
+    index = commands.load_index(index_file, settings_module)
+    if index is None:
+        # Missing or out of date: set up django once to write it again.
+        # When that fails, django reports why the usual way.
+        try:
+            import django
+            django.setup()
+            index = commands.write_index(index_file, sys.argv[0])
+        except Exception:
+            return False
+    return commands.answer(index, sys.argv, os.environ)
+
+
+def _install_memory_snapshots(directory, frames, signal_name):
+    import signal
+    from djangorecipe import memory
+    memory.install(directory, frames, getattr(signal, 'SIG' + signal_name))
+
+
+def _forkserver(settings_file, directory, timeout):
+    """Run the command through the fork server, None if that didn't work."""
+    from djangorecipe import forkserver
+    if os.environ.get(forkserver.ENVIRON) == 'serve':
+        # We're the background server started by an earlier invocation.
+        return forkserver.serve(directory, settings_file, timeout)
+    return forkserver.run(directory, settings_file, sys.argv)
+
+
+def test(settings_file, coverage_functions, *apps, **options):
+    # Imported here, so the other scripts don't have to.
+    from djangorecipe import testing
+    from djangorecipe import testmap
+    trace.enter()
     optional_arguments = sys.argv[1:]
-    sys.argv[1:] = ['test'] + list(apps) + optional_arguments
+    parallel = testing.pop_parallel_flag(optional_arguments,
+                                         default=options.get('parallel'))
+    try:
+        workers = testing.parse_workers(parallel)
+    except ValueError:
+        sys.stderr.write("%s must be a number of worker processes or "
+                         "'auto', not %r.\n" % (testing.PARALLEL_FLAG,
+                                                 parallel))
+        return 2
+    changed = testmap.pop_changed_flag(optional_arguments)
+    if changed is not None and changed not in testmap.CHANGED_MODES:
+        sys.stderr.write("%s must be one of %s, not %r.\n" % (
+            testmap.CHANGED_FLAG, ', '.join(testmap.CHANGED_MODES),
+            changed))
+        return 2
+    test_map = options.get('test_map')
+    worker = testing.worker_number()
+    coverage_options = _coverage_options(options)
+    if worker:
+        apps = testing.worker_labels()
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_file)
+
+    if changed and not worker:
+        if not test_map:
+            sys.stderr.write("--changed needs the 'test-map' option.\n")
+            return 2
+        apps = _changed_tests(test_map, changed, apps)
+        if not apps:
+            print("No tests are affected by the changes.")
+            return 0
+    sys.argv[1:] = ['test'] + list(apps) + optional_arguments
+
+    if worker:
+        _install_snapshots(options)
+        return _test_worker(worker, coverage_functions, test_map,
+                            coverage_options)
+    if workers > 1:
+        # Labels on the command line are split over the workers too, only
+        # the options are passed on to every worker.
+        labels, worker_arguments = testing.split_arguments(
+            optional_arguments)
+        if len(apps) + len(labels) > 1:
+            return _test_parallel(workers, coverage_functions, test_map,
+                                  list(apps) + labels, worker_arguments,
+                                  coverage_options)
+
+    from django.core import management
+    trace.setup_django()
+    _install_snapshots(options)
+    cov, ran = _start_coverage(coverage_functions, test_map,
+                               **coverage_options)
+    try:
+        with trace.phase('command'):
+            management.execute_from_command_line(sys.argv)
+    finally:
+        # The test command exits with sys.exit() on failures, the test map
+        # is updated anyway.
+        if cov is not None:
+            cov.stop()
+            cov.save()
+            if test_map:
+                _update_test_map(test_map, cov, ran)
+
     if coverage_functions:
-        import coverage
-        cov = coverage.coverage()
+        _coverage_reports(cov, coverage_functions)
+
+
+def _install_snapshots(options):
+    directory = options.get('test_snapshots')
+    if directory:
+        from djangorecipe import testdb
+        testdb.install(directory, options.get('test_snapshots_size', 0))
+
+
+def _coverage_options(options):
+    """Return the keyword arguments for _coverage() from the options."""
+    core = options.get('coverage_core')
+    if core:
+        if core == 'fastest':
+            # sys.monitoring has the least overhead, where it exists.
+            core = 'sysmon' if sys.version_info >= (3, 12) else 'ctrace'
+        # Inherited by the test workers. Set in the environment, coverage
+        # doesn't accept it as an argument.
+        os.environ.setdefault('COVERAGE_CORE', core)
+    return {'source': options.get('coverage_source')}
+
+
+def _coverage_config(cov, name):
+    # coverage 4.0 renamed include and omit to run_include and run_omit.
+    config = cov.config
+    return getattr(config, 'run_' + name, getattr(config, name, None))
+
+
+def _coverage(coverage_functions, test_map, source=None, **kwargs):
+    import coverage
+    if not coverage_functions:
+        # Only measuring for the test map: don't touch the regular
+        # .coverage data file.
+        kwargs['data_file'] = test_map + '.coverage'
+    cov = coverage.coverage(**kwargs)
+    if source and not (cov.config.source or
+                       _coverage_config(cov, 'include')):
+        # Measuring only our own code is a lot faster than tracing django
+        # and all eggs too. The coverage configuration file knows better,
+        # though. Passed to the constructor, as older coverage versions
+        # don't pick up a source set afterwards.
+        cov = coverage.coverage(source=list(source), **kwargs)
+    return cov
+
+
+def _start_coverage(coverage_functions, test_map, **kwargs):
+    """Start coverage if needed, return (coverage, recorded test ids)."""
+    if not (coverage_functions or test_map):
+        return None, None
+    cov = _coverage(coverage_functions, test_map, **kwargs)
+    if not kwargs.get('data_suffix'):
         cov.erase()
-        cov.start()
+    ran = None
+    if test_map:
+        from djangorecipe import testmap
+        ran = testmap.record_contexts(cov)
+    cov.start()
+    return cov, ran
 
-    management.execute_from_command_line(sys.argv)
 
-    if coverage_functions:
-        cov.stop()
-        cov.save()
-        # coverage_functions will be something like "report xml_report", which
-        # means we have to call ``cov.report()`` and ``cov.xml_report()``.
-        function_names = coverage_functions.split()
+def _fresh_coverage(cov):
+    """Return a new coverage object for the data that ``cov`` saved.
+
+    A forked process can't use the original one: its data file connection
+    belongs to the parent.
+
+    """
+    import coverage
+    fresh = coverage.coverage(data_file=cov.config.data_file,
+                              source=cov.config.source,
+                              include=_coverage_config(cov, 'include'),
+                              omit=_coverage_config(cov, 'omit'))
+    fresh.load()
+    return fresh
+
+
+def _coverage_reports(cov, coverage_functions):
+    # coverage_functions will be something like "report xml_report", which
+    # means we have to call ``cov.report()`` and ``cov.xml_report()``.
+    function_names = coverage_functions.split()
+    if len(function_names) < 2 or not hasattr(os, 'fork'):
         for function_name in function_names:
             getattr(cov, function_name)()
+        return
+    # The reports are generated side by side: all but the last one in
+    # forked processes. coverage's html report is incremental already, it
+    # only renders the files that changed since the last report.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    children = []
+    for function_name in function_names[:-1]:
+        pid = os.fork()
+        if not pid:
+            code = 1
+            try:
+                getattr(_fresh_coverage(cov), function_name)()
+                code = 0
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children.append((pid, function_name))
+    try:
+        getattr(cov, function_names[-1])()
+    finally:
+        failed = [function_name for pid, function_name in children
+                  if os.waitpid(pid, 0)[1]]
+    if failed:
+        raise RuntimeError("Generating the coverage %s failed" %
+                           ', '.join(failed))
+
+
+def _changed_tests(test_map, mode, labels):
+    from djangorecipe import testmap
+    mapping = testmap.TestMap(test_map)
+    changed = mapping.changed_files(mode)
+    return mapping.select(testmap.discover_tests(labels), changed)
 
 
-def wsgi(settings_file, logfile=None):
+def _update_test_map(test_map, cov, ran=()):
+    from djangorecipe import testmap
+    mapping = testmap.TestMap(test_map)
+    mapping.update(cov.get_data(), ran or ())
+    mapping.save()
+
+
+def _test_worker(worker, coverage_functions, test_map, coverage_options):
+    from django.core import management
+    from djangorecipe import testing
+    testing.isolate_test_databases(worker)
+    # Every worker writes its own .coverage.<suffix> data file, the master
+    # combines them.
+    cov, ran = _start_coverage(coverage_functions, test_map,
+                               data_suffix=True, **coverage_options)
+    try:
+        management.execute_from_command_line(sys.argv)
+    finally:
+        # The test command exits with sys.exit() on failures.
+        if cov is not None:
+            cov.stop()
+            cov.save()
+            if test_map:
+                from djangorecipe import testmap
+                testmap.save_ran(test_map, ran)
+
+
+def _test_parallel(workers, coverage_functions, test_map, apps,
+                   optional_arguments, coverage_options):
+    from djangorecipe import testing
+    from djangorecipe import testmap
+    cov = None
+    if coverage_functions or test_map:
+        cov = _coverage(coverage_functions, test_map, **coverage_options)
+        cov.erase()
+    if test_map:
+        # Left behind by an earlier run that was interrupted.
+        testmap.collect_ran(test_map)
+
+    with trace.phase('command'):
+        exit_code = testing.run_workers(
+            testing.split_labels(list(apps), workers), optional_arguments)
+
+    if cov is not None:
+        cov.combine()
+        cov.save()
+        if test_map:
+            _update_test_map(test_map, cov, testmap.collect_ran(test_map))
+    if coverage_functions:
+        _coverage_reports(cov, coverage_functions)
+    return exit_code
+
+
+def wsgi(settings_file, logfile=None, preload=False, warmup_urls=(),
+         metrics=None, metrics_url=None, profile=None, profile_every=100,
+         profile_match=(), profile_keep=100, memory_snapshots=None,
+         memory_frames=1, memory_signal='USR2', recycle_max_rss=0,
+         recycle_check_every=100, recycle_max_requests=0, recycle_jitter=0,
+         recycle_signal='TERM', **log_options):
+    if memory_snapshots:
+        # Before loading the application, to see what that allocates.
+        _install_memory_snapshots(memory_snapshots, memory_frames,
+                                  memory_signal)
+    trace.enter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_file)
+    if logfile:
+        from djangorecipe.logfile import BufferedLogFile
+        sys.stdout = sys.stderr = BufferedLogFile(logfile, **log_options)
+
+    # Run WSGI handler for the application
+    trace.setup_django()
+    with trace.phase('application'):
+        from django.core.wsgi import get_wsgi_application
+        application = get_wsgi_application()
+    if preload:
+        with trace.phase('preload'):
+            from djangorecipe.preload import warm_up
+            warm_up(application, warmup_urls)
+    if profile:
+        from djangorecipe.profiling import sample
+        application = sample(application, profile, every=profile_every,
+                             match=profile_match, keep=profile_keep)
+    if metrics:
+        # After the warm-up, those requests don't count.
+        from djangorecipe.metrics import instrument
+        application = instrument(application, metrics, metrics_url)
+    if recycle_max_rss or recycle_max_requests:
+        import signal
+        from djangorecipe.recycle import recycle
+        application = recycle(
+            application, max_rss=recycle_max_rss,
+            check_every=recycle_check_every,
+            max_requests=recycle_max_requests, jitter=recycle_jitter,
+            signum=getattr(signal, 'SIG' + recycle_signal))
+    # The server keeps running: the startup is done.
+    trace.finish()
+    return application
+
+
+def asgi(settings_file, logfile=None, preload=False, warmup_urls=(),
+         **log_options):
+    trace.enter()
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_file)
     if logfile:
-        import datetime
+        from djangorecipe.logfile import BufferedLogFile
+        sys.stdout = sys.stderr = BufferedLogFile(logfile, **log_options)
 
-        class logger(object):
-            def __init__(self, logfile):
-                self.logfile = logfile
+    trace.setup_django()
+    with trace.phase('application'):
+        from django.core.asgi import get_asgi_application
+        application = get_asgi_application()
+    if preload:
+        # The asgi server imports us before it accepts connections.
+        with trace.phase('preload'):
+            from djangorecipe.preload import send_asgi_requests
+            from djangorecipe.preload import warm_up
+            warm_up(application, warmup_urls, send=send_asgi_requests)
+    trace.finish()
+    return application
 
-            def write(self, data):
-                self.log(data)
 
-            def writeline(self, data):
-                self.log(data)
+def dispatch(routes, python=None, workers=1, idle_timeout=600,
+             initialization=''):
+    # No django here: every site runs in its own processes.
+    from djangorecipe.dispatch import Dispatcher
+    return Dispatcher(routes, python=python, workers=workers,
+                      idle_timeout=idle_timeout,
+                      initialization=initialization)
 
-            def log(self, msg):
-                line = '%s - %s\n' % (
-                    datetime.datetime.now().strftime('%Y%m%d %H:%M:%S'), msg)
-                fp = open(self.logfile, 'a')
-                try:
-                    fp.write(line)
-                finally:
-                    fp.close()
-        sys.stdout = sys.stderr = logger(logfile)
 
-    # Run WSGI handler for the application
-    from django.core.wsgi import get_wsgi_application
-    return get_wsgi_application()
+def serve(settings_file, listen=('127.0.0.1:8000',), workers=0,
+          max_requests=0, **wsgi_options):
+    # Load the application once in the master, the workers are forked
+    # from it.
+    application = wsgi(settings_file, **wsgi_options)
+    from djangorecipe import server
+    return server.serve(application, listen, workers=workers,
+                        max_requests=max_requests)
@@ -0,0 +1,266 @@
+"""Zip bundle of the working set, project and extra-paths.
+
+Every egg is a separate ``sys.path`` entry, so each top-level import stats
+its way through all of them, and shipping a buildout means copying
+thousands of small files. The bundle packs everything that is pure python
+into one zip archive, with precompiled bytecode, that the ``-bundle`` scripts
+put on ``sys.path`` instead.
+
+Distributions that need real files on disk stay where they are and are
+added to ``sys.path`` after the bundle: those with C extensions, with data
+files (templates, static files, locales...) next to their modules, that are
+marked as not zip safe or that contribute to namespace packages, and
+modules that use ``__file__`` (inside the archive, it points at a path that
+doesn't exist). The same goes for packages in the ``extra-paths``
+directories. The project itself always stays on disk: settings like
+``BASE_DIR`` are derived from its location.
+
+"""
+import hashlib
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+# A fixed timestamp for the archive members, so that an unchanged bundle is
+# byte for byte the same and isn't replaced.
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+HASH_BASED = hasattr(py_compile, 'PycInvalidationMode')
+# The number of modules lookup_time() is used for by the recipe.
+LOOKUP_SAMPLE = 50
+
+MAIN_TEMPLATE = """\
+import sys
+sys.path[1:1] = %(on_disk)r
+%(initialization)s
+import djangorecipe.binscripts
+sys.exit(djangorecipe.binscripts.manage(%(settings)r))
+"""
+
+
+def _uses_file(filename):
+    with open(filename, 'rb') as f:
+        return b'__file__' in f.read()
+
+
+def _is_pure(path):
+    """Return whether a module or package can be imported from a zip.
+
+    That is: it consists of .py files only, none of which use ``__file__``.
+
+    """
+    if not os.path.isdir(path):
+        return path.endswith('.py') and not _uses_file(path)
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [name for name in dirs if name != '__pycache__']
+        for name in files:
+            if name.endswith(('.pyc', '.pyo')):
+                continue
+            if (not name.endswith('.py') or
+                    _uses_file(os.path.join(root, name))):
+                return False
+    return True
+
+
+def _module_path(location, name):
+    """Return the path of top-level module or package ``name``, or None."""
+    package = os.path.join(location, name)
+    if os.path.isfile(os.path.join(package, '__init__.py')):
+        return package
+    if os.path.isfile(package + '.py'):
+        return package + '.py'
+    return None
+
+
+def _dist_modules(dist):
+    """Return [paths of the dist's top-level modules] if it can be zipped.
+
+    Returns None when the distribution has to stay on disk.
+
+    """
+    from djangorecipe.pathindex import top_level_names
+    location = dist.location
+    if not location or not os.path.isdir(location):
+        return None
+    if (dist.has_metadata('not-zip-safe') or
+            dist.has_metadata('namespace_packages.txt')):
+        return None
+    paths = []
+    for name in top_level_names(dist):
+        path = _module_path(location, name)
+        if path is None or not _is_pure(path):
+            return None
+        paths.append(path)
+    return paths
+
+
+def _directory_modules(directory, names=None):
+    """Return (pure module paths, whether anything has to stay on disk)."""
+    paths = []
+    on_disk = False
+    for name in names or sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            name = name[:-3]
+        path = _module_path(directory, name)
+        if path is None:
+            continue
+        if _is_pure(path):
+            paths.append(path)
+        else:
+            on_disk = True
+    return paths, on_disk
+
+
+def classify(ws, directories):
+    """Split the working set and directories into zippable and on-disk parts.
+
+    ``directories`` is a list of (directory, names) for the extra-paths,
+    ``names`` being None for all modules and packages in there.
+    Returns (zipped, on_disk): ``zipped`` is a list of (module path,
+    distribution or None), ``on_disk`` a list of sys.path entries.
+
+    """
+    zipped = []
+    on_disk = []
+    for dist in ws:
+        paths = _dist_modules(dist)
+        if paths is None:
+            if dist.location and dist.location not in on_disk:
+                on_disk.append(dist.location)
+            continue
+        zipped.extend((path, dist) for path in paths)
+    for directory, names in directories:
+        if not os.path.isdir(directory):
+            continue
+        paths, keep = _directory_modules(directory, names)
+        zipped.extend((path, None) for path in paths)
+        if keep and directory not in on_disk:
+            on_disk.append(directory)
+    return zipped, on_disk
+
+
+def _add(archive, arcname, data):
+    info = zipfile.ZipInfo(arcname, ZIP_DATE)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    archive.writestr(info, data)
+
+
+def _add_module(archive, path, tmp_dir, bundle_name):
+    """Add a module or package with a .pyc next to every .py file.
+
+    zipimport only looks for bytecode next to the source, not in
+    __pycache__. The bytecode isn't checked against the source: the archive
+    is immutable anyway.
+
+    """
+    base = os.path.dirname(path)
+    if os.path.isdir(path):
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(name for name in dirs if name != '__pycache__')
+            files.extend(os.path.join(root, name) for name in sorted(names)
+                         if name.endswith('.py'))
+    else:
+        files = [path]
+    errors = []
+    for filename in files:
+        arcname = os.path.relpath(filename, base).replace(os.path.sep, '/')
+        with open(filename, 'rb') as f:
+            _add(archive, arcname, f.read())
+        if not HASH_BASED:
+            continue
+        compiled = os.path.join(tmp_dir, 'module.pyc')
+        try:
+            py_compile.compile(
+                filename, cfile=compiled,
+                dfile=os.path.join(bundle_name, arcname), doraise=True,
+                invalidation_mode=(
+                    py_compile.PycInvalidationMode.UNCHECKED_HASH))
+        except py_compile.PyCompileError as e:
+            errors.append((filename, str(e).strip()))
+            continue
+        with open(compiled, 'rb') as f:
+            _add(archive, arcname + 'c', f.read())
+    return errors
+
+
+def _add_metadata(archive, dist):
+    """Add the dist's metadata, for pkg_resources and importlib.metadata."""
+    directory = '%s-%s.egg-info' % (dist.project_name.replace('-', '_'),
+                                    dist.version)
+    for name in dist.metadata_listdir(''):
+        if dist.metadata_isdir(name):
+            continue
+        _add(archive, '%s/%s' % (directory, name),
+             dist.get_metadata(name).encode('utf-8'))
+
+
+def _file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def write_bundle(filename, zipped, main=None):
+    """Write the bundle, return [(filename, compile error)].
+
+    The file is only replaced when its contents changed.
+
+    """
+    tmp_dir = tempfile.mkdtemp('djangorecipe-bundle')
+    tmp_file = os.path.join(tmp_dir, 'bundle.zip')
+    errors = []
+    seen = set()
+    try:
+        archive = zipfile.ZipFile(tmp_file, 'w')
+        try:
+            dists = []
+            for path, dist in zipped:
+                name = os.path.basename(path)
+                if name.endswith('.py'):
+                    name = name[:-3]
+                if name in seen:
+                    # Shadowed by an earlier entry, just like on sys.path.
+                    continue
+                seen.add(name)
+                errors.extend(_add_module(archive, path, tmp_dir, filename))
+                if dist is not None and dist not in dists:
+                    dists.append(dist)
+            for dist in dists:
+                _add_metadata(archive, dist)
+            if main:
+                _add(archive, '__main__.py', main.encode('utf-8'))
+        finally:
+            archive.close()
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if (not os.path.exists(filename) or
+                _file_hash(filename) != _file_hash(tmp_file)):
+            shutil.move(tmp_file, filename)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return errors
+
+
+def lookup_time(names, path):
+    """Return the seconds it takes to find the top-level modules on path.
+
+    The path entry cache is emptied first, so this is what a freshly
+    started process pays.
+
+    """
+    from importlib.machinery import PathFinder
+    saved = sys.path_importer_cache.copy()
+    sys.path_importer_cache.clear()
+    try:
+        start = time.time()
+        for name in names:
+            PathFinder.find_spec(name, path)
+        return time.time() - start
+    finally:
+        sys.path_importer_cache.clear()
+        sys.path_importer_cache.update(saved)
@@ -0,0 +1,154 @@
+"""Byte-compilation of the project code when buildout runs.
+
+Eggs installed by buildout are compiled already, but the project itself,
+the ``extra-paths`` and the develop eggs aren't: their first import after a
+deploy compiles them inside a live process, or on every start when the
+deploy tree is read-only. ``compile_sources()`` compiles them up front, in a
+process pool. A json state file remembers the source hash of everything
+compiled, so an unchanged module isn't compiled again.
+
+Where python supports it (3.7+), the .pyc files are validated by source hash
+instead of modification time, so deploys that only touch the files (a fresh
+checkout, rsync without ``--times``) don't invalidate them.
+
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import py_compile
+import time
+
+try:
+    from importlib.util import cache_from_source
+except ImportError:  # Python 2
+    def cache_from_source(path):
+        return path + 'c'
+
+STATE_VERSION = 1
+HASH_BASED = hasattr(py_compile, 'PycInvalidationMode')
+# Below this many files, starting worker processes isn't worth it.
+POOL_THRESHOLD = 20
+
+
+def find_sources(directories, exclude=()):
+    """Yield the .py files in the directories, skipping ``exclude``.
+
+    Hidden directories and ``__pycache__`` are skipped as well.
+
+    """
+    exclude = set(os.path.realpath(path) for path in exclude)
+    seen = set()
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            real_root = os.path.realpath(root)
+            if real_root in seen:
+                dirs[:] = []
+                continue
+            seen.add(real_root)
+            dirs[:] = sorted(
+                name for name in dirs
+                if not name.startswith('.') and name != '__pycache__' and
+                os.path.realpath(os.path.join(root, name)) not in exclude)
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    yield os.path.join(root, name)
+
+
+def source_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def compile_file(filename):
+    """Compile one file, return an error message or None."""
+    kwargs = {}
+    if HASH_BASED:
+        kwargs['invalidation_mode'] = (
+            py_compile.PycInvalidationMode.CHECKED_HASH)
+    try:
+        py_compile.compile(filename, doraise=True, **kwargs)
+    except (py_compile.PyCompileError, IOError, OSError) as e:
+        return str(e).strip()
+    return None
+
+
+class CompileState(object):
+    """{filename: [mtime, size, source hash]} of the compiled files."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = {}
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') == STATE_VERSION:
+            self.files = data['files']
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.filename, 'w') as f:
+            json.dump({'version': STATE_VERSION, 'files': self.files}, f,
+                      indent=1, sort_keys=True)
+
+    def needs_compiling(self, filename):
+        """Return whether the file changed since it was last compiled.
+
+        Only when the mtime or size differ is the source hashed.
+
+        """
+        stat = os.stat(filename)
+        recorded = self.files.get(filename)
+        if not os.path.exists(cache_from_source(filename)):
+            recorded = None
+        if recorded is not None and recorded[:2] == [stat.st_mtime,
+                                                     stat.st_size]:
+            return False
+        digest = source_hash(filename)
+        self.files[filename] = [stat.st_mtime, stat.st_size, digest]
+        # A timestamp based .pyc is stale as soon as the mtime changes.
+        return (recorded is None or recorded[2] != digest or
+                not HASH_BASED)
+
+    def forget(self, filename):
+        self.files.pop(filename, None)
+
+
+def compile_sources(directories, state_file, workers=0, exclude=()):
+    """Compile the changed modules in the directories.
+
+    Returns (compiled, total, errors, seconds), ``errors`` being a list of
+    (filename, message).
+
+    """
+    start = time.time()
+    state = CompileState(state_file)
+    sources = list(find_sources(directories, exclude))
+    todo = [filename for filename in sources
+            if state.needs_compiling(filename)]
+    if len(todo) < POOL_THRESHOLD or workers == 1:
+        results = [compile_file(filename) for filename in todo]
+    else:
+        pool = multiprocessing.Pool(workers or None)
+        try:
+            results = pool.map(compile_file, todo, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+    errors = []
+    for filename, error in zip(todo, results):
+        if error:
+            # Try again next time, maybe it's fixed by then.
+            state.forget(filename)
+            errors.append((filename, error))
+    # Drop files that are gone. The state file may be shared with other
+    # parts, so files outside our directories are kept.
+    for filename in list(state.files):
+        if not os.path.exists(filename):
+            state.forget(filename)
+    state.save()
+    return len(todo) - len(errors), len(sources), errors, time.time() - start
@@ -0,0 +1,263 @@
+"""An index of the management commands, for fast help and shell completion.
+
+Shell completion (``DJANGO_AUTO_COMPLETE``) and ``bin/django help`` run
+django's full ``execute_from_command_line``: ``django.setup()`` imports
+every installed app, on every keystroke. The index holds the commands, the
+options of every command and its help text, so the manage script can answer
+those requests without importing django at all.
+
+The index is written when buildout installs the part or the working set
+changes. It remembers the modification times of the settings modules and
+of the apps' command modules; when one of them changed, the next help or
+completion request sets up django once and writes the index again.
+
+"""
+import json
+import os
+import subprocess
+import sys
+
+INDEX_VERSION = 1
+PATH_ENV = 'DJANGORECIPE_COMMANDS_PATH'
+BUILD = (
+    "import json, os, sys\n"
+    "sys.path[0:0] = json.loads(os.environ.pop(%r))\n" % PATH_ENV)
+BUILD_MAIN = (
+    "import django\n"
+    "django.setup()\n"
+    "from djangorecipe import commands\n"
+    "commands.write_index(sys.argv[1], sys.argv[2])\n")
+# Commands whose completion includes the app labels, as in django.
+APP_LABEL_COMMANDS = ('dumpdata', 'sqlmigrate', 'sqlsequencereset', 'test')
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def watched_files(settings_module, app_paths):
+    """Return {path: mtime or None} of what the index depends on.
+
+    That is every module next to the settings module (settings are often
+    split over several), and the ``management/commands`` directory of every
+    app with the command modules in it.
+
+    """
+    paths = []
+    settings_file = getattr(sys.modules.get(settings_module), '__file__',
+                            None)
+    if settings_file:
+        directory = os.path.dirname(os.path.abspath(settings_file))
+        paths.extend(os.path.join(directory, name)
+                     for name in sorted(os.listdir(directory))
+                     if name.endswith('.py'))
+    for app_path in app_paths:
+        commands = os.path.join(app_path, 'management', 'commands')
+        paths.append(commands)
+        if os.path.isdir(commands):
+            paths.extend(os.path.join(commands, name)
+                         for name in sorted(os.listdir(commands))
+                         if name.endswith('.py'))
+    return dict((path, _mtime(path)) for path in paths)
+
+
+def build_index(prog_name):
+    """Return the index of the commands. django must be set up."""
+    import django
+    from django.apps import apps
+    from django.core.management import BaseCommand
+    from django.core.management import get_commands
+    from django.core.management import load_command_class
+    commands = {}
+    for name, app in get_commands().items():
+        entry = {'app': app if isinstance(app, str) else None,
+                 'options': None, 'help': None}
+        try:
+            if isinstance(app, BaseCommand):
+                command = app
+            else:
+                command = load_command_class(app, name)
+            parser = command.create_parser(prog_name, name)
+            entry['options'] = [
+                [min(action.option_strings), action.nargs != 0]
+                for action in parser._actions if action.option_strings]
+            entry['help'] = parser.format_help()
+        except Exception:
+            # django reports it when the command is used.
+            pass
+        commands[name] = entry
+    app_configs = apps.get_app_configs()
+    settings_module = os.environ.get('DJANGO_SETTINGS_MODULE')
+    return {'version': INDEX_VERSION,
+            'django': django.get_version(),
+            'settings': settings_module,
+            'prog': os.path.basename(prog_name),
+            'commands': commands,
+            'app_labels': [config.label for config in app_configs],
+            'watched': watched_files(settings_module,
+                                     [config.path for config in app_configs])}
+
+
+def write_index(filename, prog_name):
+    index = build_index(prog_name)
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = '%s.%s.tmp' % (filename, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.rename(tmp, filename)
+    return index
+
+
+def build(filename, prog_name, settings, path, initialization='',
+          python=None, cwd=None):
+    """Write the index in a django process, return its error output.
+
+    The buildout process doesn't import django: this starts one with the
+    ``path`` as sys.path. Returns None when the index was written.
+
+    """
+    env = dict(os.environ)
+    env['DJANGO_SETTINGS_MODULE'] = settings
+    env[PATH_ENV] = json.dumps(path)
+    process = subprocess.Popen(
+        [python or sys.executable, '-c',
+         BUILD + initialization + '\n' + BUILD_MAIN, filename, prog_name],
+        env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode('utf-8', 'replace')
+    if process.returncode:
+        return output.strip() or "Exited with %s" % process.returncode
+    return None
+
+
+def load_index(filename, settings_module):
+    """Return the index, or None if it is missing or out of date."""
+    try:
+        with open(filename) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if (index.get('version') != INDEX_VERSION or
+            index.get('settings') != settings_module):
+        return None
+    for path, mtime in index['watched'].items():
+        if _mtime(path) != mtime:
+            return None
+    return index
+
+
+def is_index_request(argv, environ):
+    """Return whether the index can answer the command line."""
+    if 'DJANGO_AUTO_COMPLETE' in environ:
+        return True
+    args = argv[1:]
+    if args in ([], ['help'], ['help', '--commands'], ['--help'], ['-h'],
+                ['version'], ['--version']):
+        return True
+    if len(args) == 2:
+        return args[0] == 'help' or args[1] in ('--help', '-h')
+    return False
+
+
+def _notice(text):
+    if not (hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()):
+        return text
+    from django.utils import termcolors
+    palette = termcolors.parse_color_setting(
+        os.environ.get('DJANGO_COLORS', ''))
+    style = palette and palette.get('NOTICE')
+    if not style:
+        return text
+    return termcolors.make_style(**style)(text)
+
+
+def main_help_text(index, prog_name, commands_only=False):
+    """Return django's main help text from the index."""
+    if commands_only:
+        return '\n'.join(sorted(index['commands']))
+    usage = ['',
+             "Type '%s help <subcommand>' for help on a specific "
+             "subcommand." % prog_name,
+             '',
+             'Available subcommands:']
+    by_app = {}
+    for name, entry in index['commands'].items():
+        app = entry['app'] or ''
+        if app == 'django.core':
+            app = 'django'
+        else:
+            app = app.rpartition('.')[-1]
+        by_app.setdefault(app, []).append(name)
+    for app in sorted(by_app):
+        usage.append('')
+        usage.append(_notice('[%s]' % app))
+        for name in sorted(by_app[app]):
+            usage.append('    %s' % name)
+    return '\n'.join(usage)
+
+
+def command_help(index, name, prog_name):
+    """Return the help text of the command, None if not in the index."""
+    entry = index['commands'].get(name)
+    if entry is None or entry['help'] is None:
+        return None
+    text = entry['help']
+    if prog_name != index['prog']:
+        text = text.replace('%s %s' % (index['prog'], name),
+                            '%s %s' % (prog_name, name))
+    return text
+
+
+def complete(index, environ):
+    """Return the completion output, like django's ``autocomplete()``."""
+    cwords = environ['COMP_WORDS'].split()[1:]
+    cword = int(environ['COMP_CWORD'])
+    try:
+        curr = cwords[cword - 1]
+    except IndexError:
+        curr = ''
+    subcommands = list(index['commands']) + ['help']
+    if cword == 1:
+        return ' '.join(sorted(name for name in subcommands
+                               if name.startswith(curr))) + '\n'
+    if cwords[0] not in subcommands or cwords[0] == 'help':
+        return ''
+    entry = index['commands'][cwords[0]]
+    if entry['options'] is None:
+        return None
+    options = [('--help', False)]
+    if cwords[0] in APP_LABEL_COMMANDS:
+        options.extend((label, False) for label in index['app_labels'])
+    options.extend((option, takes_value)
+                   for option, takes_value in entry['options'])
+    previous = set(word.split('=')[0] for word in cwords[1:cword - 1])
+    options = sorted((option, takes_value) for option, takes_value in options
+                     if option not in previous and option.startswith(curr))
+    return ''.join('%s%s\n' % (option, takes_value and '=' or '')
+                   for option, takes_value in options)
+
+
+def answer(index, argv, environ):
+    """Write the answer to the request, return False if we can't."""
+    prog_name = os.path.basename(argv[0])
+    args = argv[1:]
+    if 'DJANGO_AUTO_COMPLETE' in environ:
+        output = complete(index, environ)
+    elif args in ([], ['help'], ['--help'], ['-h']):
+        output = main_help_text(index, prog_name) + '\n'
+    elif args == ['help', '--commands']:
+        output = main_help_text(index, prog_name, commands_only=True) + '\n'
+    elif args in (['version'], ['--version']):
+        output = index['django'] + '\n'
+    elif args[0] == 'help':
+        output = command_help(index, args[1], prog_name)
+    else:
+        output = command_help(index, args[0], prog_name)
+    if output is None:
+        return False
+    sys.stdout.write(output)
+    return True
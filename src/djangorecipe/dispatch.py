@@ -0,0 +1,337 @@
+"""Serve django sites with different settings modules from one wsgi process.
+
+django's settings are global to the process, so a wsgi process group can
+only serve one settings module. The dispatcher is a wsgi application that
+routes every request, by host name or path prefix, to the site for it. Each
+site runs in its own worker processes: up to ``workers`` of them per
+settings module, each handling one request at a time. The dispatcher process
+itself never imports django.
+
+A site's processes are only started by its first request, and stopped
+again once the site has been idle for ``idle_timeout`` seconds, so sites
+without traffic don't take up memory.
+
+Request and response bodies are passed as a whole, so this doesn't suit
+streaming responses.
+
+"""
+import atexit
+import io
+import json
+import os
+import pickle
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+PATH_ENV = 'DJANGORECIPE_DISPATCH_PATH'
+FD_ENV = 'DJANGORECIPE_DISPATCH_FD'
+BOOTSTRAP = (
+    "import json, os, sys\n"
+    "sys.path[0:0] = json.loads(os.environ.pop(%r))\n" % PATH_ENV)
+MAIN = (
+    "from djangorecipe import dispatch\n"
+    "dispatch.worker_main()\n")
+# The types of environ values that are passed on to the sites. The others
+# (wsgi.input, wsgi.errors, server specific objects) are replaced or left out.
+SENT_TYPES = (str, bytes, bool, int, float, tuple, type(None))
+# Seconds to wait for a stopped worker process before killing it.
+STOP_TIMEOUT = 5
+
+
+class SiteError(Exception):
+    """A site's worker process died or couldn't be started."""
+
+
+def parse_routes(routes):
+    """Return (hosts, prefixes, default) for [(pattern, settings)].
+
+    A pattern is a host name, ``*.domain`` for a domain and its subdomains,
+    a ``/path`` prefix or ``*`` for all other requests. ``hosts`` is a
+    {host: settings} dict, ``prefixes`` a list of (prefix, settings), the
+    longest first.
+
+    """
+    hosts = {}
+    prefixes = []
+    default = None
+    for pattern, settings in routes:
+        if pattern == '*':
+            default = settings
+        elif pattern.startswith('/'):
+            prefixes.append((pattern.rstrip('/'), settings))
+        else:
+            hosts[pattern.lower()] = settings
+    prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+    return hosts, prefixes, default
+
+
+def request_host(environ):
+    host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+    if host.startswith('['):
+        # An IPv6 address.
+        return host.split(']')[0][1:].lower()
+    return host.split(':')[0].lower()
+
+
+def _send(conn, message):
+    data = pickle.dumps(message, 2)
+    conn.sendall(struct.pack('!I', len(data)) + data)
+
+
+def _receive_exactly(conn, size):
+    data = b''
+    while len(data) < size:
+        more = conn.recv(size - len(data))
+        if not more:
+            raise EOFError("Connection closed")
+        data += more
+    return data
+
+
+def _receive(conn):
+    size = struct.unpack('!I', _receive_exactly(conn, 4))[0]
+    return pickle.loads(_receive_exactly(conn, size))
+
+
+class Worker(object):
+    """A site worker process and our end of its socket."""
+
+    def __init__(self, settings, python, path, initialization=''):
+        conn, child_conn = socket.socketpair()
+        env = dict(os.environ)
+        env['DJANGO_SETTINGS_MODULE'] = settings
+        env[PATH_ENV] = json.dumps(path)
+        env[FD_ENV] = str(child_conn.fileno())
+        kwargs = {}
+        if sys.version_info[0] >= 3:
+            kwargs['pass_fds'] = (child_conn.fileno(),)
+        else:
+            kwargs['close_fds'] = False
+        try:
+            self.process = subprocess.Popen(
+                [python, '-c', BOOTSTRAP + initialization + '\n' + MAIN],
+                env=env, **kwargs)
+        except OSError as e:
+            conn.close()
+            raise SiteError("Can't start a worker for %s: %s" % (settings, e))
+        finally:
+            child_conn.close()
+        self.conn = conn
+
+    def request(self, environ, body):
+        """Return (status, headers, body) of the site's response."""
+        try:
+            _send(self.conn, (environ, body))
+            return _receive(self.conn)
+        except (EOFError, socket.error, ValueError) as e:
+            raise SiteError("The worker process died: %s" % e)
+
+    def stop(self):
+        # The worker exits when its socket is closed.
+        self.conn.close()
+        deadline = time.time() + STOP_TIMEOUT
+        while self.process.poll() is None:
+            if time.time() > deadline:
+                self.process.kill()
+                self.process.wait()
+                break
+            time.sleep(0.01)
+
+
+class Site(object):
+    """The worker processes of one settings module, started on demand."""
+
+    def __init__(self, settings, python, path, workers=1,
+                 initialization=''):
+        self.settings = settings
+        self.python = python
+        self.path = path
+        self.initialization = initialization
+        self.workers = max(workers, 1)
+        self.idle = []
+        self.running = 0
+        self.last_used = time.time()
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while not self.idle and self.running >= self.workers:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.running += 1
+        try:
+            return Worker(self.settings, self.python, self.path,
+                          self.initialization)
+        except BaseException:
+            self.release(None)
+            raise
+
+    def release(self, worker, broken=False):
+        with self.condition:
+            self.last_used = time.time()
+            if worker is None or broken:
+                self.running -= 1
+            else:
+                self.idle.append(worker)
+            self.condition.notify()
+        if worker is not None and broken:
+            worker.stop()
+
+    def request(self, environ, body):
+        worker = self.acquire()
+        try:
+            response = worker.request(environ, body)
+        except SiteError:
+            self.release(worker, broken=True)
+            raise
+        self.release(worker)
+        return response
+
+    def unload(self, idle_timeout=0):
+        """Stop the idle workers if the site wasn't used for a while."""
+        with self.condition:
+            if time.time() - self.last_used < idle_timeout:
+                return 0
+            idle, self.idle = self.idle, []
+            self.running -= len(idle)
+        for worker in idle:
+            worker.stop()
+        return len(idle)
+
+
+class Dispatcher(object):
+    """The wsgi application routing requests to the sites.
+
+    ``initialization`` is python code the site workers run before they set
+    up django, like the ``initialization`` of the generated scripts.
+
+    """
+
+    def __init__(self, routes, python=None, workers=1, idle_timeout=600,
+                 initialization=''):
+        self.hosts, self.prefixes, self.default = parse_routes(routes)
+        # (.domain, settings) of the wildcard hosts, the most specific first.
+        self.domains = sorted(
+            ((pattern[1:], settings)
+             for pattern, settings in self.hosts.items()
+             if pattern.startswith('*.')),
+            key=lambda item: len(item[0]), reverse=True)
+        python = python or sys.executable
+        path = list(sys.path)
+        self.sites = {}
+        for _, settings in routes:
+            if settings not in self.sites:
+                self.sites[settings] = Site(settings, python, path, workers,
+                                            initialization)
+        self.idle_timeout = idle_timeout
+        if idle_timeout:
+            unloader = threading.Thread(target=self._unload_idle_sites)
+            unloader.daemon = True
+            unloader.start()
+        atexit.register(self.close)
+
+    def match(self, environ):
+        """Return (site, environ for the site) or None."""
+        host = request_host(environ)
+        settings = self.hosts.get(host)
+        if settings is None:
+            for domain, candidate in self.domains:
+                if host == domain[1:] or host.endswith(domain):
+                    settings = candidate
+                    break
+        environ = dict((key, value) for key, value in environ.items()
+                       if isinstance(value, SENT_TYPES))
+        if settings is None:
+            path_info = environ.get('PATH_INFO', '')
+            for prefix, candidate in self.prefixes:
+                if path_info == prefix or path_info.startswith(prefix + '/'):
+                    settings = candidate
+                    environ['SCRIPT_NAME'] = (
+                        environ.get('SCRIPT_NAME', '') + prefix)
+                    environ['PATH_INFO'] = path_info[len(prefix):]
+                    break
+        if settings is None:
+            settings = self.default
+        if settings is None:
+            return None
+        return self.sites[settings], environ
+
+    def __call__(self, environ, start_response):
+        match = self.match(environ)
+        if match is None:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'No site for this host.\n']
+        site, site_environ = match
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length > 0 else b''
+        try:
+            status, headers, content = site.request(site_environ, body)
+        except SiteError as e:
+            environ['wsgi.errors'].write('%s: %s\n' % (site.settings, e))
+            start_response('502 Bad Gateway', [('Content-Type', 'text/plain')])
+            return [b'The site is unavailable.\n']
+        start_response(status, headers)
+        return [content]
+
+    def _unload_idle_sites(self):
+        interval = max(min(self.idle_timeout / 2.0, 60), 1)
+        while True:
+            time.sleep(interval)
+            for site in list(self.sites.values()):
+                site.unload(self.idle_timeout)
+
+    def close(self):
+        for site in self.sites.values():
+            site.unload()
+
+
+# Worker process side.
+
+def handle(application, environ, body):
+    """Run the request through the application, return the response."""
+    environ['wsgi.input'] = io.BytesIO(body)
+    environ['wsgi.errors'] = sys.stderr
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = list(headers)
+        return chunks.append
+
+    try:
+        result = application(environ, start_response)
+        try:
+            for chunk in result:
+                chunks.append(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return ('500 Internal Server Error', [('Content-Type', 'text/plain')],
+                b'Internal Server Error\n')
+    return response['status'], response['headers'], b''.join(chunks)
+
+
+def worker_main():
+    fd = int(os.environ.pop(FD_ENV))
+    conn = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(fd)
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    while True:
+        try:
+            environ, body = _receive(conn)
+        except EOFError:
+            return
+        _send(conn, handle(application, environ, body))
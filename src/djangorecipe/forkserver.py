@@ -0,0 +1,468 @@
+"""Warm fork server for the ``bin/django`` management commands.
+
+Most of the time of a short management command goes into starting python,
+importing django and populating the app registry. With the ``forkserver``
+option, the first ``bin/django`` invocation starts a background server that
+does all that once and then waits on a unix socket. Later invocations
+connect and hand over their argv, working directory, environment and stdio
+file descriptors. The server forks a child that runs the command with them
+and reports its exit code back.
+
+The server only serves callers with the same settings module and
+environment (a server is started per combination) and retires as soon as
+any module it loaded or any management command directory changed on disk,
+so the next invocation starts a fresh one. It also stops after ``timeout``
+idle seconds. Whenever anything doesn't work out, the command simply runs
+in the calling process, as usual.
+
+Whoever can connect to the socket can run commands as its owner, so the
+socket directory must be ours and private, and both sides check the uid of
+the other end.
+
+"""
+import hashlib
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+
+# Set to 'serve' in the background server process, set it to '0' to not
+# use the fork server.
+ENVIRON = 'DJANGORECIPE_FORKSERVER'
+# Environment variables that don't influence the outcome of a command.
+VOLATILE_ENVIRON = ('_', 'OLDPWD', 'PWD', 'SHLVL', 'COLUMNS', 'LINES',
+                    'TERM', 'TERM_SESSION_ID', 'WINDOWID', 'SSH_CLIENT',
+                    'SSH_CONNECTION', 'SSH_TTY', 'TMUX_PANE', ENVIRON)
+# Long running commands with their own process management.
+NOT_FORKED = ('runserver', 'testserver')
+# Sun_path in sockaddr_un is 108 bytes on Linux, 104 on BSD.
+MAX_SOCKET_PATH = 100
+
+
+def supported():
+    return (hasattr(socket, 'AF_UNIX') and hasattr(os, 'fork') and
+            hasattr(socket.socket, 'sendmsg'))
+
+
+def socket_path(directory, settings):
+    """Return the socket for the settings and current environment."""
+    digest = hashlib.sha1()
+    for part in [settings, sys.executable] + sys.path + sorted(
+            '%s=%s' % item for item in os.environ.items()
+            if item[0] not in VOLATILE_ENVIRON):
+        digest.update(part.encode('utf-8', 'surrogateescape'))
+        digest.update(b'\0')
+    name = 'forkserver-%s.sock' % digest.hexdigest()[:16]
+    directory = os.path.join(directory, 'forkserver')
+    if len(os.path.join(directory, name)) > MAX_SOCKET_PATH:
+        directory = os.path.join(tempfile.gettempdir(),
+                                 'djangorecipe-%s' % os.getuid())
+    return os.path.join(directory, name)
+
+
+def secure_directory(directory):
+    """Create the socket directory, make sure only we have access to it.
+
+    Raises OSError for a directory that isn't ours: someone else could
+    replace our socket.
+
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise OSError("%s isn't a directory owned by us" % directory)
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        os.chmod(directory, 0o700)
+
+
+def _lock(address):
+    """Return the locked spawn lock file, or None when someone holds it."""
+    import fcntl
+    lock = open(address + '.lock', 'a')
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        lock.close()
+        return None
+    return lock
+
+
+def _peer_uid(conn):
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return os.getuid()
+    credentials = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                  struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+def _send(conn, message):
+    conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _read_messages(conn):
+    buffered = b''
+    while True:
+        data = conn.recv(4096)
+        if not data:
+            return
+        buffered += data
+        while b'\n' in buffered:
+            line, buffered = buffered.split(b'\n', 1)
+            yield json.loads(line.decode('utf-8'))
+
+
+# Client side.
+
+def start_server(address):
+    """Start a server for ``address`` in the background.
+
+    Not when a server is being started already: warming up takes a while
+    and every invocation in the meantime would start another one.
+
+    """
+    lock = _lock(address)
+    if lock is None:
+        return
+    lock.close()
+    env = dict(os.environ)
+    env[ENVIRON] = 'serve'
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen([sys.executable, os.path.abspath(sys.argv[0])],
+                         env=env, stdin=devnull, stdout=devnull,
+                         stderr=devnull, close_fds=True,
+                         preexec_fn=os.setsid)
+
+
+def _stdio_fds():
+    """Return the stdio file descriptors to hand over, or None.
+
+    None when one of them is closed or isn't backed by a file descriptor
+    (cron jobs, captured output in tests).
+
+    """
+    try:
+        fds = [stream.fileno()
+               for stream in (sys.stdin, sys.stdout, sys.stderr)]
+        for fd in fds:
+            os.fstat(fd)
+    except (AttributeError, ValueError, OSError):
+        return None
+    return fds
+
+
+def run(directory, settings, argv):
+    """Run the command in a forked server child, return its exit code.
+
+    Returns None when the command has to run in this process: when the
+    server isn't up (yet), is outdated, or can't handle the command.
+
+    """
+    if (os.environ.get(ENVIRON) == '0' or not supported() or
+            (len(argv) > 1 and argv[1] in NOT_FORKED) or
+            os.environ.get('DJANGO_SETTINGS_MODULE', settings) != settings):
+        return None
+    fds = _stdio_fds()
+    if fds is None:
+        return None
+    address = socket_path(directory, settings)
+    try:
+        secure_directory(os.path.dirname(address))
+    except OSError:
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(address)
+    except socket.error:
+        conn.close()
+        start_server(address)
+        return None
+    try:
+        if _peer_uid(conn) != os.getuid():
+            return None
+        return _request(conn, address, argv, fds)
+    finally:
+        conn.close()
+
+
+def _request(conn, address, argv, fds):
+    request = json.dumps({'argv': argv, 'cwd': os.getcwd(),
+                          'environ': dict(os.environ)}).encode('utf-8')
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        conn.sendmsg([struct.pack('!I', len(request)) + request],
+                     [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                       struct.pack('3i', *fds))])
+    except socket.error:
+        # The server is stopping.
+        return None
+    child = []
+
+    def forward(signum, frame):
+        if child:
+            os.kill(child[0], signum)
+
+    handlers = dict((signum, signal.signal(signum, forward))
+                    for signum in (signal.SIGINT, signal.SIGTERM))
+    try:
+        for message in _read_messages(conn):
+            if message.get('stale'):
+                start_server(address)
+                return None
+            if 'pid' in message:
+                child.append(message['pid'])
+            if 'exit' in message:
+                return message['exit']
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    if not child:
+        # The server went away before it forked: it was probably stopping.
+        return None
+    sys.stderr.write("The forked management command died.\n")
+    return 1
+
+
+# Server side.
+
+def source_files():
+    """Return {filename: mtime} for every loaded module."""
+    files = {}
+    for module in list(sys.modules.values()):
+        filename = getattr(module, '__file__', None)
+        if not filename:
+            continue
+        if filename.endswith(('.pyc', '.pyo')):
+            filename = filename[:-1]
+        try:
+            files[filename] = os.path.getmtime(filename)
+        except OSError:
+            continue
+    return files
+
+
+def command_listings():
+    """Return {directory: listing} for the management command directories.
+
+    A command that is added or removed doesn't change any loaded module.
+
+    """
+    from django.apps import apps
+    from django.core import management
+    directories = [os.path.join(management.__path__[0], 'commands')]
+    directories.extend(
+        os.path.join(app_config.path, 'management', 'commands')
+        for app_config in apps.get_app_configs())
+    listings = {}
+    for directory in directories:
+        try:
+            listings[directory] = sorted(os.listdir(directory))
+        except OSError:
+            listings[directory] = None
+    return listings
+
+
+def changed(files, listings=None):
+    for filename, mtime in files.items():
+        try:
+            if os.path.getmtime(filename) != mtime:
+                return True
+        except OSError:
+            return True
+    for directory, listing in (listings or {}).items():
+        try:
+            if sorted(os.listdir(directory)) != listing:
+                return True
+        except OSError:
+            if listing is not None:
+                return True
+    return False
+
+
+def warm_up():
+    """Import django, populate the app registry and load the commands."""
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+    from django.core import management
+    for name, app_name in management.get_commands().items():
+        try:
+            management.load_command_class(app_name, name)
+        except Exception:
+            # It'll fail (and say why) when it is actually run.
+            pass
+    from django.db import connections
+    for connection in connections.all():
+        connection.close()
+
+
+def _running(address):
+    """Return whether a server listens on ``address``.
+
+    Removes the socket when it was left behind by a server that died.
+
+    """
+    if not os.path.exists(address):
+        return False
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(address)
+    except socket.error:
+        os.remove(address)
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def _listen(address):
+    if _running(address):
+        raise RuntimeError("A server is running already")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(address)
+    listener.listen(16)
+    return listener
+
+
+def serve(directory, settings, timeout=900):
+    """Run the fork server until it's outdated or idle for too long."""
+    address = socket_path(directory, settings)
+    try:
+        secure_directory(os.path.dirname(address))
+    except OSError:
+        return 0
+    # Only one server warms up at a time, and not while another one is
+    # running already.
+    lock = _lock(address)
+    if lock is None:
+        return 0
+    try:
+        if _running(address):
+            return 0
+        os.environ.pop(ENVIRON, None)
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings)
+        warm_up()
+        files = source_files()
+        listings = command_listings()
+        try:
+            listener = _listen(address)
+        except (RuntimeError, socket.error, OSError):
+            return 0
+    finally:
+        lock.close()
+    listener.settimeout(timeout)
+    # Our children report to their caller, not to us.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                os.remove(address)
+                return 0
+            try:
+                if _peer_uid(conn) == os.getuid() and not _handle(
+                        conn, listener, files, listings, address):
+                    return 0
+            finally:
+                conn.close()
+    finally:
+        listener.close()
+
+
+def _receive_request(conn):
+    size = struct.calcsize('3i')
+    data, ancillary, flags, address = conn.recvmsg(
+        65536, socket.CMSG_LEN(size))
+    fds = []
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds = list(struct.unpack('3i', payload[:size]))
+    length = struct.unpack('!I', data[:4])[0]
+    data = data[4:]
+    while len(data) < length:
+        more = conn.recv(length - len(data))
+        if not more:
+            raise EOFError("Incomplete request")
+        data += more
+    return json.loads(data.decode('utf-8')), fds
+
+
+def _handle(conn, listener, files, listings, address):
+    """Fork a child for the request, return False when we're outdated."""
+    try:
+        request, fds = _receive_request(conn)
+    except (EOFError, ValueError, socket.error, struct.error):
+        return True
+    if len(fds) != 3 or changed(files, listings):
+        for fd in fds:
+            os.close(fd)
+        if len(fds) != 3:
+            return True
+        # Out of the way before the caller starts a new server.
+        os.remove(address)
+        _send(conn, {'stale': True})
+        return False
+    pid = os.fork()
+    if pid:
+        for fd in fds:
+            os.close(fd)
+        return True
+    try:
+        listener.close()
+        code = _child(conn, request, fds)
+    except BaseException:
+        code = 1
+    try:
+        _send(conn, {'exit': code})
+    finally:
+        os._exit(0)
+
+
+def _reopen_stdio(fds):
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    if sys.version_info[0] >= 3:
+        sys.stdin = sys.__stdin__ = open(0, 'r', closefd=False)
+        sys.stdout = sys.__stdout__ = open(1, 'w', closefd=False)
+        sys.stderr = sys.__stderr__ = open(2, 'w', closefd=False)
+
+
+def _child(conn, request, fds):
+    """Run the command, return its exit code."""
+    for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    _reopen_stdio(fds)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['environ'])
+    sys.argv = request['argv']
+    _send(conn, {'pid': os.getpid()})
+    from django.core import management
+    code = 0
+    try:
+        management.execute_from_command_line(sys.argv)
+    except SystemExit as e:
+        code = e.code
+    except KeyboardInterrupt:
+        code = 130
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        code = 1
+    if code is None:
+        code = 0
+    elif not isinstance(code, int):
+        sys.stderr.write('%s\n' % code)
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
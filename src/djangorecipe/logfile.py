@@ -0,0 +1,194 @@
+"""Buffered log file used as stdout/stderr replacement by the wsgi script.
+
+Lines are timestamped and collected in memory. A background thread writes
+them to the (single, kept open) log file in batches, either when the buffer
+grows beyond ``buffer_size`` bytes or every ``flush_interval`` seconds. The
+file can optionally be rotated once it grows beyond ``max_bytes`` or every
+``rotate_interval`` seconds.
+
+Threads don't survive ``fork()``: preforking servers (``bin/django-serve``,
+``gunicorn --preload``) load the application, and so the log file, before
+they fork the workers. A worker notices it's a new process and starts its
+own writer thread.
+
+"""
+import atexit
+import datetime
+import os
+import threading
+import time
+import weakref
+
+_instances = weakref.WeakSet()
+
+
+def _after_fork():
+    for log_file in list(_instances):
+        log_file._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class BufferedLogFile(object):
+    """File-like object that writes timestamped lines to ``logfile``."""
+
+    def __init__(self, logfile, buffer_size=8192, flush_interval=1.0,
+                 max_bytes=0, rotate_interval=0, backup_count=5):
+        self.logfile = logfile
+        self.buffer_size = int(buffer_size)
+        self.flush_interval = float(flush_interval)
+        self.max_bytes = int(max_bytes)
+        self.rotate_interval = float(rotate_interval)
+        self.backup_count = int(backup_count)
+
+        self._pid = os.getpid()
+        self._lines = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._fp = None
+        self._next_rotation = None
+        self._closed = False
+
+        # Formatting a timestamp is expensive compared to the rest of a
+        # write() call, so we only do it once per second.
+        self._timestamp_second = None
+        self._timestamp = ''
+
+        self._start()
+        _instances.add(self)
+        atexit.register(self.close)
+
+    def write(self, data):
+        self.log(data)
+
+    def writeline(self, data):
+        self.log(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.log(line)
+
+    def log(self, msg):
+        if self._pid != os.getpid():
+            # Forked without os.register_at_fork() (python 2).
+            self._after_fork()
+        now = time.time()
+        second = int(now)
+        with self._lock:
+            if second != self._timestamp_second:
+                self._timestamp_second = second
+                self._timestamp = datetime.datetime.fromtimestamp(
+                    second).strftime('%Y%m%d %H:%M:%S')
+            line = '%s - %s\n' % (self._timestamp, msg)
+            self._lines.append(line)
+            self._buffered += len(line)
+            if self._buffered >= self.buffer_size:
+                self._wakeup.notify()
+
+    def flush(self):
+        if self._pid != os.getpid():
+            self._after_fork()
+        with self._lock:
+            lines = self._take_lines()
+        self._write(lines)
+
+    def close(self):
+        if self._closed:
+            return
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join(self.flush_interval + 1)
+        self.flush()
+        with self._write_lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+    def isatty(self):
+        return False
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='djangorecipe-logfile')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _after_fork(self):
+        """Start over in a forked child: new locks and writer thread.
+
+        The parent's locks may have been held by its writer thread at the
+        time of the fork. Its buffered lines are the parent's to write.
+
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._lines = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if not self._closed:
+            self._start()
+
+    def _take_lines(self):
+        # Must be called with self._lock held.
+        lines = self._lines
+        self._lines = []
+        self._buffered = 0
+        return lines
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._buffered < self.buffer_size and not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                closed = self._closed
+                lines = self._take_lines()
+            self._write(lines)
+            if closed:
+                return
+
+    def _write(self, lines):
+        if not lines:
+            return
+        with self._write_lock:
+            if self._fp is None:
+                self._open()
+            elif self._should_rotate():
+                self._rotate()
+            self._fp.write(''.join(lines))
+            self._fp.flush()
+            if self.max_bytes and self._fp.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _open(self):
+        self._fp = open(self.logfile, 'a')
+        if self.rotate_interval:
+            self._next_rotation = time.time() + self.rotate_interval
+
+    def _should_rotate(self):
+        return (self._next_rotation is not None and
+                time.time() >= self._next_rotation)
+
+    def _rotate(self):
+        # Same naming scheme as logging.handlers.RotatingFileHandler:
+        # logfile.1 is the most recent backup.
+        self._fp.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = '%s.%d' % (self.logfile, index)
+                if os.path.exists(source):
+                    os.rename(source, '%s.%d' % (self.logfile, index + 1))
+            os.rename(self.logfile, self.logfile + '.1')
+        else:
+            os.remove(self.logfile)
+        self._open()
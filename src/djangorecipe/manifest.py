@@ -0,0 +1,58 @@
+"""Manifest of the files a part generated.
+
+The manifest records a hash of the recipe's inputs and the sha1 of every
+generated file. When neither changed, ``Recipe.update`` doesn't need to
+resolve the working set or render any script.
+
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+
+def file_hash(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def _load(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get('version') != MANIFEST_VERSION:
+            return None
+        return data
+
+    def matches(self, inputs):
+        """Return True if the inputs and all generated files are unchanged."""
+        data = self._load()
+        if data is None or data['inputs'] != inputs:
+            return False
+        for filename, sha1 in data['files'].items():
+            if not os.path.isfile(filename) or file_hash(filename) != sha1:
+                return False
+        return True
+
+    def write(self, inputs, filenames):
+        files = dict((filename, file_hash(filename))
+                     for filename in filenames if os.path.isfile(filename))
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.filename, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION,
+                       'inputs': inputs,
+                       'files': files},
+                      f, indent=1, sort_keys=True)
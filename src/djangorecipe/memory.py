@@ -0,0 +1,145 @@
+"""Memory snapshots of a running process, taken on a signal.
+
+``install()`` starts tracemalloc and a handler for the signal. Every time
+the process receives it, a report is written to the directory: the top
+allocation sites by file and line, compared to the previous snapshot (or
+to nothing, for the first), followed by the number of objects per type and
+how that changed. Send the signal twice some time apart to see what grows
+in between.
+
+tracemalloc slows down allocations, so nothing of this happens unless the
+scripts are told to install it.
+
+"""
+import collections
+import gc
+import os
+import signal
+import sys
+import time
+import tracemalloc
+
+# Allocation sites and types in a report.
+TOP = 50
+
+
+class Snapshots(object):
+    """Writes the reports, remembering the previous snapshot."""
+
+    def __init__(self, directory, frames=1, top=TOP):
+        self.directory = directory
+        # With more frames, a site is the whole call stack.
+        self.key_type = frames > 1 and 'traceback' or 'lineno'
+        self.top = top
+        self.previous = None
+        self.previous_counts = {}
+
+    def take(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+        counts = collections.Counter(
+            _type_name(obj) for obj in gc.get_objects())
+        return snapshot, counts
+
+    def report(self, snapshot, counts):
+        """Return the report lines."""
+        current, peak = tracemalloc.get_traced_memory()
+        lines = ['Memory snapshot of process %s at %s' % (
+                     os.getpid(), time.strftime('%Y-%m-%d %H:%M:%S')),
+                 'Traced: %s, peak %s' % (_size(current), _size(peak)),
+                 '']
+        if self.previous is None:
+            lines.append('Top %s allocation sites:' % self.top)
+            for stat in snapshot.statistics(self.key_type)[:self.top]:
+                lines.append('%10s %8d blocks  %s' % (
+                    _size(stat.size), stat.count, _site(stat.traceback)))
+                lines.extend(_callers(stat.traceback))
+        else:
+            lines.append('Top %s allocation sites, change since the previous '
+                         'snapshot:' % self.top)
+            for stat in snapshot.compare_to(self.previous,
+                                            self.key_type)[:self.top]:
+                lines.append('%10s %11s %8d blocks %+8d  %s' % (
+                    _size(stat.size), _size(stat.size_diff, sign=True),
+                    stat.count, stat.count_diff, _site(stat.traceback)))
+                lines.extend(_callers(stat.traceback))
+        lines.extend(['', 'Objects by type:'])
+        changes = sorted(
+            counts, key=lambda name: (
+                -abs(counts[name] - self.previous_counts.get(name, 0)),
+                -counts[name], name))
+        for name in changes[:self.top]:
+            lines.append('%10d %+9d  %s' % (
+                counts[name], counts[name] - self.previous_counts.get(name, 0),
+                name))
+        return lines
+
+    def write(self):
+        """Take a snapshot and write its report, return the filename."""
+        snapshot, counts = self.take()
+        lines = self.report(snapshot, counts)
+        self.previous, self.previous_counts = snapshot, counts
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        filename = os.path.join(self.directory, 'memory-%s-%s.txt' % (
+            os.getpid(), time.strftime('%Y%m%dT%H%M%S')))
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return filename
+
+
+def _type_name(obj):
+    cls = type(obj)
+    module = getattr(cls, '__module__', None)
+    if module in (None, 'builtins'):
+        return cls.__name__
+    return '%s.%s' % (module, cls.__name__)
+
+
+def _site(traceback):
+    # The most recent frame, where the memory was allocated.
+    frame = traceback[-1]
+    return '%s:%s' % (frame.filename, frame.lineno)
+
+
+def _callers(traceback):
+    return ['%34s called from %s:%s' % ('', frame.filename, frame.lineno)
+            for frame in reversed(traceback[:-1])]
+
+
+def _size(size, sign=False):
+    number = sign and '%+d' or '%d'
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return (number + ' %s') % (size, unit)
+        size /= 1024.0
+    return (sign and '%+.1f GiB' or '%.1f GiB') % size
+
+
+def install(directory, frames=1, signum=signal.SIGUSR2):
+    """Start tracing, write a report when the process gets ``signum``.
+
+    ``frames`` is the number of frames tracemalloc keeps per allocation.
+    With more than one, the report groups by the whole call stack.
+
+    """
+    snapshots = Snapshots(directory, frames)
+
+    def handler(signum, frame):
+        try:
+            snapshots.write()
+        except Exception as e:
+            sys.stderr.write("Can't write a memory snapshot: %s\n" % e)
+
+    try:
+        signal.signal(signum, handler)
+    except ValueError:
+        # Not in the main thread, the wsgi server imported us elsewhere.
+        sys.stderr.write("Can't handle signal %s for memory snapshots in "
+                         "this thread.\n" % signum)
+        return None
+    tracemalloc.start(frames)
+    return snapshots
@@ -0,0 +1,345 @@
+"""Request metrics for the wsgi application, in a memory mapped file.
+
+``instrument()`` wraps the application. Every request counts towards its
+view (the resolved url name) and status class, and its duration towards a
+latency histogram. The numbers are kept in a memory mapped file that all
+processes serving the application share: every process claims a region of
+its own, so they never have to lock each other out. An update is a few
+in-place integer increments.
+
+``render()`` adds up the regions and returns the metrics in the Prometheus
+text exposition format. The wrapper serves that at a url for local
+clients, ``python -m djangorecipe.metrics <file>`` prints it.
+
+"""
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'DRMETRIC'
+VERSION = 1
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+# File header: magic, version, regions, slots per region.
+HEADER = struct.Struct('8sQQQ')
+# The file is made of 8 byte units: unsigned integers, and floats for the
+# duration sums. struct works on python 2, memoryview.cast() doesn't.
+UNIT = struct.Struct('Q')
+FLOAT = struct.Struct('d')
+NAME_SIZE = 64
+# A slot, in 8 byte units: the view name, the counts per status class and
+# per histogram bucket (plus one for slower requests), the duration sum.
+NAME_UNITS = NAME_SIZE // 8
+STATUS_OFFSET = NAME_UNITS
+BUCKET_OFFSET = STATUS_OFFSET + len(STATUS_CLASSES)
+SUM_OFFSET = BUCKET_OFFSET + len(BUCKETS) + 1
+SLOT_UNITS = SUM_OFFSET + 1
+# A region starts with the pid of the process that owns it.
+REGION_HEADER_UNITS = 1
+# The environ key the view name is passed in.
+VIEW_KEY = 'djangorecipe.view'
+UNRESOLVED = '<unresolved>'
+OTHER = '<other>'
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+# A reverse proxy on the local host makes every request local, but it tells
+# where the request came from in one of these.
+PROXY_HEADERS = ('HTTP_X_FORWARDED_FOR', 'HTTP_FORWARDED', 'HTTP_X_REAL_IP')
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def _region_units(slots):
+    return REGION_HEADER_UNITS + slots * SLOT_UNITS
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != 3  # ESRCH
+    return True
+
+
+class MetricsFile(object):
+    """The memory mapped metrics file.
+
+    ``regions`` is the number of processes that can write to it at the same
+    time, ``slots`` the number of views per process.
+
+    """
+
+    def __init__(self, filename, regions=64, slots=256):
+        self.filename = filename
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                header = os.read(fd, HEADER.size)
+                if len(header) == HEADER.size:
+                    magic, version, file_regions, file_slots = (
+                        HEADER.unpack(header))
+                    if magic == MAGIC and version == VERSION:
+                        regions, slots = file_regions, file_slots
+                    else:
+                        header = b''
+                if len(header) != HEADER.size:
+                    size = (HEADER.size +
+                            regions * _region_units(slots) * 8)
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.write(fd, HEADER.pack(MAGIC, VERSION, regions, slots))
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self.regions = regions
+            self.slots = slots
+            self.mmap = mmap.mmap(fd, HEADER.size +
+                                  regions * _region_units(slots) * 8)
+        finally:
+            os.close(fd)
+
+    def unit(self, offset):
+        return UNIT.unpack_from(self.mmap, HEADER.size + offset * 8)[0]
+
+    def set_unit(self, offset, value):
+        UNIT.pack_into(self.mmap, HEADER.size + offset * 8, value)
+
+    def add(self, offset, value=1):
+        self.set_unit(offset, self.unit(offset) + value)
+
+    def float_unit(self, offset):
+        return FLOAT.unpack_from(self.mmap, HEADER.size + offset * 8)[0]
+
+    def add_float(self, offset, value):
+        FLOAT.pack_into(self.mmap, HEADER.size + offset * 8,
+                        self.float_unit(offset) + value)
+
+    def region_offset(self, region):
+        return region * _region_units(self.slots)
+
+    def slot_offset(self, region, slot):
+        return (self.region_offset(region) + REGION_HEADER_UNITS +
+                slot * SLOT_UNITS)
+
+    def name(self, offset):
+        start = HEADER.size + offset * 8
+        raw = self.mmap[start:start + NAME_SIZE].rstrip(b'\0')
+        return raw.decode('utf-8', 'replace')
+
+    def set_name(self, offset, name):
+        data = name.encode('utf-8')[:NAME_SIZE]
+        start = HEADER.size + offset * 8
+        self.mmap[start:start + NAME_SIZE] = data.ljust(NAME_SIZE, b'\0')
+
+    def claim_region(self, pid):
+        """Return a region for the process: its own, a free or a dead one.
+
+        The counts of a dead process are continued, so the totals never go
+        down. Returns None when all regions are in use.
+
+        """
+        with open(self.filename, 'rb') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            owners = [self.unit(self.region_offset(region))
+                      for region in range(self.regions)]
+            for candidates in (
+                    [region for region, owner in enumerate(owners)
+                     if owner == pid],
+                    [region for region, owner in enumerate(owners)
+                     if not owner],
+                    [region for region, owner in enumerate(owners)
+                     if not _pid_alive(owner)]):
+                if candidates:
+                    region = candidates[0]
+                    self.set_unit(self.region_offset(region), pid)
+                    return region
+        return None
+
+    def views(self, region):
+        """Return {view name: slot} of the used slots in the region."""
+        views = {}
+        for slot in range(self.slots):
+            name = self.name(self.slot_offset(region, slot))
+            if name:
+                views.setdefault(name, slot)
+        return views
+
+    def close(self):
+        self.mmap.close()
+
+
+class Recorder(object):
+    """Records requests in this process' region of the metrics file."""
+
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self.kwargs = kwargs
+        self.file = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _claim(self):
+        # In a forked worker, the region of the parent isn't ours.
+        if self.file is None:
+            self.file = MetricsFile(self.filename, **self.kwargs)
+        self.pid = os.getpid()
+        self.region = self.file.claim_region(self.pid)
+        self.offsets = {}
+        if self.region is not None:
+            self.offsets = dict(
+                (name, self.file.slot_offset(self.region, slot))
+                for name, slot in self.file.views(self.region).items())
+
+    def _offset(self, view):
+        offset = self.offsets.get(view)
+        if offset is not None:
+            return offset
+        used = len(self.offsets)
+        if used >= self.file.slots - 1 and view != OTHER:
+            # The last slot is for everything that doesn't fit.
+            return self._offset(OTHER)
+        offset = self.file.slot_offset(self.region, used)
+        self.file.set_name(offset, view)
+        self.offsets[view] = offset
+        return offset
+
+    def record(self, view, status, duration):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._claim()
+            if self.region is None:
+                return
+            offset = self._offset(view)
+            status_class = min(max(status // 100, 1), 5) - 1
+            self.file.add(offset + STATUS_OFFSET + status_class)
+            self.file.add(offset + BUCKET_OFFSET +
+                          bisect.bisect_left(BUCKETS, duration))
+            self.file.add_float(offset + SUM_OFFSET, duration)
+
+
+def collect(filename):
+    """Return {view: (status counts, bucket counts, duration sum)}."""
+    metrics = MetricsFile(filename)
+    try:
+        totals = {}
+        for region in range(metrics.regions):
+            if not metrics.unit(metrics.region_offset(region)):
+                continue
+            for name, slot in metrics.views(region).items():
+                offset = metrics.slot_offset(region, slot)
+                statuses, buckets, total = totals.get(
+                    name, ([0] * len(STATUS_CLASSES),
+                           [0] * (len(BUCKETS) + 1), 0.0))
+                for i in range(len(statuses)):
+                    statuses[i] += metrics.unit(offset + STATUS_OFFSET + i)
+                for i in range(len(buckets)):
+                    buckets[i] += metrics.unit(offset + BUCKET_OFFSET + i)
+                total += metrics.float_unit(offset + SUM_OFFSET)
+                totals[name] = (statuses, buckets, total)
+        return totals
+    finally:
+        metrics.close()
+
+
+def _label(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def render(filename):
+    """Return the metrics in the Prometheus text exposition format."""
+    totals = collect(filename)
+    lines = ['# HELP django_requests_total Requests by view and status '
+             'class.',
+             '# TYPE django_requests_total counter']
+    for view in sorted(totals):
+        statuses = totals[view][0]
+        for status_class, count in zip(STATUS_CLASSES, statuses):
+            if count:
+                lines.append('django_requests_total{view="%s",status="%s"} '
+                             '%d' % (_label(view), status_class, count))
+    lines.extend(['# HELP django_request_duration_seconds Request duration '
+                  'by view.',
+                  '# TYPE django_request_duration_seconds histogram'])
+    for view in sorted(totals):
+        _, buckets, total = totals[view]
+        label = _label(view)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), buckets):
+            cumulative += count
+            lines.append(
+                'django_request_duration_seconds_bucket{view="%s",le="%s"} '
+                '%d' % (label, bound, cumulative))
+        lines.append('django_request_duration_seconds_sum{view="%s"} %r'
+                     % (label, total))
+        lines.append('django_request_duration_seconds_count{view="%s"} %d'
+                     % (label, cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def _hook_view_names(application):
+    """Have django's handler put the view name in the environ."""
+    get_response = getattr(application, 'get_response', None)
+    if get_response is None:
+        return
+
+    def get_response_with_view(request):
+        response = get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        request.environ[VIEW_KEY] = match and match.view_name or UNRESOLVED
+        return response
+
+    application.get_response = get_response_with_view
+
+
+def is_local(environ):
+    """Return whether the request comes from the local host, not a proxy."""
+    return (environ.get('REMOTE_ADDR') in LOCAL_ADDRESSES and
+            not any(header in environ for header in PROXY_HEADERS))
+
+
+def instrument(application, filename, url=None):
+    """Return the application, recording metrics in ``filename``.
+
+    With ``url``, the metrics are served at that path to clients on the
+    local host that don't come through a proxy.
+
+    """
+    recorder = Recorder(filename)
+    _hook_view_names(application)
+
+    def instrumented(environ, start_response):
+        if url and environ.get('PATH_INFO') == url and is_local(environ):
+            start_response('200 OK', [
+                ('Content-Type', 'text/plain; version=0.0.4')])
+            return [render(filename).encode('utf-8')]
+        start = timer()
+        statuses = []
+
+        def recording_start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            return start_response(status, headers, exc_info)
+
+        try:
+            return application(environ, recording_start_response)
+        finally:
+            try:
+                status = int(statuses[-1][:3])
+            except (IndexError, ValueError):
+                status = 500
+            recorder.record(environ.get(VIEW_KEY, UNRESOLVED), status,
+                            timer() - start)
+
+    return instrumented
+
+
+if __name__ == '__main__':
+    sys.stdout.write(render(sys.argv[1]))
@@ -0,0 +1,157 @@
+"""Module location index for the generated scripts.
+
+The scripts prepend every egg of the working set to ``sys.path``. Each
+top-level import then probes every one of those directories in turn. At
+install time the recipe writes an index that maps every top-level module or
+package to the egg directory (or directories, for namespace packages) that
+provide it. ``install()`` puts a finder in front of the regular path based
+one that only looks in those directories. Everything that isn't in the index
+(or isn't found where the index says it is) falls back to the regular
+``sys.path`` scan.
+
+"""
+import json
+import os
+import sys
+
+INDEX_VERSION = 1
+
+
+def build_index(working_set):
+    """Return a {top level name: [locations]} dict for the working set.
+
+    Names provided by more than one distribution (namespace packages like
+    ``zc``) list every location, in working set order.
+
+    """
+    modules = {}
+    for dist in working_set:
+        location = dist.location
+        if not location:
+            continue
+        for name in top_level_names(dist):
+            locations = modules.setdefault(name, [])
+            if location not in locations:
+                locations.append(location)
+    return modules
+
+
+def top_level_names(dist):
+    """Return the top level modules and packages a distribution provides."""
+    try:
+        if dist.has_metadata('top_level.txt'):
+            return [line.strip() for line in
+                    dist.get_metadata_lines('top_level.txt')
+                    if line.strip() and '/' not in line]
+    except (IOError, OSError):
+        pass
+    # No metadata: look at what's actually there.
+    location = dist.location
+    if not os.path.isdir(location):
+        return []
+    names = []
+    for entry in sorted(os.listdir(location)):
+        full = os.path.join(location, entry)
+        if os.path.isdir(full):
+            if os.path.exists(os.path.join(full, '__init__.py')):
+                names.append(entry)
+        elif entry.endswith(('.py', '.pyc', '.so', '.pyd')):
+            name = entry.split('.')[0]
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def write_index(filename, working_set, relative_to=None):
+    """Write the index for the working set, return True if it changed.
+
+    With ``relative_to`` (the relative-paths base directory) locations below
+    that directory are stored relative to the index file itself.
+
+    """
+    modules = build_index(working_set)
+    if relative_to:
+        index_dir = os.path.dirname(os.path.abspath(filename))
+        relative_to = os.path.join(os.path.abspath(relative_to), '')
+        for name, locations in modules.items():
+            modules[name] = [
+                os.path.relpath(location, index_dir)
+                if os.path.abspath(location).startswith(relative_to)
+                else location
+                for location in locations]
+    contents = json.dumps({'version': INDEX_VERSION,
+                           'modules': modules},
+                          indent=1, sort_keys=True)
+    if os.path.exists(filename):
+        with open(filename) as f:
+            if f.read() == contents:
+                return False
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(filename, 'w') as f:
+        f.write(contents)
+    return True
+
+
+def load_index(filename):
+    """Return the {name: [absolute locations]} dict, None when unusable."""
+    try:
+        with open(filename) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+        return None
+    index_dir = os.path.dirname(os.path.abspath(filename))
+    return dict(
+        (name, [os.path.join(index_dir, location) for location in locations])
+        for name, locations in data['modules'].items())
+
+
+class IndexFinder(object):
+    """Meta path finder that resolves top level imports through the index."""
+
+    def __init__(self, modules):
+        self.modules = modules
+
+    def find_spec(self, fullname, path=None, target=None):
+        if path is not None:
+            # Submodules are found through their parent package's __path__.
+            return None
+        locations = self.modules.get(fullname)
+        if not locations:
+            return None
+        from importlib.machinery import PathFinder
+        return PathFinder.find_spec(fullname, locations, target)
+
+    def invalidate_caches(self):
+        pass
+
+
+def install(filename):
+    """Install an IndexFinder for the index file, if possible.
+
+    Nothing happens (and imports simply use ``sys.path``) when the index is
+    missing or unreadable or the interpreter has no ``find_spec`` support.
+
+    """
+    try:
+        from importlib.machinery import PathFinder
+    except ImportError:
+        return None
+    if not hasattr(PathFinder, 'find_spec'):
+        return None
+    modules = load_index(filename)
+    if modules is None:
+        return None
+    finder = IndexFinder(modules)
+    # Builtin and frozen modules keep precedence, just like they do for the
+    # regular sys.path scan.
+    position = len(sys.meta_path)
+    for i, existing in enumerate(sys.meta_path):
+        if existing is PathFinder:
+            position = i
+            break
+    sys.meta_path.insert(position, finder)
+    return finder
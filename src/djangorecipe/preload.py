@@ -0,0 +1,242 @@
+"""Warm-up of a freshly loaded django application.
+
+Without it, the first requests to a new process pay for resolving the
+URLconf, importing views, compiling templates and connecting to the
+database. ``warm_up()`` does all that up front and logs how long each phase
+took to the ``djangorecipe.preload`` logger. Afterwards, everything that
+has been loaded is moved out of reach of the garbage collector with
+``gc.freeze()`` (where available), so forked workers don't touch (and thus
+copy) those memory pages when collecting.
+
+"""
+import gc
+import logging
+import os
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from urlparse import urlsplit
+
+logger = logging.getLogger('djangorecipe.preload')
+
+
+def load_urls():
+    try:
+        from django.urls import get_resolver
+    except ImportError:  # Django < 1.10
+        from django.core.urlresolvers import get_resolver
+    resolver = get_resolver()
+    # Populating the reverse dict imports every included URLconf.
+    resolver.reverse_dict
+    return len(resolver.url_patterns)
+
+
+def import_views():
+    from importlib import import_module
+    from django.apps import apps
+    from django.utils.module_loading import module_has_submodule
+    count = 0
+    for app_config in apps.get_app_configs():
+        if module_has_submodule(app_config.module, 'views'):
+            import_module('%s.views' % app_config.name)
+            count += 1
+    return count
+
+
+def compile_templates():
+    from django.template import engines
+    count = 0
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            directory = str(directory)
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [name for name in dirs if not name.startswith('.')]
+                for filename in files:
+                    if filename.startswith('.'):
+                        continue
+                    name = os.path.relpath(os.path.join(root, filename),
+                                           directory)
+                    try:
+                        engine.get_template(name.replace(os.path.sep, '/'))
+                    except Exception:
+                        # Not a template (or a broken one): rendering it
+                        # would fail later anyway.
+                        logger.debug("Couldn't compile template %s", name)
+                        continue
+                    count += 1
+    return count
+
+
+def connect_databases():
+    """Connect to every database, then close the connections again.
+
+    Connecting imports the database backends and checks the settings. The
+    connections are closed so that forked workers don't share them.
+
+    """
+    from django.db import connections
+    count = 0
+    for alias in connections:
+        connection = connections[alias]
+        connection.ensure_connection()
+        connection.close()
+        count += 1
+    return count
+
+
+def close_connections():
+    """Close the connections the warm-up requests opened.
+
+    Like the ones of ``connect_databases()``, forked workers mustn't share
+    them.
+
+    """
+    from django.db import connections
+    if hasattr(connections, 'close_all'):
+        connections.close_all()
+    else:  # Django < 2.2
+        for connection in connections.all():
+            connection.close()
+
+
+def send_requests(application, urls):
+    """Send a GET request to every url through the wsgi application.
+
+    A url can be a path (``/some/page/``) or a full url
+    (``http://example.com/some/page/``) to set the Host header.
+
+    """
+    from wsgiref.util import setup_testing_defaults
+    statuses = []
+    for url in urls:
+        parts = urlsplit(url)
+        environ = {'REQUEST_METHOD': 'GET',
+                   'PATH_INFO': parts.path or '/',
+                   'QUERY_STRING': parts.query}
+        if parts.netloc:
+            environ['HTTP_HOST'] = parts.netloc
+            environ['wsgi.url_scheme'] = parts.scheme or 'http'
+        setup_testing_defaults(environ)
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(status)
+
+        response = application(environ, start_response)
+        try:
+            for chunk in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        logger.info("Warm-up request %s: %s", url, statuses[-1])
+    return len(urls)
+
+
+def send_asgi_requests(application, urls):
+    """Send a GET request to every url through the asgi application.
+
+    The requests run in a new event loop, so this only works before the
+    asgi server starts its own. Servers that import the application from
+    their running loop (``uvicorn --reload`` or ``--factory``) don't get
+    the requests.
+
+    """
+    import asyncio
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        logger.warning("Skipping the warm-up requests: the asgi server's "
+                       "event loop is running already")
+        return 0
+    loop = asyncio.new_event_loop()
+
+    def done(result):
+        # Plain functions returning futures instead of coroutines keep this
+        # module importable on python 2.
+        future = loop.create_future()
+        future.set_result(result)
+        return future
+
+    try:
+        for url in urls:
+            parts = urlsplit(url)
+            host = parts.netloc or 'testserver'
+            scope = {'type': 'http', 'asgi': {'version': '3.0'},
+                     'http_version': '1.1', 'method': 'GET',
+                     'scheme': parts.scheme or 'http',
+                     'path': parts.path or '/', 'raw_path': b'',
+                     'query_string': parts.query.encode('latin-1'),
+                     'root_path': '',
+                     'headers': [(b'host', host.encode('latin-1'))],
+                     'client': ('127.0.0.1', 0),
+                     'server': (host.split(':')[0], 80)}
+            statuses = []
+            requests = [{'type': 'http.request', 'body': b'',
+                         'more_body': False}]
+            # Django listens for a disconnect after the request: that comes
+            # once the whole response has been sent.
+            disconnect = loop.create_future()
+
+            def receive():
+                if requests:
+                    return done(requests.pop())
+                return disconnect
+
+            def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif (message['type'] == 'http.response.body' and
+                        not message.get('more_body') and
+                        not disconnect.done()):
+                    disconnect.set_result({'type': 'http.disconnect'})
+                return done(None)
+
+            loop.run_until_complete(application(scope, receive, send))
+            logger.info("Warm-up request %s: %s", url,
+                        statuses and statuses[0])
+    finally:
+        loop.close()
+    return len(urls)
+
+
+def warm_up(application, urls=(), send=None):
+    """Run all warm-up phases, return [(phase, seconds)].
+
+    ``send`` sends the warm-up requests: ``send_requests`` (the default)
+    for wsgi, ``send_asgi_requests`` for asgi applications. A failing phase
+    is logged and doesn't stop the others: the application works without
+    the warm-up, just slower on the first requests.
+
+    """
+    phases = [('urls', load_urls),
+              ('views', import_views),
+              ('templates', compile_templates),
+              ('databases', connect_databases)]
+    if urls:
+        send = send or send_requests
+        phases.append(('requests', lambda: send(application, urls)))
+    timings = []
+    for name, function in phases:
+        start = time.time()
+        try:
+            count = function()
+        except Exception:
+            logger.exception("Warm-up phase %s failed", name)
+            continue
+        duration = time.time() - start
+        timings.append((name, duration))
+        logger.info("Warm-up phase %s: %s loaded in %.3fs",
+                    name, count, duration)
+    if urls:
+        try:
+            close_connections()
+        except Exception:
+            logger.exception("Closing the database connections failed")
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+    return timings
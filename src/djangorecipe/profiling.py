@@ -0,0 +1,155 @@
+"""Profile a sample of the requests to the wsgi application.
+
+``sample()`` wraps the application. One in ``every`` requests is run under
+cProfile and its profile written as a pstats file, named after the url and
+the time, to a directory that keeps the ``keep`` most recent profiles. With
+``match`` patterns, only the requests matching one of them are candidates.
+Requests that aren't sampled only cost a counter increment (and the pattern
+matching); nothing is profiled for them.
+
+Load a profile with ``python -m pstats <file>`` or a viewer like snakeviz.
+
+"""
+import cProfile
+import itertools
+import os
+import re
+import threading
+import time
+
+SUFFIX = '.prof'
+# Longest url part of a profile's filename.
+MAX_NAME = 80
+
+
+def parse_match(lines):
+    """Return [(environ key, regex)] for the match pattern lines.
+
+    A line starting with ``/`` is a regular expression for the start of the
+    path, ``Header: regex`` one for the value of a request header.
+
+    """
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('/'):
+            key, pattern = 'PATH_INFO', line
+        elif ':' in line:
+            header, pattern = line.split(':', 1)
+            key = 'HTTP_' + header.strip().upper().replace('-', '_')
+            pattern = pattern.strip()
+        else:
+            raise ValueError("Not a path or header pattern: %r" % line)
+        try:
+            patterns.append((key, re.compile(pattern)))
+        except re.error as e:
+            raise ValueError("Invalid pattern %r: %s" % (pattern, e))
+    return patterns
+
+
+def matches(patterns, environ):
+    for key, regex in patterns:
+        value = environ.get(key)
+        if value is None:
+            continue
+        if key == 'PATH_INFO':
+            if regex.match(value):
+                return True
+        elif regex.search(value):
+            return True
+    return False
+
+
+def profile_name(environ, now=None):
+    """Return the filename for the request's profile, without directory."""
+    path = environ.get('PATH_INFO', '') or '/'
+    name = re.sub(r'[^A-Za-z0-9.-]+', '_', path).strip('_') or 'root'
+    now = time.time() if now is None else now
+    return '%s.%s.%s.%06d%s' % (
+        environ.get('REQUEST_METHOD', 'GET'), name[:MAX_NAME],
+        time.strftime('%Y%m%dT%H%M%S', time.localtime(now)),
+        int(now % 1 * 1000000), SUFFIX)
+
+
+class ProfileRing(object):
+    """A directory keeping the ``keep`` most recent profiles."""
+
+    def __init__(self, directory, keep=100):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, profile, name):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Another process made it.
+                pass
+        filename = os.path.join(self.directory, name)
+        # Don't let anyone load half a profile.
+        tmp = '%s.%s.tmp' % (filename, os.getpid())
+        profile.dump_stats(tmp)
+        os.rename(tmp, filename)
+        self.evict()
+        return filename
+
+    def evict(self):
+        """Remove the oldest profiles beyond ``keep``."""
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                profiles.append((os.path.getmtime(filename), name, filename))
+            except OSError:
+                # Evicted by another process.
+                continue
+        profiles.sort()
+        for _, _, filename in profiles[:max(len(profiles) - self.keep, 0)]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+
+def sample(application, directory, every=100, match=(), keep=100):
+    """Return the application, profiling one in ``every`` requests.
+
+    ``match`` is a list of pattern lines (see ``parse_match()``).
+
+    """
+    ring = ProfileRing(directory, keep)
+    patterns = parse_match(match)
+    counter = itertools.count(1)
+    # Only one profiler can be active at a time, concurrent requests that
+    # are sampled while a profile runs just aren't profiled.
+    running = threading.Lock()
+
+    def profiled(environ, start_response):
+        if patterns and not matches(patterns, environ):
+            return application(environ, start_response)
+        if next(counter) % every or not running.acquire(False):
+            return application(environ, start_response)
+        try:
+            profile = cProfile.Profile()
+            name = profile_name(environ)
+            profile.enable()
+            try:
+                # django renders the response in there, except for
+                # streaming responses.
+                return application(environ, start_response)
+            finally:
+                profile.disable()
+                try:
+                    ring.save(profile, name)
+                except (OSError, IOError) as e:
+                    # The request was served, don't turn it into an error.
+                    environ['wsgi.errors'].write(
+                        "Couldn't save the profile %s: %s\n" % (name, e))
+        finally:
+            running.release()
+
+    return profiled
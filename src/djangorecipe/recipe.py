@@ -1,13 +1,80 @@
 import os
 import logging
+import signal
 import sys
 
 from zc.buildout import UserError
 import pkg_resources
 import zc.recipe.egg
 
+from djangorecipe import assets
+from djangorecipe import bundle
+from djangorecipe import bytecode
+from djangorecipe import commands
+from djangorecipe import pathindex
+from djangorecipe import profiling
+from djangorecipe.manifest import Manifest
+from djangorecipe import wscache
 from djangorecipe.boilerplate import WSGI_TEMPLATE
 
+# Buildout options tuning the buffered wsgi logfile and the keyword argument
+# of djangorecipe.logfile.BufferedLogFile they map to.
+LOGFILE_OPTIONS = [
+    ('logfile-buffer-size', 'buffer_size'),
+    ('logfile-flush-interval', 'flush_interval'),
+    ('logfile-max-bytes', 'max_bytes'),
+    ('logfile-rotate-interval', 'rotate_interval'),
+    ('logfile-backup-count', 'backup_count'),
+]
+
+
+# Entry points of working sets indexed by name, shared by all parts:
+# {(group, dists of the working set): {name: entry point}}.
+_entry_point_indexes = {}
+
+
+def entry_point_index(ws, group):
+    """Return the {name: entry point} dict for a group in the working set.
+
+    The first distribution in the working set that provides a name wins.
+
+    """
+    key = (group, tuple((dist.key, dist.location) for dist in ws))
+    index = _entry_point_indexes.get(key)
+    if index is None:
+        index = {}
+        for entrypoint in ws.iter_entry_points(group):
+            index.setdefault(entrypoint.name, entrypoint)
+        _entry_point_indexes[key] = index
+    return index
+
+
+def script_path(ws, extra_paths):
+    """Return the sys.path zc.buildout puts in scripts for the working set.
+
+    zc.buildout works it out again for every script, scanning every egg for
+    .pth files. Passing the result as ``extra_paths`` along with an empty
+    working set skips that.
+
+    """
+    path = [dist.location for dist in ws]
+    get_pth_paths = getattr(zc.buildout.easy_install, 'get_pth_paths', None)
+    if get_pth_paths is not None:
+        for location in list(path):
+            for pth_path in get_pth_paths(location):
+                if pth_path not in path:
+                    path.append(pth_path)
+    path.extend(extra_paths)
+    unique_path = []
+    seen = set()
+    for entry in path:
+        if entry not in seen:
+            seen.add(entry)
+            unique_path.append(entry)
+    realpath = getattr(zc.buildout.easy_install, 'realpath',
+                       os.path.realpath)
+    return [realpath(entry) for entry in unique_path]
+
 
 class Recipe(object):
     def __init__(self, buildout, name, options):
@@ -53,11 +120,25 @@ class Recipe(object):
         options.setdefault('deploy-script-extra', '')
         options.setdefault('scripts-with-settings', '')
         options.setdefault('coverage', '')
+        options.setdefault('module-index', 'false')
+        options.setdefault('working-set-cache', 'true')
+        options.setdefault('startup-trace', '')
+        options.setdefault('compile-bytecode', 'false')
+        options.setdefault('compile-workers', '0')
+        options.setdefault('bundle', 'false')
+        options.setdefault('forkserver', 'false')
+        options.setdefault('command-index', 'false')
 
         # mod_wsgi support script
         options.setdefault('wsgi', 'false')
         options.setdefault('logfile', '')
 
+        # ASGI application module
+        options.setdefault('asgi', 'false')
+
+        # Preforking wsgi server script
+        options.setdefault('server', 'false')
+
         # respect relative-paths (from zc.recipe.egg)
         relative_paths = options.get(
             'relative-paths', buildout['buildout'].get('relative-paths',
@@ -69,6 +150,10 @@ class Recipe(object):
             self._relative_paths = ''
             assert relative_paths == 'false'
 
+        # Code that the recipe itself needs to run before the
+        # 'initialization' option in every generated script.
+        self._script_setup = ''
+
     def install(self):
         if self.options['project'] not in os.listdir(
                 self.buildout['buildout']['directory']):
@@ -78,18 +163,165 @@ class Recipe(object):
                 "Probably you want to run 'bin/django startproject %s'",
                 self.options['project'])
 
+        script_paths = self.generate_scripts()
+        self.compile_bytecode()
+        self.run_build_steps()
+        return script_paths
+
+    def generate_scripts(self):
+        """Create all scripts and files, return their paths.
+
+        A manifest of what was generated is written, so that ``update`` can
+        skip all this when nothing changed.
+
+        """
+        inputs = self.get_inputs_hash()
         extra_paths = self.get_extra_paths()
-        ws = self.egg.working_set(['djangorecipe'])[1]
-        # ^^^ working_set returns (requirements, ws)
+        ws = self.get_working_set()
 
         script_paths = []
+        script_paths.extend(self.create_module_index(ws))
         script_paths.extend(self.create_manage_script(extra_paths, ws))
+        script_paths.extend(self.create_command_index(extra_paths, ws))
         script_paths.extend(self.create_test_runner(extra_paths, ws))
         script_paths.extend(self.make_wsgi_script(extra_paths, ws))
+        script_paths.extend(self.make_asgi_script(extra_paths, ws))
+        script_paths.extend(self.make_dispatch_script(extra_paths, ws))
+        script_paths.extend(self.create_server_script(extra_paths, ws))
+        script_paths.extend(self.create_bundle(extra_paths, ws))
         script_paths += self.create_scripts_with_settings(
             extra_paths, ws)
+        script_paths.extend(self.create_matrix_scripts(extra_paths, ws))
+
+        manifest = self.get_manifest()
+        manifest.write(inputs, script_paths)
+        script_paths.append(manifest.filename)
         return script_paths
 
+    def get_manifest(self):
+        return Manifest(os.path.join(self.options['location'],
+                                     'manifest.json'))
+
+    def get_versions(self):
+        buildout = self.buildout['buildout']
+        return self.buildout.get(buildout.get('versions', 'versions'), {})
+
+    def get_working_set_key(self):
+        """Return a hash of everything the working set resolution uses."""
+        buildout = self.buildout['buildout']
+        versions = self.get_versions()
+        return wscache.cache_key(
+            self.options.get('eggs', ''),
+            '\n'.join('%s=%s' % item for item in sorted(versions.items())),
+            self.options['extra-paths'],
+            buildout['directory'],
+            wscache.develop_state(buildout['develop-eggs-directory']))
+
+    def get_inputs_hash(self):
+        """Return a hash of everything that influences the generated files."""
+        try:
+            version = pkg_resources.get_distribution('djangorecipe').version
+        except pkg_resources.DistributionNotFound:
+            version = ''
+        return wscache.cache_key(
+            self.get_working_set_key(),
+            '\n'.join('%s=%s' % (key, self.options[key])
+                      for key in sorted(self.options.keys())),
+            version,
+            WSGI_TEMPLATE,
+            zc.buildout.easy_install.script_template)
+
+    def is_final(self, dists):
+        """Return whether newest mode can't change the working set.
+
+        That is when every egg of the [(key, version, location)] is pinned
+        to its version or is a develop egg.
+
+        """
+        versions = dict((name.lower(), version)
+                        for name, version in self.get_versions().items())
+        develop_eggs = self.buildout['buildout']['develop-eggs-directory']
+        develop = set([develop_eggs])
+        if os.path.isdir(develop_eggs):
+            for name in os.listdir(develop_eggs):
+                if name.endswith('.egg-link'):
+                    with open(os.path.join(develop_eggs, name)) as f:
+                        develop.add(f.readline().strip())
+        return all(versions.get(key) == version or location in develop
+                   for key, version, location in dists)
+
+    def get_cached_working_set(self):
+        """Return the working set from the cache, or None.
+
+        In newest mode, a new release of an unpinned egg would change the
+        working set: then only a set of pinned and develop eggs is reused.
+
+        """
+        if self.options['working-set-cache'].lower() != 'true':
+            return None
+        return self.get_working_set_cache().get(
+            self.get_working_set_key(),
+            accept=self.is_newest() and self.is_final or None)
+
+    def is_newest(self):
+        return self.buildout['buildout'].get(
+            'newest', 'false').lower() == 'true'
+
+    def get_working_set_cache(self):
+        return wscache.WorkingSetCache(os.path.join(
+            self.buildout['buildout']['parts-directory'],
+            '.djangorecipe-cache', 'working-sets.json'))
+
+    def get_working_set(self):
+        """Return the working set, resolved or from the cache."""
+        ws = self.get_cached_working_set()
+        if ws is not None:
+            self.log.debug("Using cached working set")
+            return ws
+        ws = self.egg.working_set(['djangorecipe'])[1]
+        # ^^^ working_set returns (requirements, ws)
+        if self.options['working-set-cache'].lower() == 'true':
+            self.get_working_set_cache().set(self.get_working_set_key(), ws)
+        return ws
+
+    def create_module_index(self, ws):
+        """Write the module location index, return [index file] or [].
+
+        The generated scripts install a finder that uses this index instead
+        of probing every egg on sys.path for each top-level import.
+
+        """
+        self._script_setup = ''
+        if self.options['module-index'].lower() != 'true':
+            return []
+        index_file = os.path.join(self.options['location'],
+                                  'module-index.json')
+        if pathindex.write_index(index_file, ws,
+                                 relative_to=self._relative_paths):
+            self.log.info("Wrote module index %s", index_file)
+        if self._relative_paths:
+            index_path = 'join(base, %r)' % os.path.relpath(
+                index_file, self._relative_paths)
+        else:
+            index_path = repr(index_file)
+        self._script_setup = (
+            "import djangorecipe.pathindex\n"
+            "djangorecipe.pathindex.install(%s)\n" % index_path)
+        return [index_file]
+
+    def get_initialization(self, module_index=True):
+        initialization = self.options['initialization']
+        if module_index:
+            initialization = self._script_setup + initialization
+        trace_file = self.options['startup-trace'].strip()
+        if trace_file:
+            # First of all, so that the rest of the setup is timed as well.
+            initialization = (
+                "import djangorecipe.trace\n"
+                "djangorecipe.trace.start(%r)\n" % trace_file +
+                initialization)
+        return initialization
+
     def create_manage_script(self, extra_paths, ws):
         settings = self.get_settings()
         return zc.buildout.easy_install.scripts(
@@ -98,8 +330,114 @@ class Recipe(object):
             ws, sys.executable, self.options['bin-directory'],
             extra_paths=extra_paths,
             relative_paths=self._relative_paths,
-            arguments="'%s'" % settings,
-            initialization=self.options['initialization'])
+            arguments=self.get_manage_arguments(settings),
+            initialization=self.get_initialization())
+
+    def get_manage_arguments(self, settings):
+        return ("'%s'" % settings + self.get_forkserver_arguments() +
+                self.get_memory_arguments() +
+                self.get_command_index_arguments(settings))
+
+    def get_command_index_file(self, settings):
+        return os.path.join(self.options['location'],
+                            'commands-%s.json' % settings)
+
+    def get_command_index_arguments(self, settings):
+        if self.options['command-index'].lower() != 'true':
+            return ''
+        index_file = self.get_command_index_file(settings)
+        if self._relative_paths:
+            index_file = 'join(base, %r)' % os.path.relpath(
+                index_file, self._relative_paths)
+        else:
+            index_file = repr(index_file)
+        return ", command_index=%s" % index_file
+
+    def create_command_index(self, extra_paths, ws):
+        """Write the index of the management commands, return [index file].
+
+        The scripts of other settings modules (``settings-matrix``) write
+        theirs when they first need it.
+
+        """
+        if self.options['command-index'].lower() != 'true':
+            return []
+        settings = self.get_settings()
+        index_file = self.get_command_index_file(settings)
+        error = commands.build(
+            index_file, self.options.get('control-script', self.name),
+            settings, script_path(ws, extra_paths),
+            initialization=self.options['initialization'],
+            cwd=self.buildout['buildout']['directory'])
+        if error:
+            # Before startproject, for instance.
+            self.log.warning("Couldn't index the management commands, the "
+                             "first help or completion request will:\n%s",
+                             error)
+            return []
+        return [index_file]
+
+    def get_forkserver_arguments(self):
+        if self.options['forkserver'].lower() != 'true':
+            return ''
+        timeout = self.options.get('forkserver-timeout', '').strip() or '900'
+        if not timeout.isdigit():
+            raise UserError("The forkserver-timeout option must be a number "
+                            "of seconds, not %r" % timeout)
+        if self._relative_paths:
+            directory = 'join(base, %r)' % os.path.relpath(
+                self.options['location'], self._relative_paths)
+        else:
+            directory = repr(self.options['location'])
+        return ", forkserver_directory=%s, forkserver_timeout=%s" % (
+            directory, timeout)
+
+    def get_memory_arguments(self):
+        directory = self.options.get('memory-snapshots', '').strip()
+        if not directory or directory.lower() == 'false':
+            return ''
+        if directory.lower() == 'true':
+            directory = os.path.join(self.options['location'], 'memory')
+        frames = self.options.get('memory-snapshot-frames', '').strip() or '1'
+        if not frames.isdigit() or not int(frames):
+            raise UserError("The memory-snapshot-frames option must be a "
+                            "positive number, not %r" % frames)
+        return ", memory_snapshots=%r, memory_frames=%s, memory_signal=%r" % (
+            directory, frames, self.get_signal('memory-snapshot-signal',
+                                               'USR2'))
+
+    def get_signal(self, option, default):
+        """Return the signal name of the option, without ``SIG``."""
+        name = (self.options.get(option, '').strip() or default).upper()
+        if name.startswith('SIG'):
+            name = name[3:]
+        # signal.Signals only exists on python 3.5 and later. SIG_DFL,
+        # SIG_IGN and friends are integers too.
+        signum = getattr(signal, 'SIG' + name, None)
+        if name.startswith('_') or not isinstance(signum, int):
+            raise UserError("Unknown %s: %r" % (option, name))
+        return name
+
+    def get_coverage_arguments(self):
+        """Return the coverage keyword arguments for the test runner."""
+        source = self.options.get('coverage-source', '').strip() or 'auto'
+        if source.lower() == 'auto':
+            # The project and the extra-paths, not django and the eggs.
+            source = [os.path.join(self.buildout['buildout']['directory'],
+                                   self.options['project'])]
+            source.extend(self.get_extra_paths()[1:])
+        elif source.lower() == 'all':
+            source = None
+        else:
+            source = source.split()
+        arguments = ", coverage_source=%r" % (source,)
+        core = self.options.get('coverage-tracer', '').strip().lower()
+        if core:
+            if core not in ('fastest', 'ctrace', 'pytrace', 'sysmon'):
+                raise UserError("coverage-tracer must be one of fastest, "
+                                "ctrace, pytrace or sysmon, not %r" % core)
+            arguments += ", coverage_core=%r" % core
+        return arguments
 
     def create_test_runner(self, extra_paths, working_set):
         settings = self.get_settings()
@@ -108,6 +446,36 @@ class Recipe(object):
             coverage_functions = 'report html_report xml_report'
         apps = self.options.get('test', '').split()
         # Only create the testrunner if the user requests it
+        arguments = "'%s', '%s', %s" % (
+            settings,
+            coverage_functions,
+            ', '.join(["'%s'" % app for app in apps]))
+        parallel = self.options.get('test-parallel', '').strip()
+        if parallel:
+            if not (parallel.lower() == 'auto' or parallel.isdigit()):
+                raise UserError("test-parallel must be a number of worker "
+                                "processes or 'auto', not %r" % parallel)
+            arguments += ", parallel='%s'" % parallel.lower()
+        test_map = self.options.get('test-map', '').strip()
+        if test_map:
+            if test_map.lower() == 'true':
+                test_map = os.path.join(
+                    self.buildout['buildout']['directory'], '.testmap.json')
+            arguments += ", test_map=%r" % test_map
+        if coverage_functions or test_map:
+            arguments += self.get_coverage_arguments()
+        snapshots = self.options.get('test-snapshots', '').strip()
+        if snapshots and snapshots.lower() != 'false':
+            if snapshots.lower() == 'true':
+                snapshots = os.path.join(self.options['location'],
+                                         'test-snapshots')
+            size = (self.options.get('test-snapshots-size', '').strip() or
+                    '1024')
+            if not size.isdigit():
+                raise UserError("test-snapshots-size must be a number of "
+                                "megabytes, not %r" % size)
+            arguments += ", test_snapshots=%r, test_snapshots_size=%d" % (
+                snapshots, int(size) * 1024 * 1024)
         if apps:
             return zc.buildout.easy_install.scripts(
                 [(self.options.get('testrunner', 'test'),
@@ -116,42 +484,263 @@ class Recipe(object):
                 self.options['bin-directory'],
                 extra_paths=extra_paths,
                 relative_paths=self._relative_paths,
-                arguments="'%s', '%s', %s" % (
-                    settings,
-                    coverage_functions,
-                    ', '.join(["'%s'" % app for app in apps])),
-                initialization=self.options['initialization'])
+                arguments=arguments,
+                initialization=self.get_initialization())
         else:
             return []
 
     def make_wsgi_script(self, extra_paths, ws):
-        scripts = []
-        _script_template = zc.buildout.easy_install.script_template
+        if self.options.get('wsgi', '').lower() != 'true':
+            return []
+        settings = self.get_settings()
+        return self.create_wsgi_script(
+            self.options.get('wsgi-script') or
+            '%s.%s' % (self.options.get('control-script', self.name), 'wsgi'),
+            extra_paths, ws, self.get_wsgi_arguments(settings),
+            self.get_initialization())
+
+    def make_asgi_script(self, extra_paths, ws):
+        if self.options['asgi'].lower() != 'true':
+            return []
         settings = self.get_settings()
+        return self.create_wsgi_script(
+            self.options.get('asgi-script') or
+            '%s_asgi.py' % self.options.get('control-script', self.name),
+            extra_paths, ws, self.get_wsgi_arguments(settings, 'asgi'),
+            self.get_initialization(), entry='asgi')
+
+    def get_dispatch_routes(self):
+        """Return [(pattern, settings)] from the ``dispatch`` option."""
+        routes = []
+        for line in self.options.get('dispatch', '').splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) != 2:
+                raise UserError("Invalid dispatch line: %r" % line.strip())
+            routes.append((parts[0], parts[1]))
+        return routes
+
+    def make_dispatch_script(self, extra_paths, ws):
+        routes = self.get_dispatch_routes()
+        if not routes:
+            return []
+        numbers = {}
+        for option, default in (('dispatch-workers', '1'),
+                                ('dispatch-idle-timeout', '600')):
+            value = self.options.get(option, '').strip() or default
+            if not value.isdigit():
+                raise UserError("The %s option must be a number, not %r"
+                                % (option, value))
+            numbers[option] = int(value)
+        # The wsgi server's sys.executable isn't necessarily python.
+        arguments = "%r, python=%r, workers=%s, idle_timeout=%s" % (
+            routes, sys.executable, numbers['dispatch-workers'],
+            numbers['dispatch-idle-timeout'])
+        # The site workers are separate processes and run it themselves.
+        if self.options['initialization']:
+            arguments += ", initialization=%r" % (
+                self.options['initialization'])
+        return self.create_wsgi_script(
+            self.options.get('dispatch-script') or
+            '%s-dispatch.wsgi' % self.options.get('control-script',
+                                                  self.name),
+            extra_paths, ws, arguments, self.get_initialization(),
+            entry='dispatch')
+
+    def create_wsgi_script(self, name, extra_paths, ws, arguments,
+                           initialization, entry='wsgi'):
+        """Generate a wsgi (or asgi) script from WSGI_TEMPLATE."""
+        _script_template = zc.buildout.easy_install.script_template
         zc.buildout.easy_install.script_template = (
             zc.buildout.easy_install.script_header +
             WSGI_TEMPLATE +
             self.options['deploy-script-extra']
         )
-        if self.options.get('wsgi', '').lower() == 'true':
-            scripts.extend(
-                zc.buildout.easy_install.scripts(
-                    [(self.options.get('wsgi-script') or
-                      '%s.%s' % (self.options.get('control-script',
-                                                  self.name),
-                                 'wsgi'),
-                      'djangorecipe.binscripts', 'wsgi')],
-                    ws,
-                    sys.executable,
-                    self.options['bin-directory'],
-                    extra_paths=extra_paths,
-                    relative_paths=self._relative_paths,
-                    arguments="'%s', logfile='%s'" % (
-                        settings, self.options.get('logfile')),
-                    initialization=self.options['initialization'],
-                ))
-        zc.buildout.easy_install.script_template = _script_template
-        return scripts
+        try:
+            return zc.buildout.easy_install.scripts(
+                [(name, 'djangorecipe.binscripts', entry)],
+                ws,
+                sys.executable,
+                self.options['bin-directory'],
+                extra_paths=extra_paths,
+                relative_paths=self._relative_paths,
+                arguments=arguments,
+                initialization=initialization,
+            )
+        finally:
+            zc.buildout.easy_install.script_template = _script_template
+
+    def create_server_script(self, extra_paths, ws):
+        if self.options['server'].lower() != 'true':
+            return []
+        settings = self.get_settings()
+        listen = self.options.get('server-listen', '').split() or [
+            '127.0.0.1:8000']
+        numbers = {}
+        for option in ('server-workers', 'server-max-requests'):
+            value = self.options.get(option, '').strip() or '0'
+            if not value.isdigit():
+                raise UserError("The %s option must be a number, not %r"
+                                % (option, value))
+            numbers[option] = int(value)
+        return zc.buildout.easy_install.scripts(
+            [(self.options.get('server-script') or
+              '%s-serve' % self.options.get('control-script', self.name),
+              'djangorecipe.binscripts', 'serve')],
+            ws, sys.executable, self.options['bin-directory'],
+            extra_paths=extra_paths,
+            relative_paths=self._relative_paths,
+            arguments="%s, listen=%r, workers=%s, max_requests=%s" % (
+                self.get_wsgi_arguments(settings), listen,
+                numbers['server-workers'], numbers['server-max-requests']),
+            initialization=self.get_initialization())
+
+    def get_wsgi_arguments(self, settings, kind='wsgi'):
+        arguments = "'%s', logfile='%s'" % (settings,
+                                             self.options.get('logfile'))
+        if self.options.get('logfile'):
+            for option, keyword in LOGFILE_OPTIONS:
+                value = self.options.get(option, '').strip()
+                if not value:
+                    continue
+                try:
+                    float(value)
+                except ValueError:
+                    raise UserError("The %s option must be a number, not %r"
+                                    % (option, value))
+                arguments += ", %s=%s" % (keyword, value)
+        if self.options.get('%s-preload' % kind, '').lower() == 'true':
+            arguments += ", preload=True"
+            urls = self.options.get('%s-warmup-urls' % kind, '').split()
+            if urls:
+                arguments += ", warmup_urls=%r" % urls
+        if kind == 'wsgi':
+            arguments += self.get_metrics_arguments(settings)
+            arguments += self.get_profile_arguments()
+            arguments += self.get_memory_arguments()
+            arguments += self.get_recycle_arguments()
+        return arguments
+
+    def get_metrics_arguments(self, settings):
+        metrics = self.options.get('wsgi-metrics', '').strip()
+        if not metrics or metrics.lower() == 'false':
+            return ''
+        if metrics.lower() == 'true':
+            # Every settings module gets its own, the views differ.
+            metrics = os.path.join(self.options['location'], 'metrics',
+                                   '%s.metrics' % settings)
+        arguments = ", metrics=%r" % metrics
+        url = self.options.get('wsgi-metrics-url', '').strip()
+        if url:
+            arguments += ", metrics_url=%r" % url
+        return arguments
+
+    def get_profile_arguments(self):
+        profile = self.options.get('wsgi-profile', '').strip()
+        if not profile or profile.lower() == 'false':
+            return ''
+        if profile.lower() == 'true':
+            profile = os.path.join(self.options['location'], 'profiles')
+        match = [line.strip() for line in
+                 self.options.get('wsgi-profile-match', '').splitlines()
+                 if line.strip()]
+        try:
+            profiling.parse_match(match)
+        except ValueError as e:
+            raise UserError("Invalid wsgi-profile-match: %s" % e)
+        numbers = {}
+        # Every matching request, unless told otherwise.
+        for option, default in (('wsgi-profile-sample', match and '1' or
+                                 '100'),
+                                ('wsgi-profile-keep', '100')):
+            value = self.options.get(option, '').strip() or default
+            if not value.isdigit() or not int(value):
+                raise UserError("The %s option must be a positive number, "
+                                "not %r" % (option, value))
+            numbers[option] = int(value)
+        arguments = ", profile=%r, profile_every=%s, profile_keep=%s" % (
+            profile, numbers['wsgi-profile-sample'],
+            numbers['wsgi-profile-keep'])
+        if match:
+            arguments += ", profile_match=%r" % match
+        return arguments
+
+    def get_recycle_arguments(self):
+        numbers = {}
+        for option, default in (('wsgi-recycle-memory', '0'),
+                                ('wsgi-recycle-requests', '0'),
+                                ('wsgi-recycle-jitter', '0'),
+                                ('wsgi-recycle-check-every', '100')):
+            value = self.options.get(option, '').strip() or default
+            if not value.isdigit():
+                raise UserError("The %s option must be a number, not %r"
+                                % (option, value))
+            numbers[option] = int(value)
+        if not (numbers['wsgi-recycle-memory'] or
+                numbers['wsgi-recycle-requests']):
+            return ''
+        # The memory limit is in megabytes.
+        return (", recycle_max_rss=%s, recycle_check_every=%s, "
+                "recycle_max_requests=%s, recycle_jitter=%s, "
+                "recycle_signal=%r" % (
+                    numbers['wsgi-recycle-memory'] * 1024 * 1024,
+                    max(numbers['wsgi-recycle-check-every'], 1),
+                    numbers['wsgi-recycle-requests'],
+                    numbers['wsgi-recycle-jitter'],
+                    self.get_signal('wsgi-recycle-signal', 'TERM')))
+
+    def get_scripts_with_settings(self, ws):
+        """Return {settings: [(script name, module, attrs)]}.
+
+        The scripts are the ones requested by ``scripts-with-settings``.
+
+        """
+        requested = []
+        for line in self.options.get('scripts-with-settings').splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) > 2:
+                raise UserError("Invalid scripts-with-settings line: %r"
+                                % line.strip())
+            group, _, name = parts[0].rpartition(':')
+            settings = len(parts) == 2 and parts[1] or self.get_settings()
+            requested.append((group or 'console_scripts', name, settings))
+        if not requested:
+            return {}
+
+        postfix = '-with-settings'
+        by_settings = {}
+        script_names = set()
+        unknown_script_names = []
+        for group, name, settings in requested:
+            entrypoint = entry_point_index(ws, group).get(name)
+            if entrypoint is None:
+                unknown_script_names.append(name)
+                continue
+            script_name = entrypoint.name + postfix
+            # One would silently overwrite the other.
+            if script_name in script_names:
+                raise UserError("Duplicate scripts-with-settings script: %r"
+                                % script_name)
+            script_names.add(script_name)
+            self.log.debug("Creating entrypoint %s:%s as %s",
+                           entrypoint.module_name,
+                           '.'.join(entrypoint.attrs), script_name)
+            by_settings.setdefault(settings, []).append(
+                (script_name, entrypoint.module_name,
+                 '.'.join(entrypoint.attrs)))
+        if unknown_script_names:
+            raise UserError("Some script names couldn't be found: %s" % (
+                ', '.join(unknown_script_names)))
+        return by_settings
+
+    def get_settings_initialization(self, settings):
+        return (self.get_initialization() +
+                "\n" +
+                "import os\n" +
+                "os.environ['DJANGO_SETTINGS_MODULE'] = '%s'" % settings)
 
     def create_scripts_with_settings(self, extra_paths, ws):
         """Create duplicates of existing scripts - *with* a settings env.
@@ -161,45 +750,107 @@ class Recipe(object):
         install a duplicate. We postfix the duplicate with '-with-settings',
         so that 'gunicorn' for instance becomes 'gunicorn-with-settings'.
 
+        Every line is ``[group:]name [settings]``. The group defaults to
+        ``console_scripts``, the settings to the part's settings. All scripts
+        with the same settings are generated in one go.
+
         """
-        script_names = [entrypoint.strip() for entrypoint in
-                        self.options.get('scripts-with-settings').splitlines()
-                        if entrypoint.strip()]
-        if not script_names:
-            return []
-        settings = self.get_settings()
-        postfix = '-with-settings'
-        initialization = self.options['initialization']
-        initialization += (
-            "\n" +
-            "import os\n" +
-            "os.environ['DJANGO_SETTINGS_MODULE'] = '%s'" % settings)
+        by_settings = self.get_scripts_with_settings(ws)
         created_scripts = []
-        known_entrypoints = list(ws.iter_entry_points('console_scripts'))
-        to_create = [entrypoint for entrypoint in known_entrypoints
-                     if entrypoint.name in script_names]
-        for entrypoint in to_create:
-            script_name = entrypoint.name + postfix
-            dotted_path = entrypoint.module_name
-            function_name = entrypoint.attrs[0]
-            self.log.debug("Creating entrypoint %s:%s as %s",
-                           dotted_path, function_name, script_name)
-            zc.buildout.easy_install.scripts(
-                [(script_name, dotted_path, function_name)],
+        for settings in sorted(by_settings):
+            created_scripts.extend(zc.buildout.easy_install.scripts(
+                by_settings[settings],
                 ws, sys.executable, self.options['bin-directory'],
                 extra_paths=extra_paths,
                 relative_paths=self._relative_paths,
-                initialization=initialization)
-            created_scripts.append(script_name)
-
-        # Feedback logging.
-        known_names = [entrypoint.name for entrypoint in known_entrypoints]
-        unkown_script_names = [name for name in script_names
-                               if name not in known_names]
-        if unkown_script_names:
-            raise UserError("Some script names couldn't be found: %s" % (
-                ', '.join(unkown_script_names)))
+                initialization=self.get_settings_initialization(settings)))
+        return created_scripts
 
+    def get_settings_matrix(self):
+        """Return [(suffix, settings)] from the ``settings-matrix`` option."""
+        matrix = []
+        suffixes = set()
+        for line in self.options.get('settings-matrix', '').splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) != 2:
+                raise UserError("Invalid settings-matrix line: %r"
+                                % line.strip())
+            suffix, settings = parts
+            if suffix in suffixes:
+                raise UserError("Duplicate settings-matrix suffix: %r"
+                                % suffix)
+            suffixes.add(suffix)
+            matrix.append((suffix, settings))
+        return matrix
+
+    def create_matrix_scripts(self, extra_paths, ws):
+        """Create the scripts for every ``settings-matrix`` line.
+
+        Every line gets a manage script, the wsgi and asgi scripts when
+        those are enabled and the ``scripts-with-settings`` scripts, all
+        with the line's settings. They share the working set, so the
+        script path and entry points are only worked out once.
+
+        """
+        matrix = self.get_settings_matrix()
+        if not matrix:
+            return []
+        path = script_path(ws, extra_paths)
+        # zc.buildout resolves every path entry again for every script,
+        # ours are resolved already. Versions without realpath() don't.
+        _realpath = getattr(zc.buildout.easy_install, 'realpath', None)
+        if _realpath is None:
+            return self._create_matrix_scripts(matrix, path, ws)
+        resolved = dict((entry, entry) for entry in path)
+        zc.buildout.easy_install.realpath = (
+            lambda entry: resolved.get(entry) or _realpath(entry))
+        try:
+            return self._create_matrix_scripts(matrix, path, ws)
+        finally:
+            zc.buildout.easy_install.realpath = _realpath
+
+    def _create_matrix_scripts(self, matrix, path, ws):
+        control_script = self.options.get('control-script', self.name)
+        initialization = self.get_initialization()
+        wrapped = {}
+        for scripts in self.get_scripts_with_settings(ws).values():
+            for script in scripts:
+                wrapped[script[0]] = script
+        wrapped = sorted(wrapped.values())
+        created_scripts = []
+        for suffix, settings in matrix:
+            self.log.debug("Creating scripts for %s with suffix %s",
+                           settings, suffix)
+            created_scripts.extend(zc.buildout.easy_install.scripts(
+                [('%s-%s' % (control_script, suffix),
+                  'djangorecipe.binscripts', 'manage')],
+                (), sys.executable, self.options['bin-directory'],
+                extra_paths=path,
+                relative_paths=self._relative_paths,
+                arguments=self.get_manage_arguments(settings),
+                initialization=initialization))
+            if self.options['wsgi'].lower() == 'true':
+                created_scripts.extend(self.create_wsgi_script(
+                    '%s-%s.wsgi' % (control_script, suffix), path, (),
+                    self.get_wsgi_arguments(settings), initialization))
+            if self.options['asgi'].lower() == 'true':
+                # A module name, it has to be importable.
+                created_scripts.extend(self.create_wsgi_script(
+                    '%s_%s_asgi.py' % (control_script,
+                                       suffix.replace('-', '_')),
+                    path, (), self.get_wsgi_arguments(settings, 'asgi'),
+                    initialization, entry='asgi'))
+            if wrapped:
+                created_scripts.extend(zc.buildout.easy_install.scripts(
+                    [('%s-%s' % (name, suffix), module_name, attrs)
+                     for name, module_name, attrs in wrapped],
+                    (), sys.executable, self.options['bin-directory'],
+                    extra_paths=path,
+                    relative_paths=self._relative_paths,
+                    initialization=self.get_settings_initialization(
+                        settings)))
         return created_scripts
 
     def get_extra_paths(self):
@@ -210,13 +861,180 @@ class Recipe(object):
         return extra_paths
 
     def update(self):
-        extra_paths = self.get_extra_paths()
-        ws = self.egg.working_set(['djangorecipe'])[1]
-        # ^^^ working_set returns (requirements, ws)
+        # The project code changes without buildout noticing.
+        self.compile_bytecode()
+        # zc.buildout only writes scripts whose contents changed (touching
+        # an unchanged .wsgi file would make mod_wsgi restart its daemons).
+        # When the manifest says nothing changed at all, we don't even need
+        # to resolve the working set.
+        # The bundle contains the extra-paths code, which changes without
+        # buildout noticing.
+        # In newest mode, an earlier part may have resolved a newer release
+        # of an unpinned egg in this run.
+        ws = None
+        if (self.options['bundle'].lower() != 'true' and
+                self.get_manifest().matches(self.get_inputs_hash())):
+            ws = self.get_cached_working_set()
+        if ws is not None and (not self.is_newest() or self.is_final(
+                [(dist.key, dist.version, dist.location) for dist in ws])):
+            self.log.debug("Nothing changed, leaving the scripts alone")
+        else:
+            self.generate_scripts()
+        # Static files, translations and templates change without buildout
+        # noticing as well.
+        self.run_build_steps()
 
-        self.create_manage_script(extra_paths, ws)
-        self.create_test_runner(extra_paths, ws)
-        self.make_wsgi_script(extra_paths, ws)
+    def create_bundle(self, extra_paths, ws):
+        """Write the zip bundle and the scripts using it, return paths."""
+        if self.options['bundle'].lower() != 'true':
+            return []
+        buildout_directory = self.buildout['buildout']['directory']
+        directories = [(os.path.join(buildout_directory, path), None)
+                       for path in extra_paths[1:]]
+        zipped, on_disk = bundle.classify(ws, directories)
+        # The project package stays on disk: its settings usually derive
+        # paths like BASE_DIR from __file__.
+        if buildout_directory not in on_disk:
+            on_disk.insert(0, buildout_directory)
+        control_script = self.options.get('control-script', self.name)
+        bundle_file = os.path.join(self.options['location'],
+                                   '%s.pyz' % control_script)
+        settings = self.get_settings()
+        # Running the archive itself with python runs the manage command.
+        # The initialization code can't use the relative paths' ``base``.
+        main = None
+        if not self._relative_paths:
+            main = bundle.MAIN_TEMPLATE % {
+                'on_disk': on_disk,
+                'initialization': self.get_initialization(module_index=False),
+                'settings': settings}
+        errors = bundle.write_bundle(bundle_file, zipped, main)
+        for filename, error in errors:
+            self.log.warn("Couldn't compile %s: %s", filename, error)
+
+        paths = [bundle_file] + on_disk
+        names = sorted(set(os.path.basename(path).split('.')[0]
+                           for path, dist in zipped))
+        # Probing every name on a long sys.path would take longer than the
+        # rest of the bundling: a sample shows the difference just as well.
+        sample = names[:bundle.LOOKUP_SAMPLE]
+        before = bundle.lookup_time(
+            sample, [dist.location for dist in ws] + extra_paths)
+        after = bundle.lookup_time(sample, paths)
+        self.log.info(
+            "Wrote bundle %s (%.1f MB, %s modules and packages, %s sys.path "
+            "entries on disk). Finding %s of them takes %.1fms instead of "
+            "%.1fms.",
+            bundle_file, os.path.getsize(bundle_file) / 1024.0 / 1024.0,
+            len(names), len(on_disk), len(sample), after * 1000,
+            before * 1000)
+
+        no_eggs = pkg_resources.WorkingSet([])
+        scripts = [bundle_file]
+        scripts.extend(zc.buildout.easy_install.scripts(
+            [('%s-bundle' % control_script, 'djangorecipe.binscripts',
+              'manage')],
+            no_eggs, sys.executable, self.options['bin-directory'],
+            extra_paths=paths,
+            relative_paths=self._relative_paths,
+            arguments="'%s'" % settings,
+            initialization=self.get_initialization(module_index=False)))
+        if self.options.get('wsgi', '').lower() == 'true':
+            scripts.extend(self.create_wsgi_script(
+                '%s-bundle.wsgi' % control_script, paths, no_eggs,
+                self.get_wsgi_arguments(settings),
+                self.get_initialization(module_index=False)))
+        if self.options['asgi'].lower() == 'true':
+            scripts.extend(self.create_wsgi_script(
+                '%s_bundle_asgi.py' % control_script, paths, no_eggs,
+                self.get_wsgi_arguments(settings, 'asgi'),
+                self.get_initialization(module_index=False),
+                entry='asgi'))
+        return scripts
+
+    def get_compile_directories(self):
+        """Return the project, extra-paths and develop egg directories."""
+        buildout = self.buildout['buildout']
+        directories = [os.path.join(buildout['directory'],
+                                    self.options['project'])]
+        directories.extend(os.path.join(buildout['directory'], path)
+                           for path in self.get_extra_paths()[1:])
+        develop_eggs = buildout['develop-eggs-directory']
+        if os.path.isdir(develop_eggs):
+            for name in sorted(os.listdir(develop_eggs)):
+                if not name.endswith('.egg-link'):
+                    continue
+                with open(os.path.join(develop_eggs, name)) as f:
+                    location = f.readline().strip()
+                directories.append(os.path.join(buildout['directory'],
+                                                location))
+        return [directory for directory in directories
+                if os.path.isdir(directory)]
+
+    def compile_bytecode(self):
+        """Byte-compile the project, extra-paths and develop eggs."""
+        if self.options['compile-bytecode'].lower() != 'true':
+            return
+        workers = self.options['compile-workers'].strip()
+        if not workers.isdigit():
+            raise UserError("compile-workers should be a number, not %r"
+                            % workers)
+        buildout = self.buildout['buildout']
+        # A develop egg can be the buildout directory itself: leave what
+        # buildout manages alone, and whatever the user excludes.
+        exclude = [buildout[key] for key in (
+            'eggs-directory', 'develop-eggs-directory', 'parts-directory',
+            'bin-directory') if key in buildout]
+        exclude.extend(
+            os.path.join(buildout['directory'], path.strip())
+            for path in self.options.get('compile-exclude', '').splitlines()
+            if path.strip())
+        compiled, total, errors, seconds = bytecode.compile_sources(
+            self.get_compile_directories(),
+            os.path.join(buildout['parts-directory'], '.djangorecipe-cache',
+                         'bytecode.json'),
+            workers=int(workers), exclude=exclude)
+        for filename, error in errors:
+            self.log.warn("Couldn't compile %s: %s", filename, error)
+        self.log.info("Compiled %s of %s modules in %.2fs",
+                      compiled, total, seconds)
+
+    def run_build_steps(self):
+        """Run the ``build-steps`` in one django process, log the timings."""
+        steps = self.options.get('build-steps', '').split()
+        if not steps:
+            return
+        for step in steps:
+            if step not in assets.STEPS:
+                raise UserError("Unknown build step %r, choose from %s"
+                                % (step, ', '.join(assets.STEPS)))
+        path = script_path(self.get_working_set(), self.get_extra_paths())
+        try:
+            results = assets.run(
+                steps, self.get_settings(), path,
+                os.path.join(self.options['location'], 'build-steps.json'),
+                initialization=self.options['initialization'],
+                cwd=self.buildout['buildout']['directory'])
+        except assets.BuildError as e:
+            raise UserError("The build steps failed:\n%s" % e)
+        self.log.info("Django setup for the build steps took %.2fs",
+                      results['setup'])
+        failed = []
+        for result in results['steps']:
+            if result['error']:
+                failed.append(result['step'])
+                self.log.error("%s failed after %.2fs:\n%s%s",
+                               result['step'], result['seconds'],
+                               result['output'], result['error'])
+            elif result['skipped']:
+                self.log.info("%s skipped, its inputs didn't change "
+                              "(checked in %.2fs)", result['step'],
+                              result['seconds'])
+            else:
+                self.log.info("%s took %.2fs", result['step'],
+                              result['seconds'])
+        if failed:
+            raise UserError("Build steps failed: %s" % ', '.join(failed))
 
     def create_file(self, filename, template, options):
         if os.path.exists(filename):
@@ -0,0 +1,128 @@
+"""Recycle a wsgi worker process that grew too big or served long enough.
+
+``recycle()`` wraps the application. Every ``check_every`` requests it
+looks at the resident memory of the process; once that is over ``max_rss``
+bytes, or once the process served ``max_requests`` requests (plus a random
+``jitter``, so the workers don't all restart at the same time), the process
+sends itself a signal after the current response is sent. Servers stop a
+worker gracefully on their stop signal and start a fresh one: ``TERM`` for
+gunicorn and ``bin/django-serve``, ``INT`` for mod_wsgi daemon processes.
+
+"""
+import os
+import random
+import signal
+import sys
+import time
+
+
+def log(message):
+    sys.stderr.write('%s [%s] %s\n' % (
+        time.strftime('%Y-%m-%d %H:%M:%S'), os.getpid(), message))
+    sys.stderr.flush()
+
+
+def _page_size():
+    try:
+        return os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 4096
+
+
+def rss():
+    """Return the resident memory of the process in bytes, or None."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _page_size()
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # The peak, not the current size, but it only ever grows anyway.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _size(size):
+    return '%d MiB' % (size // (1024 * 1024))
+
+
+class Recycler(object):
+    """Decides when this process is due for recycling."""
+
+    def __init__(self, max_rss=0, check_every=100, max_requests=0, jitter=0,
+                 signum=signal.SIGTERM):
+        self.max_rss = max_rss
+        self.check_every = max(check_every, 1)
+        self.max_requests = max_requests
+        self.jitter = jitter
+        self.signum = signum
+        self.pid = None
+
+    def _reset(self):
+        # The counts of the process we were forked from aren't ours.
+        self.pid = os.getpid()
+        self.requests = 0
+        self.limit = self.max_requests and (
+            self.max_requests + random.randint(0, self.jitter))
+        self.reason = None
+
+    def count(self):
+        """Count a request, return why to recycle or None."""
+        if self.pid != os.getpid():
+            self._reset()
+        if self.reason:
+            return None
+        self.requests += 1
+        if self.limit and self.requests >= self.limit:
+            self.reason = 'served %s requests' % self.requests
+        elif self.max_rss and not self.requests % self.check_every:
+            size = rss()
+            if size is not None and size > self.max_rss:
+                self.reason = 'memory %s over the limit of %s' % (
+                    _size(size), _size(self.max_rss))
+        return self.reason
+
+    def recycle(self):
+        log("Recycling worker after %s requests: %s" % (
+            self.requests, self.reason))
+        os.kill(os.getpid(), self.signum)
+
+
+class ClosingResponse(object):
+    """The response, recycling the process once the server closes it."""
+
+    def __init__(self, response, recycler):
+        self.response = response
+        self.recycler = recycler
+
+    def __iter__(self):
+        return iter(self.response)
+
+    def close(self):
+        try:
+            if hasattr(self.response, 'close'):
+                self.response.close()
+        finally:
+            self.recycler.recycle()
+
+
+def recycle(application, max_rss=0, check_every=100, max_requests=0,
+            jitter=0, signum=signal.SIGTERM):
+    """Return the application, recycling the process when it's due.
+
+    ``max_rss`` is in bytes, 0 means no memory limit, and ``max_requests``
+    0 no request limit.
+
+    """
+    recycler = Recycler(max_rss, check_every, max_requests, jitter, signum)
+
+    def recycling(environ, start_response):
+        response = application(environ, start_response)
+        if recycler.count():
+            return ClosingResponse(response, recycler)
+        return response
+
+    return recycling
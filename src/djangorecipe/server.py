@@ -0,0 +1,279 @@
+"""Small preforking WSGI server, used by the ``bin/django-serve`` script.
+
+The master process loads the application once and then forks the workers,
+so the workers share the preloaded memory copy-on-write. Workers accept
+connections on the shared listening sockets and handle them with wsgiref.
+
+Signals to the master:
+
+- TERM, INT: stop the workers (after their current request) and exit.
+- HUP: graceful reload. The workers finish their current request and the
+  master re-executes itself, inheriting the listening sockets, so no
+  connection is refused while the application is loaded again.
+
+A worker that crashes logs its traceback and exits with a non-zero code.
+The master replaces it, but waits longer and longer while workers keep on
+crashing, so a broken application doesn't make it fork in a tight loop.
+
+"""
+import errno
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+from wsgiref.simple_server import WSGIRequestHandler
+from wsgiref.simple_server import WSGIServer
+
+FDS_ENV = 'DJANGORECIPE_SERVE_FDS'
+# Seconds to wait before replacing a crashed worker, doubled for every
+# crash in a row.
+BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+
+def log(message):
+    sys.stderr.write('%s [%s] %s\n' % (
+        time.strftime('%Y-%m-%d %H:%M:%S'), os.getpid(), message))
+    sys.stderr.flush()
+
+
+def parse_listen(value):
+    """Return (family, address) for 'host:port', 'port' or 'unix:path'."""
+    value = value.strip()
+    if value.startswith('unix:'):
+        return socket.AF_UNIX, value[len('unix:'):]
+    host, _, port = value.rpartition(':')
+    host = host.strip('[]') or '127.0.0.1'
+    family = ':' in host and socket.AF_INET6 or socket.AF_INET
+    return family, (host, int(port))
+
+
+def create_socket(listen, backlog=128):
+    family, address = parse_listen(listen)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        if os.path.exists(address):
+            os.remove(address)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+
+def inherited_sockets():
+    """Return the listening sockets passed on by a reloading master."""
+    fds = os.environ.pop(FDS_ENV, '')
+    sockets = []
+    for fd in fds.split(','):
+        if not fd:
+            continue
+        family, fd = fd.split(':')
+        sockets.append(socket.fromfd(int(fd), int(family),
+                                     socket.SOCK_STREAM))
+        os.close(int(fd))
+    return sockets
+
+
+def server_name(sock):
+    """Return the (SERVER_NAME, SERVER_PORT) of a listening socket.
+
+    getfqdn() can mean a DNS lookup: the master looks it up once for all
+    workers.
+
+    """
+    if sock.family == socket.AF_UNIX:
+        return 'localhost', 0
+    host, port = sock.getsockname()[:2]
+    return socket.getfqdn(host), port
+
+
+class Server(WSGIServer):
+    """wsgiref server that uses an existing, shared, listening socket."""
+
+    def __init__(self, sock, application, name=None):
+        socketserver.BaseServer.__init__(self, sock.getsockname(),
+                                         WSGIRequestHandler)
+        self.socket = sock
+        self.handled = 0
+        self.server_name, self.server_port = name or server_name(sock)
+        self.setup_environ()
+        self.set_app(application)
+
+    def get_request(self):
+        conn, address = self.socket.accept()
+        if self.socket.family == socket.AF_UNIX:
+            address = ('127.0.0.1', 0)
+        return conn, address
+
+    def finish_request(self, request, client_address):
+        self.handled += 1
+        WSGIServer.finish_request(self, request, client_address)
+
+    def server_close(self):
+        # The socket is shared with the master and the other workers.
+        pass
+
+
+class Arbiter(object):
+    """Master process: keeps ``workers`` worker processes running."""
+
+    def __init__(self, application, sockets, workers=0, max_requests=0):
+        self.application = application
+        self.sockets = sockets
+        if not workers:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        self.workers = workers
+        self.max_requests = max_requests
+        self.names = [server_name(sock) for sock in sockets]
+        self.children = set()
+        self.stopping = False
+        self.reloading = False
+        # Crashed workers in a row and when to start the next one.
+        self.failures = 0
+        self.spawn_after = 0
+
+    def run(self):
+        for sock in self.sockets:
+            # Workers compete for connections: a worker that loses the race
+            # mustn't block in accept().
+            sock.setblocking(False)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._reload)
+        log("Serving on %s with %s workers (master pid %s)" % (
+            ', '.join(str(sock.getsockname()) for sock in self.sockets),
+            self.workers, os.getpid()))
+        while not (self.stopping or self.reloading):
+            self._reap()
+            if time.time() >= self.spawn_after:
+                while len(self.children) < self.workers:
+                    self._spawn()
+            time.sleep(0.5)
+        self._stop_workers()
+        if self.reloading:
+            self._exec()
+        return 0
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _reload(self, signum, frame):
+        self.reloading = True
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return
+        code = 1
+        try:
+            worker(self.application, self.sockets, self.max_requests,
+                   self.names)
+            code = 0
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    self.children.clear()
+                    return
+                raise
+            if not pid:
+                return
+            self.children.discard(pid)
+            self._exited(pid, status)
+
+    def _exited(self, pid, status):
+        """Back off when workers keep on crashing."""
+        if self.stopping or self.reloading:
+            return
+        if os.WIFEXITED(status) and not os.WEXITSTATUS(status):
+            self.failures = 0
+            return
+        self.failures += 1
+        delay = min(BACKOFF * 2 ** (self.failures - 1), MAX_BACKOFF)
+        self.spawn_after = time.time() + delay
+        log("Worker %s died (status %s), starting a new one in %ss" % (
+            pid, status, delay))
+
+    def _stop_workers(self, timeout=30):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.children.discard(pid)
+        if self.reloading:
+            # The workers finish their current request on their own, the
+            # new master picks up the listening sockets right away.
+            return
+        deadline = time.time() + timeout
+        while self.children and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self.children:
+            os.kill(pid, signal.SIGKILL)
+
+    def _exec(self):
+        fds = []
+        for sock in self.sockets:
+            fd = sock.fileno()
+            if hasattr(os, 'set_inheritable'):
+                os.set_inheritable(fd, True)
+            sock.setblocking(True)
+            fds.append('%s:%s' % (int(sock.family), fd))
+        os.environ[FDS_ENV] = ','.join(fds)
+        log("Reloading")
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+def worker(application, sockets, max_requests=0, names=None):
+    """Handle requests until told to stop or ``max_requests`` is reached.
+
+    ``names`` are the sockets' (SERVER_NAME, SERVER_PORT), when known.
+
+    """
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+    # Ctrl-C reaches the whole process group: the master stops us.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    servers = [Server(sock, application, name)
+               for sock, name in zip(sockets, names or [None] * len(sockets))]
+    while not stopping:
+        try:
+            readable = select.select(servers, [], [], 1.0)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for server in readable:
+            server._handle_request_noblock()
+        if max_requests and sum(s.handled for s in servers) >= max_requests:
+            # Recycle: the master starts a fresh worker.
+            break
+
+
+def serve(application, listen, workers=0, max_requests=0):
+    sockets = inherited_sockets() or [create_socket(address)
+                                      for address in listen]
+    return Arbiter(application, sockets, workers, max_requests).run()
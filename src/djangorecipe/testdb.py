@@ -0,0 +1,308 @@
+"""Snapshots of the migrated test databases for ``bin/test``.
+
+Creating the test database means running every migration, which takes
+longer than the tests themselves for many projects. With the
+``test-snapshots`` option, the migrated test database is saved to a snapshot
+directory: a copy made with sqlite's backup API for sqlite (which also
+works for in-memory test databases), a ``pg_dump`` archive for PostgreSQL.
+Later runs restore the snapshot into a fresh test database instead of
+migrating.
+
+A snapshot is keyed by a hash of all migration files (of the models for
+apps without migrations), the database settings and the django version, so
+any change to those migrates again. Code that migrations import from
+elsewhere isn't part of the key. The least recently used snapshots are
+removed once the directory grows beyond its size limit.
+
+"""
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+KEY_VERSION = 1
+EXTENSIONS = {'sqlite': '.sqlite3', 'postgresql': '.pgdump'}
+# Not relevant for the contents of the test database.
+IGNORED_SETTINGS = ('NAME', 'PASSWORD', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')
+
+
+def _module_files(module):
+    """Return the .py files of a module or package."""
+    paths = getattr(module, '__path__', None)
+    if paths is None:
+        filename = getattr(module, '__file__', None) or ''
+        if filename.endswith(('.pyc', '.pyo')):
+            filename = filename[:-1]
+        return [filename] if filename.endswith('.py') else []
+    files = []
+    for path in paths:
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(name for name in dirs if name != '__pycache__')
+            files.extend(os.path.join(root, name) for name in sorted(names)
+                         if name.endswith('.py'))
+    return files
+
+
+def schema_files(migrate=True):
+    """Return [(app label, files)] that determine the test database schema.
+
+    That's the migrations of every app or, for apps without migrations and
+    when migrations are disabled, its models.
+
+    """
+    from django.apps import apps
+    from django.db.migrations.loader import MigrationLoader
+    result = []
+    for app_config in apps.get_app_configs():
+        module = None
+        if migrate:
+            module_name, _ = MigrationLoader.migrations_module(
+                app_config.label)
+            if module_name:
+                try:
+                    module = importlib.import_module(module_name)
+                except ImportError:
+                    module = None
+        if module is None:
+            module = app_config.models_module
+        files = _module_files(module) if module is not None else []
+        result.append((app_config.label, files))
+    return result
+
+
+def snapshot_key(connection):
+    """Return the snapshot key for the connection's test database."""
+    import django
+    settings_dict = dict(
+        (key, value) for key, value in connection.settings_dict.items()
+        if key not in IGNORED_SETTINGS)
+    test_settings = dict(settings_dict.get('TEST') or {})
+    # Parallel test workers get their own test database names, they can
+    # share the snapshot.
+    test_settings.pop('NAME', None)
+    settings_dict['TEST'] = test_settings
+    digest = hashlib.sha1()
+    digest.update(json.dumps(
+        [KEY_VERSION, django.get_version(), connection.alias,
+         connection.vendor, settings_dict],
+        sort_keys=True, default=str).encode('utf-8'))
+    migrate = test_settings.get('MIGRATE', True) is not False
+    for label, files in schema_files(migrate):
+        digest.update(('\0app %s' % label).encode('utf-8'))
+        for filename in files:
+            digest.update(('\0%s\0' % os.path.basename(filename)).encode(
+                'utf-8'))
+            with open(filename, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _pg_environ(settings_dict):
+    env = dict(os.environ)
+    for setting, variable in (('HOST', 'PGHOST'), ('PORT', 'PGPORT'),
+                              ('USER', 'PGUSER'),
+                              ('PASSWORD', 'PGPASSWORD')):
+        if settings_dict.get(setting):
+            env[variable] = str(settings_dict[setting])
+    return env
+
+
+def _pg_run(command, connection):
+    """Run a PostgreSQL client, raise SnapshotError when it fails."""
+    try:
+        process = subprocess.Popen(
+            command, env=_pg_environ(connection.settings_dict),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise SnapshotError("%s: %s" % (command[0], e))
+    _, error = process.communicate()
+    if process.returncode:
+        raise SnapshotError("%s failed: %s" % (
+            command[0], error.decode('utf-8', 'replace').strip()))
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def dump(connection, filename):
+    """Save the connection's (test) database to ``filename``."""
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        connection.ensure_connection()
+        target = sqlite3.connect(filename)
+        try:
+            connection.connection.backup(target)
+        finally:
+            target.close()
+    elif connection.vendor == 'postgresql':
+        _pg_run(['pg_dump', '--format=custom', '--no-owner',
+                 '--file=%s' % filename, connection.settings_dict['NAME']],
+                connection)
+    else:
+        raise SnapshotError("Can't snapshot %s databases" % connection.vendor)
+
+
+def load(connection, filename):
+    """Restore ``filename`` into the connection's empty (test) database."""
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        connection.ensure_connection()
+        source = sqlite3.connect(filename)
+        try:
+            source.backup(connection.connection)
+        finally:
+            source.close()
+    elif connection.vendor == 'postgresql':
+        _pg_run(['pg_restore', '--no-owner', '--exit-on-error',
+                 '--dbname=%s' % connection.settings_dict['NAME'], filename],
+                connection)
+    else:
+        raise SnapshotError("Can't snapshot %s databases" % connection.vendor)
+
+
+class Snapshots(object):
+    """A directory of snapshots, limited to ``max_size`` bytes."""
+
+    def __init__(self, directory, max_size=0):
+        self.directory = directory
+        self.max_size = max_size
+
+    def supports(self, connection):
+        if connection.vendor == 'sqlite':
+            import sqlite3
+            return hasattr(sqlite3.Connection, 'backup')
+        return connection.vendor in EXTENSIONS
+
+    def path(self, key, connection):
+        return os.path.join(self.directory,
+                            key + EXTENSIONS[connection.vendor])
+
+    def get(self, key, connection):
+        """Return the snapshot's filename, or None if there's none."""
+        filename = self.path(key, connection)
+        if not os.path.exists(filename):
+            return None
+        # The mtime is the time it was last used.
+        try:
+            os.utime(filename, None)
+        except OSError:
+            return None
+        return filename
+
+    def save(self, key, connection):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Parallel test workers may be saving the same snapshot, only
+        # complete files get the snapshot's name.
+        fd, tmp_file = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        os.close(fd)
+        os.remove(tmp_file)
+        try:
+            dump(connection, tmp_file)
+            os.rename(tmp_file, self.path(key, connection))
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        self.evict(keep=self.path(key, connection))
+
+    def evict(self, keep=None):
+        """Remove the least recently used snapshots beyond the size limit."""
+        if not self.max_size:
+            return
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.'):
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            snapshots.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in snapshots)
+        for _, size, filename in sorted(snapshots):
+            if total <= self.max_size:
+                break
+            if filename == keep:
+                continue
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            total -= size
+
+
+def _log(message):
+    sys.stderr.write(message + '\n')
+
+
+def _restore(creation, snapshot, verbosity, autoclobber, serialize):
+    """Do what create_test_db() does, loading the snapshot to migrate."""
+    from django.conf import settings
+    from django.core.management import call_command
+    connection = creation.connection
+    test_database_name = creation._get_test_db_name()
+    if verbosity >= 1:
+        _log("Restoring test database for alias %s from snapshot %s..." % (
+            creation._get_database_display_str(verbosity,
+                                               test_database_name),
+            os.path.basename(snapshot)))
+    creation._create_test_db(verbosity, autoclobber, False)
+    connection.close()
+    settings.DATABASES[connection.alias]['NAME'] = test_database_name
+    connection.settings_dict['NAME'] = test_database_name
+    load(connection, snapshot)
+    if serialize:
+        connection._test_serialized_contents = (
+            creation.serialize_db_to_string())
+    call_command('createcachetable', database=connection.alias)
+    connection.ensure_connection()
+    return test_database_name
+
+
+def wrap_create_test_db(original, snapshots):
+    def create_test_db(self, verbosity=1, autoclobber=False, serialize=True,
+                       keepdb=False):
+        connection = self.connection
+        if keepdb or not snapshots.supports(connection):
+            return original(self, verbosity, autoclobber, serialize, keepdb)
+        key = snapshot_key(connection)
+        snapshot = snapshots.get(key, connection)
+        if snapshot is not None:
+            try:
+                return _restore(self, snapshot, verbosity, autoclobber,
+                                serialize)
+            except SnapshotError as e:
+                _log("Restoring the test database snapshot failed, "
+                     "migrating instead: %s" % e)
+                # Start over with a fresh test database.
+                autoclobber = True
+        name = original(self, verbosity, autoclobber, serialize, keepdb)
+        try:
+            snapshots.save(key, connection)
+        except (SnapshotError, OSError, IOError) as e:
+            _log("Saving the test database snapshot failed: %s" % e)
+        return name
+
+    create_test_db.snapshots = snapshots
+    return create_test_db
+
+
+def install(directory, max_size=0):
+    """Have django's test database creation use snapshots in ``directory``.
+
+    ``max_size`` is the size limit of the directory in bytes, 0 for no
+    limit.
+
+    """
+    from django.db.backends.base.creation import BaseDatabaseCreation
+    current = BaseDatabaseCreation.create_test_db
+    original = getattr(current, 'original', current)
+    wrapped = wrap_create_test_db(original, Snapshots(directory, max_size))
+    wrapped.original = original
+    BaseDatabaseCreation.create_test_db = wrapped
@@ -0,0 +1,241 @@
+"""Helpers for running ``bin/test`` with multiple worker processes.
+
+The master process splits the test labels over a number of workers. Every
+worker is the same ``bin/test`` script, started with the ``WORKER_ENV`` and
+``LABELS_ENV`` environment variables set. A worker runs only its own labels
+against its own test databases. The master prints the output of each
+worker, a summary that adds up the workers' results and exits with a
+failure code when any worker failed.
+
+"""
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+WORKER_ENV = 'DJANGORECIPE_TEST_WORKER'
+LABELS_ENV = 'DJANGORECIPE_TEST_LABELS'
+PARALLEL_FLAG = '--test-parallel'
+# The end of unittest's output: 'Ran 3 tests in 0.1s' and 'OK',
+# 'OK (skipped=1)' or 'FAILED (failures=1, errors=2)'.
+RAN = re.compile(r'^Ran (\d+) tests? in ', re.M)
+RESULT = re.compile(r'^(OK|FAILED)(?: \((.*)\))?\s*$', re.M)
+# unittest's order of the counts.
+COUNTS = ('failures', 'errors', 'skipped', 'expected failures',
+          'unexpected successes')
+
+
+def worker_number():
+    """Return the worker number when running as a worker, otherwise None."""
+    return os.environ.get(WORKER_ENV) or None
+
+
+def worker_labels():
+    return os.environ.get(LABELS_ENV, '').split()
+
+
+def parse_workers(value):
+    """Return the number of workers for a ``test-parallel`` value."""
+    if value in (None, '', False):
+        return 1
+    if str(value).lower() in ('auto', 'true'):
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+    return max(int(value), 1)
+
+
+def pop_parallel_flag(arguments, default=None):
+    """Remove ``--test-parallel[=N]`` from the arguments, return its value.
+
+    Without a value, the flag means 'one worker per cpu'.
+
+    """
+    value = default
+    remaining = []
+    for argument in arguments:
+        if argument == PARALLEL_FLAG:
+            value = 'auto'
+        elif argument.startswith(PARALLEL_FLAG + '='):
+            value = argument.split('=', 1)[1]
+        else:
+            remaining.append(argument)
+    arguments[:] = remaining
+    return value
+
+
+def test_command_options():
+    """Return {option string: nargs} of django's test command."""
+    from django.core.management.commands.test import Command
+    parser = Command().create_parser('test', 'test')
+    return dict((option, action.nargs) for action in parser._actions
+                for option in action.option_strings)
+
+
+def _option(argument, options):
+    """Return the option string of the argument, or None."""
+    if argument in options:
+        return argument
+    if argument.startswith('--') and '=' not in argument:
+        # argparse accepts unambiguous prefixes.
+        candidates = [option for option in options
+                      if option.startswith(argument)]
+        if len(candidates) == 1:
+            return candidates[0]
+    return None
+
+
+def split_arguments(arguments, options=None):
+    """Return (labels, options) of the test command's arguments.
+
+    The workers get their labels from the master: the labels on the command
+    line must not be passed on to every worker with the options. Options
+    taking a value are recognized by the test command's parser, like
+    argparse does it.
+
+    """
+    if options is None:
+        options = test_command_options()
+    labels = []
+    remaining = []
+    index = 0
+    while index < len(arguments):
+        argument = arguments[index]
+        index += 1
+        if argument == '--':
+            labels.extend(arguments[index:])
+            break
+        if not argument.startswith('-') or argument == '-':
+            labels.append(argument)
+            continue
+        remaining.append(argument)
+        option = _option(argument, options)
+        nargs = options.get(option, 0)
+        if nargs == 0 or index == len(arguments):
+            continue
+        if nargs == '?' and arguments[index].startswith('-'):
+            # The value is optional and not there.
+            continue
+        remaining.append(arguments[index])
+        index += 1
+    return labels, remaining
+
+
+def split_labels(labels, workers):
+    """Distribute the labels round-robin over at most ``workers`` chunks."""
+    workers = min(workers, len(labels))
+    return [labels[i::workers] for i in range(workers)]
+
+
+def isolate_test_databases(worker):
+    """Give every database its own test database name for this worker.
+
+    In-memory sqlite test databases are private to the process already.
+
+    """
+    from django.conf import settings
+    for alias, database in settings.DATABASES.items():
+        test_settings = database.setdefault('TEST', {})
+        name = test_settings.get('NAME')
+        if database.get('ENGINE', '').endswith('sqlite3') and not name:
+            continue
+        if not name:
+            name = 'test_%s' % database.get('NAME', alias)
+        test_settings['NAME'] = '%s_%s' % (name, worker)
+
+
+def parse_result(output):
+    """Return (tests run, {count: number}) of a worker's output, or None.
+
+    The counts are the ones unittest reports in its last line: failures,
+    errors, skipped and so on.
+
+    """
+    ran = RAN.findall(output)
+    if not ran:
+        return None
+    counts = {}
+    results = RESULT.findall(output)
+    if results and results[-1][1]:
+        for item in results[-1][1].split(', '):
+            name, _, number = item.partition('=')
+            if number.isdigit():
+                counts[name] = int(number)
+    return int(ran[-1]), counts
+
+
+def summary(results):
+    """Return the lines of the combined summary of the workers' results.
+
+    ``results`` is a list of (number, labels, exit code, parsed result).
+
+    """
+    lines = []
+    total = 0
+    counts = {}
+    exit_code = 0
+    for number, labels, returncode, result in results:
+        lines.append('Worker %s (%s): %s' % (
+            number, ' '.join(labels),
+            returncode and 'FAILED (exit code %s)' % returncode or 'OK'))
+        if result is None:
+            lines.append('Worker %s reported no test results' % number)
+        else:
+            total += result[0]
+            for name, count in result[1].items():
+                counts[name] = counts.get(name, 0) + count
+        if returncode and not exit_code:
+            exit_code = returncode
+    lines.append('Ran %s test%s in %s workers' % (
+        total, total != 1 and 's' or '', len(results)))
+    names = [name for name in COUNTS if counts.get(name)]
+    names.extend(sorted(name for name in counts
+                        if name not in COUNTS and counts[name]))
+    result = exit_code and 'FAILED' or 'OK'
+    if names:
+        result += ' (%s)' % ', '.join('%s=%s' % (name, counts[name])
+                                      for name in names)
+    lines.append(result)
+    return lines
+
+
+def run_workers(chunks, arguments, out=None):
+    """Run a worker process per chunk of labels, return the exit code.
+
+    Workers write to temporary files so they don't block on a full pipe;
+    their output is printed per worker once they're all finished.
+
+    """
+    out = out or sys.stdout
+    processes = []
+    for number, labels in enumerate(chunks, 1):
+        env = dict(os.environ)
+        env[WORKER_ENV] = str(number)
+        env[LABELS_ENV] = ' '.join(labels)
+        output = tempfile.TemporaryFile()
+        process = subprocess.Popen(
+            [sys.executable, sys.argv[0]] + list(arguments),
+            env=env, stdout=output, stderr=subprocess.STDOUT)
+        processes.append((number, labels, process, output))
+
+    results = []
+    for number, labels, process, output in processes:
+        returncode = process.wait()
+        output.seek(0)
+        text = output.read().decode('utf-8', 'replace')
+        output.close()
+        out.write('==== Worker %s: %s\n' % (number, ' '.join(labels)))
+        out.write(text)
+        results.append((number, labels, returncode, parse_result(text)))
+
+    out.write('==== Summary\n')
+    for line in summary(results):
+        out.write(line + '\n')
+    out.flush()
+    for _, _, returncode, _ in results:
+        if returncode:
+            return returncode
+    return 0
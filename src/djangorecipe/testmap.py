@@ -0,0 +1,195 @@
+"""Map of which test touches which files, for ``bin/test --changed``.
+
+While the tests run, coverage records every test in its own dynamic context
+(the test id). Afterwards, the files each test executed are stored in a json
+file next to the buildout. ``bin/test --changed`` then only runs the tests
+that touched a modified file, plus every test that isn't in the map yet.
+
+With parallel tests, every worker saves the ids of the tests it ran next to
+the map and the master merges them after combining the coverage data.
+
+"""
+import json
+import os
+import subprocess
+import unittest
+
+MAP_VERSION = 1
+CHANGED_FLAG = '--changed'
+CHANGED_MODES = ('all', 'git', 'mtime')
+
+
+def pop_changed_flag(arguments):
+    """Remove ``--changed[=git|mtime]`` from the arguments, return the mode.
+
+    Returns None when the flag isn't there. ``--changed`` on its own means
+    'both git and mtime'.
+
+    """
+    mode = None
+    remaining = []
+    for argument in arguments:
+        if argument == CHANGED_FLAG:
+            mode = 'all'
+        elif argument.startswith(CHANGED_FLAG + '='):
+            mode = argument.split('=', 1)[1]
+        else:
+            remaining.append(argument)
+    arguments[:] = remaining
+    return mode
+
+
+def record_contexts(cov):
+    """Make coverage record every test in a context named after its id.
+
+    Returns the set that collects the ids of the tests that ran.
+
+    """
+    ran = set()
+    original_run = unittest.TestCase.run
+
+    def run(self, result=None):
+        test_id = self.id()
+        ran.add(test_id)
+        cov.switch_context(test_id)
+        try:
+            return original_run(self, result)
+        finally:
+            cov.switch_context('')
+
+    unittest.TestCase.run = run
+    return ran
+
+
+def save_ran(filename, ran):
+    """Save the ids of the tests a worker ran, next to the test map."""
+    with open('%s.ran.%s' % (filename, os.getpid()), 'w') as f:
+        json.dump(sorted(ran), f)
+
+
+def collect_ran(filename):
+    """Return and remove the ids of the tests the workers ran."""
+    ran = set()
+    directory, name = os.path.split(os.path.abspath(filename))
+    prefix = name + '.ran.'
+    for ran_file in sorted(os.listdir(directory)):
+        if not ran_file.startswith(prefix):
+            continue
+        ran_file = os.path.join(directory, ran_file)
+        try:
+            with open(ran_file) as f:
+                ran.update(json.load(f))
+        except (IOError, OSError, ValueError):
+            pass
+        os.remove(ran_file)
+    return ran
+
+
+def iter_tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for subtest in iter_tests(test):
+                yield subtest
+        else:
+            yield test
+
+
+def discover_tests(labels):
+    """Return the ids of the tests django's test runner would run."""
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+    from django.conf import settings
+    from django.test.utils import get_runner
+    runner = get_runner(settings)()
+    suite = runner.build_suite(list(labels))
+    return [test.id() for test in iter_tests(suite)]
+
+
+def _git_changed_files():
+    def git(*arguments):
+        output = subprocess.check_output(('git',) + arguments,
+                                         stderr=subprocess.STDOUT)
+        return output.decode('utf-8').splitlines()
+
+    root = git('rev-parse', '--show-toplevel')[0]
+    names = git('diff', '--name-only', 'HEAD')
+    names += git('ls-files', '--others', '--exclude-standard')
+    return set(os.path.realpath(os.path.join(root, name))
+               for name in names if name)
+
+
+class TestMap(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.tests = {}
+        self.files = {}
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') == MAP_VERSION:
+            self.tests = data['tests']
+            self.files = data['files']
+
+    def save(self):
+        with open(self.filename, 'w') as f:
+            json.dump({'version': MAP_VERSION,
+                       'tests': self.tests,
+                       'files': self.files},
+                      f, indent=1, sort_keys=True)
+
+    def update(self, data, ran=()):
+        """Store the files every test in the coverage data touched.
+
+        Only the tests in this run are updated, the rest is kept as-is.
+
+        """
+        touched = dict((test_id, set()) for test_id in ran)
+        # Our own TestCase.run wrapper runs inside every test's context.
+        ourselves = os.path.realpath(os.path.splitext(__file__)[0] + '.py')
+        for filename in data.measured_files():
+            real_filename = os.path.realpath(filename)
+            if real_filename == ourselves:
+                continue
+            for contexts in data.contexts_by_lineno(filename).values():
+                for context in contexts:
+                    if context:
+                        touched.setdefault(context, set()).add(real_filename)
+            if os.path.exists(real_filename):
+                self.files[real_filename] = os.path.getmtime(real_filename)
+        for test_id, filenames in touched.items():
+            self.tests[test_id] = sorted(filenames)
+
+    def changed_files(self, mode='all'):
+        """Return the files changed since they were recorded.
+
+        ``git`` mode asks git for uncommitted and untracked files, ``mtime``
+        mode compares modification times against those in the map.
+
+        """
+        changed = set()
+        if mode in ('all', 'git'):
+            try:
+                changed.update(_git_changed_files())
+            except (OSError, IndexError, subprocess.CalledProcessError):
+                # Not a git checkout (or no git): mtimes are all we have.
+                mode = 'all'
+        if mode in ('all', 'mtime'):
+            for filename, mtime in self.files.items():
+                if (not os.path.exists(filename) or
+                        os.path.getmtime(filename) != mtime):
+                    changed.add(filename)
+        return changed
+
+    def select(self, test_ids, changed):
+        """Return the tests affected by the changed files, in order.
+
+        Tests that aren't in the map yet are always selected.
+
+        """
+        return [test_id for test_id in test_ids
+                if test_id not in self.tests or
+                changed.intersection(self.tests[test_id])]
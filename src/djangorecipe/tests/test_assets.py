@@ -0,0 +1,114 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from djangorecipe import assets
+
+SETTINGS = """
+import os
+BASE = os.path.dirname(os.path.abspath(__file__))
+SECRET_KEY = 'assets'
+INSTALLED_APPS = ['django.contrib.staticfiles']
+STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BASE, 'collected')
+STATICFILES_DIRS = [os.path.join(BASE, 'static')]
+TEMPLATES = [{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'DIRS': [os.path.join(BASE, 'templates')],
+}]
+"""
+
+
+class TestBuildSteps(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-assets')
+        for directory in ('static', 'templates'):
+            os.mkdir(os.path.join(self.tmp_dir, directory))
+        self.write('assets_settings.py', SETTINGS)
+        self.write('static/site.css', 'body {}')
+        self.write('templates/index.html',
+                   '{% if page %}{{ page }}{% endif %}')
+        self.state_file = os.path.join(self.tmp_dir, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmp_dir, name), 'w') as f:
+            f.write(content)
+
+    def run_steps(self, *steps):
+        results = assets.run(steps, 'assets_settings',
+                             [self.tmp_dir] + sys.path, self.state_file,
+                             cwd=self.tmp_dir)
+        self.assertTrue(results['setup'] > 0)
+        return dict((result['step'], result) for result in results['steps'])
+
+    def test_skip_unchanged(self):
+        results = self.run_steps('collectstatic', 'templates')
+        self.assertFalse(results['collectstatic']['skipped'])
+        self.assertTrue('1 static file copied' in
+                        results['collectstatic']['output'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp_dir, 'collected', 'site.css')))
+        self.assertTrue('1 templates compiled' in
+                        results['templates']['output'])
+
+        results = self.run_steps('collectstatic', 'templates')
+        self.assertTrue(results['collectstatic']['skipped'])
+        self.assertTrue(results['templates']['skipped'])
+
+        # Changed content.
+        self.write('static/site.css', 'body { margin: 0 }')
+        results = self.run_steps('collectstatic', 'templates')
+        self.assertFalse(results['collectstatic']['skipped'])
+        self.assertTrue(results['templates']['skipped'])
+
+        # The output is gone.
+        shutil.rmtree(os.path.join(self.tmp_dir, 'collected'))
+        self.assertFalse(
+            self.run_steps('collectstatic')['collectstatic']['skipped'])
+
+    def test_template_error(self):
+        self.write('templates/broken.html', '{% if page %}')
+        result = self.run_steps('templates')['templates']
+        self.assertTrue('broken.html' in result['error'])
+        # A failed step runs again next time.
+        self.assertFalse(self.run_steps('templates')['templates']['skipped'])
+
+    def test_locale_inputs(self):
+        app_configs = []
+        for app in ('app', 'eggs/egg.egg/egg', '.hidden/app', 'other'):
+            directory = os.path.join(self.tmp_dir, app, 'locale', 'nl',
+                                     'LC_MESSAGES')
+            os.makedirs(directory)
+            self.write(os.path.join(directory, 'django.po'), '')
+            if app != 'other':
+                app_configs.append(
+                    mock.Mock(path=os.path.join(self.tmp_dir, app)))
+        po_file = os.path.join(self.tmp_dir, 'app', 'locale', 'nl',
+                               'LC_MESSAGES', 'django.po')
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir)
+        try:
+            with mock.patch('django.conf.settings',
+                            mock.Mock(LOCALE_PATHS=[])), \
+                    mock.patch('django.apps.apps.get_app_configs',
+                               return_value=app_configs):
+                # Only the installed apps outside of the eggs.
+                _, files, done = assets.locale_inputs()
+                self.assertEqual(files, [os.path.abspath(po_file)])
+                self.assertFalse(done)
+                self.write(po_file[:-3] + '.mo', '')
+                self.assertTrue(assets.locale_inputs()[2])
+        finally:
+            os.chdir(cwd)
+
+    def test_process_failed(self):
+        self.assertRaises(assets.BuildError, assets.run, ['templates'],
+                          'no_such_settings', sys.path, self.state_file)
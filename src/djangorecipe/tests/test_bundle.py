@@ -0,0 +1,79 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+import pkg_resources
+
+from djangorecipe import bundle
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-bundle')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_egg(self, name, files):
+        location = os.path.join(self.tmp_dir, '%s-1.0.egg' % name)
+        for filename, contents in files.items():
+            path = os.path.join(location, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(contents)
+        return pkg_resources.Distribution(location, project_name=name,
+                                          version='1.0')
+
+    def test_classify(self):
+        pure = self.make_egg('pure', {'pure/__init__.py': 'x = 1\n',
+                                      'pure/sub/mod.py': 'y = 2\n'})
+        compiled = self.make_egg('compiled', {'compiled/__init__.py': '',
+                                              'compiled/_speedups.so': ''})
+        data = self.make_egg('data', {'data/__init__.py': '',
+                                      'data/templates/base.html': ''})
+        uses_file = self.make_egg(
+            'uses_file', {'uses_file/__init__.py': 'x = 1\n',
+                          'uses_file/paths.py': 'BASE = __file__\n'})
+        lib_dir = os.path.join(self.tmp_dir, 'lib')
+        os.makedirs(lib_dir)
+        with open(os.path.join(lib_dir, 'helpers.py'), 'w') as f:
+            f.write('')
+        zipped, on_disk = bundle.classify(
+            [pure, compiled, data, uses_file], [(lib_dir, None)])
+        self.assertEqual(zipped, [(os.path.join(pure.location, 'pure'), pure),
+                                  (os.path.join(lib_dir, 'helpers.py'),
+                                   None)])
+        self.assertEqual(on_disk, [compiled.location, data.location,
+                                   uses_file.location])
+
+    def test_write_bundle(self):
+        pure = self.make_egg('pure', {'pure/__init__.py': 'x = 1\n',
+                                      'pure/sub/__init__.py': '',
+                                      'pure/sub/mod.py': 'y = 2\n'})
+        other = self.make_egg('other', {'pure/__init__.py': 'x = 3\n'})
+        filename = os.path.join(self.tmp_dir, 'parts', 'bundle.pyz')
+        zipped = [(os.path.join(pure.location, 'pure'), pure),
+                  (os.path.join(other.location, 'pure'), other)]
+        main = "import pure.sub.mod\nprint(pure.x + pure.sub.mod.y)\n"
+        self.assertEqual(bundle.write_bundle(filename, zipped, main), [])
+        names = zipfile.ZipFile(filename).namelist()
+        self.assertTrue('pure/sub/mod.py' in names)
+        if bundle.HASH_BASED:
+            self.assertTrue('pure/sub/mod.pyc' in names)
+        # The first 'pure' wins, like it would on sys.path.
+        output = subprocess.check_output([sys.executable, filename])
+        self.assertEqual(output.strip(), b'3')
+
+        # An unchanged bundle isn't replaced.
+        os.utime(filename, (1, 1))
+        bundle.write_bundle(filename, zipped, main)
+        self.assertEqual(os.path.getmtime(filename), 1)
+
+    def test_lookup_time(self):
+        self.assertTrue(bundle.lookup_time(['os'], sys.path) >= 0)
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from djangorecipe import bytecode
+
+
+class TestBytecode(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-bytecode')
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        self.state_file = os.path.join(self.tmp_dir, 'cache', 'state.json')
+        os.makedirs(os.path.join(self.source_dir, 'pkg'))
+        os.makedirs(os.path.join(self.source_dir, '.git'))
+        os.makedirs(os.path.join(self.source_dir, 'parts'))
+        for name in ('pkg/__init__.py', 'pkg/mod.py', '.git/hook.py',
+                     'parts/generated.py', 'README.txt'):
+            self.write(name, 'x = 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, contents):
+        with open(os.path.join(self.source_dir, name), 'w') as f:
+            f.write(contents)
+
+    def test_find_sources(self):
+        sources = list(bytecode.find_sources(
+            [self.source_dir, os.path.join(self.source_dir, 'pkg')],
+            exclude=[os.path.join(self.source_dir, 'parts')]))
+        self.assertEqual(
+            [os.path.relpath(path, self.source_dir) for path in sources],
+            [os.path.join('pkg', '__init__.py'), os.path.join('pkg',
+                                                              'mod.py')])
+
+    def test_compile_sources(self):
+        compiled, total, errors, seconds = bytecode.compile_sources(
+            [self.source_dir], self.state_file)
+        self.assertEqual((compiled, total, errors), (3, 3, []))
+        mod = os.path.join(self.source_dir, 'pkg', 'mod.py')
+        self.assertTrue(os.path.exists(bytecode.cache_from_source(mod)))
+
+        # Nothing changed: nothing is compiled.
+        self.assertEqual(bytecode.compile_sources(
+            [self.source_dir], self.state_file)[:2], (0, 3))
+
+        # A changed source, a touched one and a removed .pyc.
+        self.write('pkg/mod.py', 'x = 2\n')
+        os.utime(os.path.join(self.source_dir, 'pkg', '__init__.py'),
+                 (1, 1))
+        os.remove(bytecode.cache_from_source(
+            os.path.join(self.source_dir, 'parts', 'generated.py')))
+        expected = bytecode.HASH_BASED and 2 or 3
+        self.assertEqual(bytecode.compile_sources(
+            [self.source_dir], self.state_file)[0], expected)
+
+    def test_compile_errors(self):
+        self.write('pkg/broken.py', 'def (\n')
+        compiled, total, errors, seconds = bytecode.compile_sources(
+            [self.source_dir], self.state_file)
+        self.assertEqual((compiled, total), (3, 4))
+        self.assertEqual(errors[0][0],
+                         os.path.join(self.source_dir, 'pkg', 'broken.py'))
+        # It isn't recorded, so it is tried again.
+        self.assertEqual(len(bytecode.compile_sources(
+            [self.source_dir], self.state_file)[2]), 1)
+
+    def test_pool(self):
+        for number in range(bytecode.POOL_THRESHOLD):
+            self.write('pkg/mod%s.py' % number, 'x = %s\n' % number)
+        with mock.patch('multiprocessing.Pool') as pool:
+            pool.return_value.map.side_effect = (
+                lambda function, todo, chunksize: list(map(function, todo)))
+            compiled = bytecode.compile_sources(
+                [self.source_dir], self.state_file, workers=3)[0]
+        pool.assert_called_with(3)
+        self.assertEqual(compiled, bytecode.POOL_THRESHOLD + 3)
@@ -0,0 +1,140 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import mock
+
+from djangorecipe import commands
+
+SETTINGS = """
+SECRET_KEY = 'commands'
+INSTALLED_APPS = ['django.contrib.staticfiles']
+STATIC_URL = '/static/'
+"""
+
+INDEX = {
+    'version': commands.INDEX_VERSION,
+    'django': '5.2',
+    'settings': 'project.settings',
+    'prog': 'django',
+    'app_labels': ['shop', 'staticfiles'],
+    'watched': {},
+    'commands': {
+        'migrate': {'app': 'django.core', 'help': 'usage: django migrate\n',
+                    'options': [['--database', True], ['--fake', False]]},
+        'dumpdata': {'app': 'django.core', 'help': 'usage: django dumpdata\n',
+                     'options': [['--format', True]]},
+        'collectstatic': {'app': 'django.contrib.staticfiles',
+                          'help': 'usage: django collectstatic\n',
+                          'options': [['--noinput', False]]},
+        'broken': {'app': 'shop', 'help': None, 'options': None},
+    },
+}
+
+
+class TestAnswers(unittest.TestCase):
+
+    def answer(self, argv, environ=None):
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            answered = commands.answer(INDEX, argv, environ or {})
+        return answered, stdout.getvalue()
+
+    def complete(self, words, cword):
+        return self.answer(['bin/django'], {
+            'DJANGO_AUTO_COMPLETE': '1', 'COMP_WORDS': words,
+            'COMP_CWORD': str(cword)})[1]
+
+    def test_is_index_request(self):
+        for argv in (['django'], ['django', 'help'], ['django', '-h'],
+                     ['django', 'help', 'migrate'],
+                     ['django', 'migrate', '--help']):
+            self.assertTrue(commands.is_index_request(argv, {}))
+        for argv in (['django', 'migrate'],
+                     ['django', 'migrate', 'shop', '--help']):
+            self.assertFalse(commands.is_index_request(argv, {}))
+        self.assertTrue(commands.is_index_request(
+            ['django', 'migrate'], {'DJANGO_AUTO_COMPLETE': '1'}))
+
+    def test_main_help(self):
+        answered, output = self.answer(['bin/django', 'help'])
+        self.assertTrue(answered)
+        self.assertTrue(output.startswith(
+            "\nType 'django help <subcommand>' for help on a specific "
+            "subcommand.\n\nAvailable subcommands:\n\n[django]\n"
+            "    dumpdata\n    migrate\n\n[shop]\n    broken\n\n"
+            "[staticfiles]\n    collectstatic\n"))
+        self.assertEqual(self.answer(['django', 'help', '--commands'])[1],
+                         'broken\ncollectstatic\ndumpdata\nmigrate\n')
+
+    def test_command_help(self):
+        self.assertEqual(self.answer(['/bin/manage', 'help', 'migrate']),
+                         (True, 'usage: manage migrate\n'))
+        self.assertEqual(self.answer(['django', 'collectstatic', '-h'])[1],
+                         'usage: django collectstatic\n')
+        # Left to django.
+        self.assertFalse(self.answer(['django', 'help', 'broken'])[0])
+        self.assertFalse(self.answer(['django', 'help', 'nothing'])[0])
+
+    def test_complete(self):
+        self.assertEqual(self.complete('django m', 1), 'migrate\n')
+        self.assertEqual(self.complete('django migrate --', 2),
+                         '--database=\n--fake\n--help\n')
+        self.assertEqual(self.complete('django migrate --fake --', 3),
+                         '--database=\n--help\n')
+        self.assertEqual(self.complete('django dumpdata s', 2),
+                         'shop\nstaticfiles\n')
+        self.assertEqual(self.complete('django help m', 2), '')
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-commands')
+        self.settings_file = os.path.join(self.tmp_dir,
+                                          'commands_settings.py')
+        with open(self.settings_file, 'w') as f:
+            f.write(SETTINGS)
+        self.index_file = os.path.join(self.tmp_dir, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_build(self):
+        self.assertEqual(commands.build(
+            self.index_file, 'django', 'commands_settings',
+            [self.tmp_dir] + sys.path, cwd=self.tmp_dir), None)
+        index = commands.load_index(self.index_file, 'commands_settings')
+        self.assertEqual(index['app_labels'], ['staticfiles'])
+        collectstatic = index['commands']['collectstatic']
+        self.assertEqual(collectstatic['app'], 'django.contrib.staticfiles')
+        self.assertTrue(['--no-input', False] in collectstatic['options'])
+        self.assertTrue(collectstatic['help'].startswith(
+            'usage: django collectstatic'))
+        self.assertTrue(self.settings_file in index['watched'])
+
+        self.assertEqual(commands.load_index(self.index_file, 'other'), None)
+        # Changed settings.
+        mtime = time.time() + 10
+        os.utime(self.settings_file, (mtime, mtime))
+        self.assertEqual(
+            commands.load_index(self.index_file, 'commands_settings'), None)
+
+    def test_build_failed(self):
+        self.assertTrue('ModuleNotFoundError' in commands.build(
+            self.index_file, 'django', 'no_such_settings', sys.path))
+        self.assertEqual(commands.load_index(self.index_file, 'x'), None)
+
+    def test_watched_new_commands(self):
+        with open(self.index_file, 'w') as f:
+            json.dump(dict(INDEX, watched=commands.watched_files(
+                'project.settings', [self.tmp_dir])), f)
+        self.assertTrue(
+            commands.load_index(self.index_file, 'project.settings'))
+        os.makedirs(os.path.join(self.tmp_dir, 'management', 'commands'))
+        self.assertEqual(
+            commands.load_index(self.index_file, 'project.settings'), None)
@@ -0,0 +1,173 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import mock
+
+from djangorecipe import dispatch
+
+SETTINGS = """
+SECRET_KEY = 'dispatch'
+SITE_NAME = %r
+ROOT_URLCONF = 'urls'
+ALLOWED_HOSTS = ['*']
+INSTALLED_APPS = []
+DATABASES = {}
+"""
+
+URLS = """
+import os
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import path
+
+
+def index(request):
+    return HttpResponse('%s %s %s %s' % (
+        settings.SITE_NAME, request.path, request.body.decode(), os.getpid()))
+
+
+urlpatterns = [path('', index), path('page', index)]
+"""
+
+
+def environ(host='example.com', path='/', body=b''):
+    return {'REQUEST_METHOD': body and 'POST' or 'GET',
+            'HTTP_HOST': host, 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'SCRIPT_NAME': '', 'PATH_INFO': path,
+            'QUERY_STRING': '', 'CONTENT_LENGTH': str(len(body)),
+            'CONTENT_TYPE': 'text/plain',
+            'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+            'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False}
+
+
+class TestRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = dispatch.Dispatcher(
+            [('shop.example.com', 'shop'), ('*.blog.example.com', 'blog'),
+             ('/admin', 'admin'), ('/admin/stats', 'stats')],
+            idle_timeout=0)
+
+    def match(self, *args):
+        site, site_environ = self.dispatcher.match(environ(*args))
+        return (site.settings, site_environ['SCRIPT_NAME'],
+                site_environ['PATH_INFO'])
+
+    def test_parse_routes(self):
+        hosts, prefixes, default = dispatch.parse_routes(
+            [('Example.com', 'a'), ('/b/', 'b'), ('/b/c', 'c'), ('*', 'd')])
+        self.assertEqual(hosts, {'example.com': 'a'})
+        self.assertEqual(prefixes, [('/b/c', 'c'), ('/b', 'b')])
+        self.assertEqual(default, 'd')
+
+    def test_hosts(self):
+        self.assertEqual(self.match('shop.example.com:8080', '/x'),
+                         ('shop', '', '/x'))
+        self.assertEqual(self.match('blog.example.com'), ('blog', '', '/'))
+        self.assertEqual(self.match('me.blog.example.com'), ('blog', '', '/'))
+
+    def test_most_specific_host(self):
+        routes = [('*.example.com', 'all'), ('*.blog.example.com', 'blog')]
+        for routes in (routes, routes[::-1]):
+            dispatcher = dispatch.Dispatcher(routes, idle_timeout=0)
+            site, _ = dispatcher.match(environ('me.blog.example.com'))
+            self.assertEqual(site.settings, 'blog')
+            site, _ = dispatcher.match(environ('shop.example.com'))
+            self.assertEqual(site.settings, 'all')
+
+    def test_prefixes(self):
+        self.assertEqual(self.match('other.com', '/admin/stats/x'),
+                         ('stats', '/admin/stats', '/x'))
+        self.assertEqual(self.match('other.com', '/admin'),
+                         ('admin', '/admin', ''))
+        self.assertEqual(self.dispatcher.match(
+            environ('other.com', '/administration')), None)
+
+    def test_unknown_site(self):
+        start_response = mock.Mock()
+        self.assertEqual(self.dispatcher(environ('other.com'),
+                                         start_response),
+                         [b'No site for this host.\n'])
+        self.assertEqual(start_response.call_args[0][0], '404 Not Found')
+
+    def test_not_sent(self):
+        _, site_environ = self.dispatcher.match(environ('shop.example.com'))
+        self.assertFalse('wsgi.input' in site_environ)
+        self.assertEqual(site_environ['wsgi.version'], (1, 0))
+
+
+class TestSites(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-dispatch')
+        for name in ('one', 'two'):
+            with open(os.path.join(self.tmp_dir, name + '.py'), 'w') as f:
+                f.write(SETTINGS % name)
+        with open(os.path.join(self.tmp_dir, 'urls.py'), 'w') as f:
+            f.write(URLS)
+        sys.path.insert(0, self.tmp_dir)
+        self.dispatcher = dispatch.Dispatcher(
+            [('one.example.com', 'one'), ('/two', 'two')], idle_timeout=0)
+
+    def tearDown(self):
+        self.dispatcher.close()
+        sys.path.remove(self.tmp_dir)
+        shutil.rmtree(self.tmp_dir)
+
+    def request(self, *args):
+        start_response = mock.Mock()
+        body = b''.join(self.dispatcher(environ(*args), start_response))
+        return start_response.call_args[0][0], body.decode().split()
+
+    def test_sites(self):
+        status, one = self.request('one.example.com', '/page', b'spam')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(one[:3], ['one', '/page', 'spam'])
+        status, two = self.request('example.com', '/two/page')
+        self.assertEqual(two[:2], ['two', '/two/page'])
+        # Separate processes, the worker is reused.
+        self.assertNotEqual(one[3], two[2])
+        self.assertEqual(self.request('one.example.com', '/')[1][2], one[3])
+
+    def test_unload(self):
+        site = self.dispatcher.sites['one']
+        pid = self.request('one.example.com', '/')[1][-1]
+        self.assertEqual(site.unload(idle_timeout=60), 0)
+        site.last_used = time.time() - 61
+        self.assertEqual(site.unload(idle_timeout=60), 1)
+        self.assertEqual(site.running, 0)
+        # Loaded again when needed.
+        self.assertNotEqual(self.request('one.example.com', '/')[1][-1], pid)
+
+    def test_worker_died(self):
+        site = self.dispatcher.sites['one']
+        self.request('one.example.com', '/')
+        os.kill(site.idle[0].process.pid, 9)
+        site.idle[0].process.wait()
+        with mock.patch.object(sys, 'stderr'):
+            status, _ = self.request('one.example.com', '/')
+        self.assertEqual(status, '502 Bad Gateway')
+        self.assertEqual(self.request('one.example.com', '/')[0], '200 OK')
+
+    def test_initialization(self):
+        marker = os.path.join(self.tmp_dir, 'initialized')
+        dispatcher = dispatch.Dispatcher(
+            [('*', 'one')], idle_timeout=0, initialization=(
+                "with open(%r, 'w') as f:\n"
+                "    f.write(os.environ['DJANGO_SETTINGS_MODULE'])" % marker))
+        try:
+            start_response = mock.Mock()
+            dispatcher(environ(), start_response)
+            self.assertEqual(start_response.call_args[0][0], '200 OK')
+        finally:
+            dispatcher.close()
+        with open(marker) as f:
+            self.assertEqual(f.read(), 'one')
@@ -0,0 +1,164 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import mock
+
+from djangorecipe import forkserver
+
+CLIENT = """
+import sys
+from djangorecipe import forkserver
+forkserver.start_server = lambda address: None
+code = forkserver.run(sys.argv[1], 'forkserver_settings', [
+    'django', 'shell', '-c',
+    'import os; print("child %s" % os.getpid()); raise SystemExit(3)'])
+if code is None:
+    print('local')
+    code = 0
+sys.exit(code)
+"""
+
+
+class TestForkServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-forkserver')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_socket_path(self):
+        path = forkserver.socket_path(self.tmp_dir, 'project.settings')
+        self.assertTrue(path.startswith(
+            os.path.join(self.tmp_dir, 'forkserver', 'forkserver-')))
+        with mock.patch.dict(os.environ, {'PWD': '/elsewhere'}):
+            self.assertEqual(
+                forkserver.socket_path(self.tmp_dir, 'project.settings'),
+                path)
+        with mock.patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+            self.assertNotEqual(
+                forkserver.socket_path(self.tmp_dir, 'project.settings'),
+                path)
+        self.assertNotEqual(
+            forkserver.socket_path(self.tmp_dir, 'project.other'), path)
+        # Too long for a unix socket.
+        self.assertTrue(forkserver.socket_path(
+            os.path.join(self.tmp_dir, 'x' * 100), 'project.settings')
+            .startswith(tempfile.gettempdir()))
+
+    @mock.patch('djangorecipe.forkserver.start_server')
+    def test_run_without_server(self, start_server):
+        with open(os.devnull) as stdin:
+            with mock.patch.object(sys, 'stdin', stdin):
+                self.assertEqual(forkserver.run(
+                    self.tmp_dir, 'project.settings', ['django', 'check']),
+                    None)
+        self.assertTrue(start_server.called)
+        directory = os.path.join(self.tmp_dir, 'forkserver')
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+    @mock.patch('djangorecipe.forkserver.start_server')
+    def test_run_without_stdin(self, start_server):
+        # Closed or captured stdio can't be handed over: run it here.
+        with mock.patch.object(sys, 'stdin', None):
+            self.assertEqual(forkserver.run(
+                self.tmp_dir, 'project.settings', ['django', 'check']), None)
+        self.assertFalse(start_server.called)
+
+    def test_secure_directory(self):
+        directory = os.path.join(self.tmp_dir, 'sockets')
+        forkserver.secure_directory(directory)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        os.chmod(directory, 0o777)
+        forkserver.secure_directory(directory)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertRaises(OSError, forkserver.secure_directory,
+                              directory)
+        link = os.path.join(self.tmp_dir, 'link')
+        os.symlink(directory, link)
+        self.assertRaises(OSError, forkserver.secure_directory, link)
+
+    @mock.patch('subprocess.Popen')
+    def test_start_server_locked(self, popen):
+        address = os.path.join(self.tmp_dir, 'forkserver.sock')
+        lock = forkserver._lock(address)
+        forkserver.start_server(address)
+        self.assertFalse(popen.called)
+        lock.close()
+        forkserver.start_server(address)
+        self.assertTrue(popen.called)
+
+    def test_changed_listings(self):
+        commands = os.path.join(self.tmp_dir, 'commands')
+        missing = os.path.join(self.tmp_dir, 'missing')
+        os.mkdir(commands)
+        listings = {commands: [], missing: None}
+        self.assertFalse(forkserver.changed({}, listings))
+        open(os.path.join(commands, 'new.py'), 'w').close()
+        self.assertTrue(forkserver.changed({}, listings))
+        listings = {commands: ['new.py'], missing: None}
+        os.mkdir(missing)
+        self.assertTrue(forkserver.changed({}, listings))
+
+    @mock.patch('djangorecipe.forkserver.start_server')
+    def test_run_not_forked(self, start_server):
+        self.assertEqual(forkserver.run(self.tmp_dir, 'project.settings',
+                                        ['django', 'runserver']), None)
+        with mock.patch.dict(os.environ, {forkserver.ENVIRON: '0'}):
+            self.assertEqual(forkserver.run(
+                self.tmp_dir, 'project.settings', ['django', 'check']), None)
+        with mock.patch.dict(os.environ,
+                             {'DJANGO_SETTINGS_MODULE': 'project.other'}):
+            self.assertEqual(forkserver.run(
+                self.tmp_dir, 'project.settings', ['django', 'check']), None)
+        self.assertFalse(start_server.called)
+
+    def test_server(self):
+        settings = os.path.join(self.tmp_dir, 'forkserver_settings.py')
+        with open(settings, 'w') as f:
+            f.write("SECRET_KEY = 'secret'\nINSTALLED_APPS = []\n")
+        env = dict(os.environ)
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+        env.pop(forkserver.ENVIRON, None)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [self.tmp_dir] + [path for path in sys.path if path])
+        server = subprocess.Popen(
+            [sys.executable, '-c',
+             'import sys; from djangorecipe import forkserver; '
+             'forkserver.serve(sys.argv[1], "forkserver_settings", 30)',
+             self.tmp_dir], env=env)
+        self.addCleanup(server.kill)
+        directory = os.path.join(self.tmp_dir, 'forkserver')
+
+        def sockets():
+            return [name for name in os.listdir(directory)
+                    if name.endswith('.sock')]
+
+        deadline = time.time() + 30
+        while not (os.path.isdir(directory) and sockets()):
+            self.assertTrue(time.time() < deadline)
+            self.assertEqual(server.poll(), None)
+            time.sleep(0.05)
+
+        client = subprocess.Popen(
+            [sys.executable, '-c', CLIENT, self.tmp_dir], env=env,
+            stdout=subprocess.PIPE)
+        output = client.communicate()[0].decode('utf-8')
+        self.assertEqual(client.returncode, 3)
+        self.assertTrue('child ' in output)
+        self.assertFalse('child %s' % client.pid in output)
+
+        # Changed settings: the server retires, the command runs locally.
+        os.utime(settings, (1, 1))
+        client = subprocess.Popen(
+            [sys.executable, '-c', CLIENT, self.tmp_dir], env=env,
+            stdout=subprocess.PIPE)
+        self.assertEqual(client.communicate()[0].strip(), b'local')
+        self.assertEqual(server.wait(), 0)
+        self.assertEqual(sockets(), [])
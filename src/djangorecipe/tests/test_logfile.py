@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from djangorecipe.logfile import BufferedLogFile
+
+
+class TestBufferedLogFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp('djangorecipe')
+        self.logfile = os.path.join(self.tempdir, 'wsgi.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_lines_are_buffered(self):
+        log = BufferedLogFile(self.logfile, flush_interval=60)
+        log.write('spam')
+        # Nothing has been written yet, the line sits in the buffer.
+        self.assertFalse(os.path.exists(self.logfile))
+        log.flush()
+        self.assertTrue(open(self.logfile).read().endswith(' - spam\n'))
+        log.close()
+
+    def test_flush_on_buffer_size(self):
+        log = BufferedLogFile(self.logfile, buffer_size=10, flush_interval=60)
+        log.write('more than ten bytes')
+        for i in range(50):
+            if os.path.exists(self.logfile):
+                break
+            time.sleep(0.05)
+        self.assertTrue('more than ten bytes' in open(self.logfile).read())
+        log.close()
+
+    def test_close_flushes(self):
+        log = BufferedLogFile(self.logfile, flush_interval=60)
+        log.write('eggs')
+        log.close()
+        self.assertTrue('eggs' in open(self.logfile).read())
+
+    def test_timestamp_format(self):
+        log = BufferedLogFile(self.logfile)
+        log.write('ham')
+        log.close()
+        line = open(self.logfile).read()
+        # Same format as the old per-write logger: '20160629 12:00:00 - ham'
+        time.strptime(line.split(' - ')[0], '%Y%m%d %H:%M:%S')
+
+    def test_rotation_on_size(self):
+        log = BufferedLogFile(self.logfile, max_bytes=10, backup_count=2)
+        for word in ['first', 'second', 'third']:
+            log.write(word)
+            log.flush()
+        log.close()
+        self.assertTrue('third' in open(self.logfile + '.1').read())
+        self.assertTrue('second' in open(self.logfile + '.2').read())
+        self.assertFalse(os.path.exists(self.logfile + '.3'))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork()')
+    def test_forked_child_writes(self):
+        log = BufferedLogFile(self.logfile, flush_interval=0.05)
+        log.write('parent')
+        log.flush()
+        pid = os.fork()
+        if not pid:
+            # The child's lines must reach the file without a flush() or
+            # close(): forked workers often exit with os._exit().
+            log.write('child')
+            for i in range(100):
+                if 'child' in open(self.logfile).read():
+                    os._exit(0)
+                time.sleep(0.05)
+            os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        log.close()
+        self.assertEqual(status, 0)
+        contents = open(self.logfile).read()
+        self.assertEqual(contents.count(' - parent\n'), 1)
+        self.assertTrue(' - child\n' in contents)
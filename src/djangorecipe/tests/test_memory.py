@@ -0,0 +1,59 @@
+import os
+import shutil
+import signal
+import tempfile
+import tracemalloc
+import unittest
+
+import mock
+
+from djangorecipe import memory
+
+
+class Leak(object):
+    pass
+
+
+class TestMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-memory')
+        self.directory = os.path.join(self.tmp_dir, 'memory')
+        tracemalloc.start(1)
+
+    def tearDown(self):
+        tracemalloc.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reports(self):
+        snapshots = memory.Snapshots(self.directory)
+        first = open(snapshots.write()).read()
+        self.assertTrue('Top 50 allocation sites:\n' in first)
+        leaked = [Leak() for _ in range(1000)]
+        with mock.patch('time.strftime', return_value='later'):
+            second = open(snapshots.write()).read()
+        self.assertTrue('change since the previous snapshot' in second)
+        # The allocation site and the type that grew.
+        self.assertTrue('test_memory.py:' in second)
+        self.assertTrue('      1000     +1000  %s.Leak\n' % __name__
+                        in second)
+        self.assertEqual(len(leaked), 1000)
+
+    def test_size(self):
+        self.assertEqual(memory._size(512), '512 B')
+        self.assertEqual(memory._size(3 * 1024 * 1024), '3 MiB')
+        self.assertEqual(memory._size(-2048, sign=True), '-2 KiB')
+        self.assertEqual(memory._size(2048, sign=True), '+2 KiB')
+
+    def test_install(self):
+        tracemalloc.stop()
+        previous = signal.getsignal(signal.SIGUSR2)
+        try:
+            snapshots = memory.install(self.directory, frames=3)
+            self.assertTrue(tracemalloc.is_tracing())
+            self.assertEqual(tracemalloc.get_traceback_limit(), 3)
+            self.assertEqual(snapshots.key_type, 'traceback')
+            os.kill(os.getpid(), signal.SIGUSR2)
+            self.assertEqual(len(os.listdir(self.directory)), 1)
+        finally:
+            signal.signal(signal.SIGUSR2, previous)
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from djangorecipe import metrics
+
+
+class Application(object):
+    """Looks like django's WSGIHandler to the metrics wrapper."""
+
+    def __init__(self, view_name, status='200 OK'):
+        self.view_name = view_name
+        self.status = status
+
+    def get_response(self, request):
+        request.resolver_match = self.view_name and mock.Mock(
+            view_name=self.view_name)
+        return [b'response']
+
+    def __call__(self, environ, start_response):
+        request = mock.Mock(environ=environ)
+        response = self.get_response(request)
+        start_response(self.status, [])
+        return response
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-metrics')
+        self.filename = os.path.join(self.tmp_dir, 'metrics', 'app.metrics')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_record(self):
+        recorder = metrics.Recorder(self.filename)
+        recorder.record('shop:index', 200, 0.003)
+        recorder.record('shop:index', 404, 0.2)
+        recorder.record('shop:cart', 500, 20)
+        totals = metrics.collect(self.filename)
+        statuses, buckets, total = totals['shop:index']
+        self.assertEqual(statuses, [0, 1, 0, 1, 0])
+        self.assertEqual(buckets[0], 1)
+        self.assertEqual(buckets[metrics.BUCKETS.index(0.25)], 1)
+        self.assertAlmostEqual(total, 0.203)
+        # Slower than the slowest bucket.
+        self.assertEqual(totals['shop:cart'][1][-1], 1)
+
+    def test_render(self):
+        recorder = metrics.Recorder(self.filename)
+        recorder.record('say "cheese"', 200, 0.02)
+        recorder.record('say "cheese"', 200, 0.04)
+        text = metrics.render(self.filename)
+        self.assertTrue('django_requests_total{view="say \\"cheese\\"",'
+                        'status="2xx"} 2\n' in text)
+        self.assertTrue('django_request_duration_seconds_bucket{'
+                        'view="say \\"cheese\\"",le="0.025"} 1\n' in text)
+        self.assertTrue('django_request_duration_seconds_bucket{'
+                        'view="say \\"cheese\\"",le="+Inf"} 2\n' in text)
+        self.assertTrue('django_request_duration_seconds_count{'
+                        'view="say \\"cheese\\""} 2\n' in text)
+
+    def test_processes(self):
+        recorder = metrics.Recorder(self.filename)
+        recorder.record('index', 200, 0.01)
+        children = []
+        for _ in range(3):
+            pid = os.fork()
+            if not pid:
+                # Forked workers claim regions of their own.
+                for _ in range(10):
+                    recorder.record('index', 200, 0.01)
+                os._exit(0)
+            children.append(pid)
+        for pid in children:
+            os.waitpid(pid, 0)
+        self.assertEqual(metrics.collect(self.filename)['index'][0][1], 31)
+
+    def test_dead_region_continued(self):
+        recorder = metrics.Recorder(self.filename, regions=1)
+        recorder.record('index', 200, 0.01)
+        metrics_file = metrics.MetricsFile(self.filename)
+        with mock.patch('djangorecipe.metrics._pid_alive',
+                        return_value=False):
+            self.assertEqual(metrics_file.claim_region(os.getpid() + 1), 0)
+        # The counts are continued.
+        self.assertEqual(metrics.collect(self.filename)['index'][0][1], 1)
+        # The only region belongs to a live process now.
+        other = metrics.Recorder(self.filename)
+        with mock.patch('djangorecipe.metrics._pid_alive',
+                        return_value=True):
+            other._claim()
+        self.assertEqual(other.region, None)
+        metrics_file.close()
+
+    def test_full_slots(self):
+        recorder = metrics.Recorder(self.filename, slots=3)
+        for view in ('a', 'b', 'c', 'd'):
+            recorder.record(view, 200, 0.01)
+        self.assertEqual(sorted(metrics.collect(self.filename)),
+                         ['<other>', 'a', 'b'])
+
+    def test_instrument(self):
+        application = metrics.instrument(Application('shop:index'),
+                                         self.filename, '/-/metrics')
+        start_response = mock.Mock()
+        self.assertEqual(application({'PATH_INFO': '/'}, start_response),
+                         [b'response'])
+        self.assertEqual(start_response.call_args[0][0], '200 OK')
+        unresolved = metrics.instrument(Application(None, '404 Not Found'),
+                                        self.filename)
+        unresolved({'PATH_INFO': '/nothing'}, start_response)
+        totals = metrics.collect(self.filename)
+        self.assertEqual(totals['shop:index'][0][1], 1)
+        self.assertEqual(totals['<unresolved>'][0][3], 1)
+
+        body = application({'PATH_INFO': '/-/metrics',
+                            'REMOTE_ADDR': '127.0.0.1'}, start_response)
+        self.assertTrue(b'view="shop:index"' in body[0])
+        # Not for remote clients.
+        self.assertEqual(application({'PATH_INFO': '/-/metrics',
+                                      'REMOTE_ADDR': '10.0.0.1'},
+                                     start_response), [b'response'])
+        # Nor for clients behind a proxy on the local host.
+        self.assertEqual(application({'PATH_INFO': '/-/metrics',
+                                      'REMOTE_ADDR': '127.0.0.1',
+                                      'HTTP_X_FORWARDED_FOR': '10.0.0.1'},
+                                     start_response), [b'response'])
@@ -0,0 +1,81 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from djangorecipe import pathindex
+
+
+class FakeDist(object):
+
+    def __init__(self, location, top_level=None):
+        self.location = location
+        self.top_level = top_level
+
+    def has_metadata(self, name):
+        return self.top_level is not None
+
+    def get_metadata_lines(self, name):
+        return self.top_level
+
+
+class TestPathIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp('djangorecipe')
+        self.egg = os.path.join(self.tempdir, 'spam.egg')
+        os.makedirs(os.path.join(self.egg, 'spam'))
+        open(os.path.join(self.egg, 'spam', '__init__.py'), 'w').close()
+        open(os.path.join(self.egg, 'spam', 'eggs.py'), 'w').close()
+        open(os.path.join(self.egg, 'bacon.py'), 'w').close()
+        self.index_file = os.path.join(self.tempdir, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        for name in ['spam', 'spam.eggs', 'bacon']:
+            sys.modules.pop(name, None)
+
+    def test_top_level_from_metadata(self):
+        dist = FakeDist(self.egg, ['spam', ''])
+        self.assertEqual(pathindex.top_level_names(dist), ['spam'])
+
+    def test_top_level_from_directory(self):
+        dist = FakeDist(self.egg)
+        self.assertEqual(pathindex.top_level_names(dist), ['bacon', 'spam'])
+
+    def test_namespace_packages(self):
+        # zc.buildout and zc.recipe.egg both provide 'zc'.
+        index = pathindex.build_index([FakeDist('/one', ['zc']),
+                                       FakeDist('/two', ['zc'])])
+        self.assertEqual(index, {'zc': ['/one', '/two']})
+
+    def test_write_index_only_when_changed(self):
+        ws = [FakeDist(self.egg)]
+        self.assertTrue(pathindex.write_index(self.index_file, ws))
+        self.assertFalse(pathindex.write_index(self.index_file, ws))
+        self.assertEqual(pathindex.load_index(self.index_file),
+                         {'bacon': [self.egg], 'spam': [self.egg]})
+
+    def test_relative_index(self):
+        pathindex.write_index(self.index_file, [FakeDist(self.egg)],
+                              relative_to=self.tempdir)
+        self.assertFalse(self.tempdir in open(self.index_file).read())
+        self.assertEqual(pathindex.load_index(self.index_file)['spam'],
+                         [self.egg])
+
+    def test_unusable_index(self):
+        self.assertEqual(pathindex.load_index(self.index_file), None)
+        self.assertEqual(pathindex.install(self.index_file), None)
+
+    def test_install(self):
+        pathindex.write_index(self.index_file, [FakeDist(self.egg)])
+        with mock.patch.object(sys, 'meta_path', list(sys.meta_path)):
+            finder = pathindex.install(self.index_file)
+            self.assertTrue(finder in sys.meta_path)
+            # The egg isn't on sys.path, the index is all we need.
+            import spam.eggs
+            self.assertTrue(spam.eggs.__file__.startswith(self.egg))
+            self.assertEqual(finder.find_spec('unknown'), None)
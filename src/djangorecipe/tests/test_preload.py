@@ -0,0 +1,104 @@
+import unittest
+
+import mock
+
+from djangorecipe import preload
+
+
+class TestPreload(unittest.TestCase):
+
+    def test_send_requests(self):
+        environs = []
+
+        def application(environ, start_response):
+            environs.append(environ)
+            start_response('200 OK', [])
+            return [b'ok']
+
+        preload.send_requests(application,
+                              ['/spam/?eggs=1', 'https://example.com/ham/'])
+        self.assertEqual(environs[0]['PATH_INFO'], '/spam/')
+        self.assertEqual(environs[0]['QUERY_STRING'], 'eggs=1')
+        self.assertEqual(environs[1]['HTTP_HOST'], 'example.com')
+        self.assertEqual(environs[1]['wsgi.url_scheme'], 'https')
+
+    def test_send_asgi_requests(self):
+        import asyncio
+        scopes = []
+
+        def application(scope, receive, send):
+            scopes.append(scope)
+            receive()
+            return asyncio.gather(
+                send({'type': 'http.response.start', 'status': 200,
+                      'headers': []}),
+                send({'type': 'http.response.body', 'body': b'ok'}),
+                receive())
+
+        preload.send_asgi_requests(
+            application, ['/spam/?eggs=1', 'https://example.com/ham/'])
+        self.assertEqual(scopes[0]['path'], '/spam/')
+        self.assertEqual(scopes[0]['query_string'], b'eggs=1')
+        self.assertEqual(scopes[1]['headers'], [(b'host', b'example.com')])
+        self.assertEqual(scopes[1]['scheme'], 'https')
+
+    def test_send_asgi_requests_in_running_loop(self):
+        import asyncio
+        application = mock.Mock()
+        loop = asyncio.new_event_loop()
+        counts = []
+
+        def warm_up():
+            counts.append(preload.send_asgi_requests(application, ['/']))
+            loop.stop()
+
+        loop.call_soon(warm_up)
+        with mock.patch.object(preload.logger, 'warning') as warning:
+            try:
+                loop.run_forever()
+            finally:
+                loop.close()
+        self.assertEqual(counts, [0])
+        self.assertFalse(application.called)
+        self.assertTrue(warning.called)
+
+    @mock.patch('gc.freeze', create=True)
+    @mock.patch('djangorecipe.preload.close_connections')
+    @mock.patch('djangorecipe.preload.send_requests')
+    @mock.patch('djangorecipe.preload.connect_databases')
+    @mock.patch('djangorecipe.preload.compile_templates',
+                side_effect=ValueError)
+    @mock.patch('djangorecipe.preload.import_views')
+    @mock.patch('djangorecipe.preload.load_urls')
+    def test_warm_up(self, load_urls, import_views, compile_templates,
+                     connect_databases, send_requests, close_connections,
+                     freeze):
+        with mock.patch.object(preload.logger, 'exception'):
+            timings = preload.warm_up('app', ['/'])
+        # A failing phase doesn't stop the rest.
+        self.assertEqual([name for name, duration in timings],
+                         ['urls', 'views', 'databases', 'requests'])
+        self.assertEqual(send_requests.call_args[0], ('app', ['/']))
+        # The requests opened connections again.
+        self.assertTrue(close_connections.called)
+        self.assertTrue(freeze.called)
+
+    @mock.patch('djangorecipe.preload.close_connections')
+    @mock.patch('djangorecipe.preload.send_requests')
+    @mock.patch('djangorecipe.preload.connect_databases')
+    @mock.patch('djangorecipe.preload.compile_templates')
+    @mock.patch('djangorecipe.preload.import_views')
+    @mock.patch('djangorecipe.preload.load_urls')
+    def test_warm_up_without_urls(self, load_urls, import_views,
+                                  compile_templates, connect_databases,
+                                  send_requests, close_connections):
+        preload.warm_up('app')
+        self.assertFalse(send_requests.called)
+        # connect_databases() closed its connections itself.
+        self.assertFalse(close_connections.called)
+
+    def test_close_connections(self):
+        connections = mock.Mock()
+        with mock.patch('django.db.connections', connections):
+            preload.close_connections()
+        self.assertTrue(connections.close_all.called)
@@ -0,0 +1,100 @@
+import io
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from djangorecipe import profiling
+
+
+def application(environ, start_response):
+    start_response('200 OK', [])
+    return [b'response']
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-profiling')
+        self.directory = os.path.join(self.tmp_dir, 'profiles')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def request(self, wrapped, path='/', **headers):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+        environ.update(headers)
+        return wrapped(environ, mock.Mock())
+
+    def profiles(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.listdir(self.directory))
+
+    def test_parse_match(self):
+        patterns = profiling.parse_match(['/api/', ' X-Profile: ^1$ ', ''])
+        self.assertEqual([key for key, _ in patterns],
+                         ['PATH_INFO', 'HTTP_X_PROFILE'])
+        self.assertRaises(ValueError, profiling.parse_match, ['api'])
+        self.assertRaises(ValueError, profiling.parse_match, ['/api/('])
+
+    def test_profile_name(self):
+        now = time.mktime((2020, 5, 17, 13, 4, 5, 0, 0, -1)) + 0.25
+        self.assertEqual(
+            profiling.profile_name({'REQUEST_METHOD': 'POST',
+                                    'PATH_INFO': '/shop/cart/42/'}, now),
+            'POST.shop_cart_42.20200517T130405.250000.prof')
+        self.assertTrue(profiling.profile_name({}).startswith('GET.root.'))
+
+    def test_sample(self):
+        wrapped = profiling.sample(application, self.directory, every=3)
+        for _ in range(7):
+            self.assertEqual(self.request(wrapped, '/page'), [b'response'])
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 2)
+        stats = pstats.Stats(os.path.join(self.directory, profiles[0]))
+        self.assertTrue(any(function[2] == 'application'
+                            for function in stats.stats))
+
+    def test_not_sampled(self):
+        wrapped = profiling.sample(application, self.directory, every=2)
+        with mock.patch('cProfile.Profile') as profile:
+            self.request(wrapped)
+        self.assertFalse(profile.called)
+
+    def test_match(self):
+        wrapped = profiling.sample(
+            application, self.directory, every=1,
+            match=['/api/', 'X-Profile: 1'])
+        self.request(wrapped, '/page')
+        self.request(wrapped, '/page/api/')
+        self.assertEqual(self.profiles(), [])
+        self.request(wrapped, '/api/users')
+        self.request(wrapped, '/page', HTTP_X_PROFILE='1')
+        self.assertEqual(len(self.profiles()), 2)
+
+    def test_ring(self):
+        wrapped = profiling.sample(application, self.directory, every=1,
+                                   keep=2)
+        for path in ('/one', '/two', '/three'):
+            self.request(wrapped, path)
+            # Distinct modification times.
+            for name in self.profiles():
+                filename = os.path.join(self.directory, name)
+                os.utime(filename, (os.path.getmtime(filename) - 10,) * 2)
+        self.assertEqual([name.split('.')[1] for name in self.profiles()],
+                         ['three', 'two'])
+
+    def test_save_error(self):
+        # Not a directory.
+        open(self.directory, 'w').close()
+        wrapped = profiling.sample(application, self.directory, every=1)
+        errors = io.StringIO()
+        self.assertEqual(self.request(wrapped, **{'wsgi.errors': errors}),
+                         [b'response'])
+        self.assertTrue(errors.getvalue().startswith(
+            "Couldn't save the profile GET.root."))
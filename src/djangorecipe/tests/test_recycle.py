@@ -0,0 +1,77 @@
+import os
+import signal
+import unittest
+
+import mock
+
+from djangorecipe import recycle
+
+
+class Response(list):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def application(environ, start_response):
+    start_response('200 OK', [])
+    return Response([b'response'])
+
+
+class TestRecycle(unittest.TestCase):
+
+    def serve(self, wrapped, requests):
+        """Return the responses, closed like a wsgi server does."""
+        responses = []
+        for _ in range(requests):
+            response = wrapped({}, mock.Mock())
+            self.assertEqual(list(response), [b'response'])
+            response.close()
+            responses.append(response)
+        return responses
+
+    def test_rss(self):
+        self.assertTrue(recycle.rss() > 1024 * 1024)
+
+    @mock.patch('os.kill')
+    @mock.patch('djangorecipe.recycle.log')
+    def test_max_requests(self, log, kill):
+        wrapped = recycle.recycle(application, max_requests=3, jitter=2)
+        with mock.patch('random.randint', return_value=1):
+            responses = self.serve(wrapped, 6)
+        # After the response of the fourth request, once.
+        self.assertEqual(kill.call_args_list,
+                         [mock.call(os.getpid(), signal.SIGTERM)])
+        self.assertTrue(responses[3].response.closed)
+        self.assertFalse(hasattr(responses[4], 'response'))
+        self.assertEqual(log.call_args[0][0],
+                         'Recycling worker after 4 requests: served 4 '
+                         'requests')
+
+    @mock.patch('os.kill')
+    @mock.patch('djangorecipe.recycle.log')
+    def test_max_rss(self, log, kill):
+        wrapped = recycle.recycle(application, max_rss=100 * 1024 * 1024,
+                                  check_every=2, signum=signal.SIGINT)
+        with mock.patch('djangorecipe.recycle.rss',
+                        return_value=50 * 1024 * 1024) as rss:
+            self.serve(wrapped, 3)
+        self.assertEqual(rss.call_count, 1)
+        self.assertFalse(kill.called)
+        with mock.patch('djangorecipe.recycle.rss',
+                        return_value=150 * 1024 * 1024):
+            self.serve(wrapped, 1)
+        kill.assert_called_once_with(os.getpid(), signal.SIGINT)
+        self.assertEqual(log.call_args[0][0],
+                         'Recycling worker after 4 requests: memory 150 MiB '
+                         'over the limit of 100 MiB')
+
+    @mock.patch('os.kill')
+    def test_forked(self, kill):
+        recycler = recycle.Recycler(max_requests=2)
+        recycler.count()
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            # A forked worker starts counting at zero.
+            self.assertEqual(recycler.count(), None)
+            self.assertEqual(recycler.count(), 'served 2 requests')
@@ -1,10 +1,17 @@
+import io
 import os
+import shutil
+import signal
 import sys
+import tempfile
 import unittest
 
 import mock
 
 from djangorecipe import binscripts
+from djangorecipe import preload
+from djangorecipe import testing
+from djangorecipe import testmap
 
 
 class ScriptTestCase(unittest.TestCase):
@@ -95,6 +102,293 @@ class TestTestScript(ScriptTestCase):
                              ('DJANGO_SETTINGS_MODULE',
                               'cheeseshop.development'))
 
+    @mock.patch('djangorecipe.testing.test_command_options',
+                return_value={'--verbosity': None, '--failfast': 0})
+    @mock.patch('djangorecipe.testing.run_workers', return_value=1)
+    @mock.patch('os.environ.setdefault')
+    def test_script_parallel(self, mock_setdefault, run_workers,
+                             test_command_options):
+        with mock.patch.object(sys, 'argv', ['bin/test', '--verbosity',
+                                             '2']):
+            exit_code = binscripts.test('cheeseshop.development', '',
+                                        'spamm', 'eggs', 'ham',
+                                        parallel='2')
+            self.assertEqual(exit_code, 1)
+            self.assertEqual(run_workers.call_args[0],
+                             ([['spamm', 'ham'], ['eggs']],
+                              ['--verbosity', '2']))
+        # Labels on the command line are split over the workers as well,
+        # not run by every one of them.
+        with mock.patch.object(sys, 'argv', ['bin/test', 'bacon',
+                                             '--failfast', 'beans']):
+            binscripts.test('cheeseshop.development', '', 'spamm',
+                            parallel='2')
+            self.assertEqual(run_workers.call_args[0],
+                             ([['spamm', 'beans'], ['bacon']],
+                              ['--failfast']))
+
+    @mock.patch('djangorecipe.testing.run_workers', return_value=0)
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    def test_script_parallel_flag(self, mock_setdefault,
+                                  execute_from_command_line, run_workers):
+        # --test-parallel=1 on the command line overrides the option.
+        with mock.patch.object(sys, 'argv', ['bin/test',
+                                             '--test-parallel=1']):
+            binscripts.test('cheeseshop.development', '', 'spamm', 'eggs',
+                            parallel='2')
+            self.assertFalse(run_workers.called)
+            self.assertEqual(execute_from_command_line.call_args[0],
+                             (['bin/test', 'test', 'spamm', 'eggs'],))
+
+    @mock.patch('djangorecipe.testing.run_workers')
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    def test_script_parallel_invalid(self, mock_setdefault,
+                                     execute_from_command_line, run_workers):
+        with mock.patch.object(sys, 'argv', ['bin/test',
+                                             '--test-parallel=many']):
+            with mock.patch('sys.stderr', new_callable=io.StringIO) as err:
+                self.assertEqual(
+                    binscripts.test('cheeseshop.development', '', 'spamm',
+                                    'eggs'), 2)
+        self.assertTrue("not 'many'" in err.getvalue())
+        self.assertFalse(run_workers.called)
+        self.assertFalse(execute_from_command_line.called)
+
+    @mock.patch('djangorecipe.testing.isolate_test_databases')
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    def test_script_worker(self, mock_setdefault, execute_from_command_line,
+                           isolate_test_databases):
+        environ = {testing.WORKER_ENV: '2', testing.LABELS_ENV: 'ham'}
+        with mock.patch.dict('os.environ', environ):
+            with mock.patch.object(sys, 'argv', ['bin/test']):
+                binscripts.test('cheeseshop.development', '', 'spamm', 'eggs',
+                                'ham', parallel='2')
+        self.assertEqual(isolate_test_databases.call_args[0], ('2',))
+        self.assertEqual(execute_from_command_line.call_args[0],
+                         (['bin/test', 'test', 'ham'],))
+
+    @mock.patch('djangorecipe.testdb.install')
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    def test_script_snapshots(self, mock_setdefault,
+                              execute_from_command_line, install):
+        with mock.patch.object(sys, 'argv', ['bin/test']):
+            binscripts.test('cheeseshop.development', '', 'spamm',
+                            test_snapshots='/snapshots',
+                            test_snapshots_size=1024)
+        self.assertEqual(install.call_args[0], ('/snapshots', 1024))
+        self.assertTrue(execute_from_command_line.called)
+
+    def test_coverage_source(self):
+        cov = binscripts._coverage('report', None, source=['/project'])
+        self.assertEqual(cov.config.source, ['/project'])
+        tmp_dir = tempfile.mkdtemp('djangorecipe-coverage')
+        try:
+            config_file = os.path.join(tmp_dir, '.coveragerc')
+            with open(config_file, 'w') as f:
+                f.write('[run]\ninclude = configured/*\n')
+            cov = binscripts._coverage('report', None, source=['/project'],
+                                       config_file=config_file)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertFalse(cov.config.source)
+        self.assertEqual(binscripts._coverage_config(cov, 'include'),
+                         ['configured/*'])
+
+    def test_fresh_coverage(self):
+        cov = binscripts._coverage('report', None, source=['/project'],
+                                   omit=['*/migrations/*'])
+        with mock.patch('coverage.coverage.load'):
+            fresh = binscripts._fresh_coverage(cov)
+        self.assertEqual(fresh.config.source, ['/project'])
+        self.assertEqual(binscripts._coverage_config(fresh, 'omit'),
+                         ['*/migrations/*'])
+        self.assertEqual(fresh.config.data_file, cov.config.data_file)
+
+    @mock.patch.dict('os.environ')
+    def test_coverage_core(self):
+        os.environ.pop('COVERAGE_CORE', None)
+        options = binscripts._coverage_options(
+            {'coverage_source': ['/project'], 'coverage_core': 'pytrace'})
+        self.assertEqual(options, {'source': ['/project']})
+        self.assertEqual(os.environ['COVERAGE_CORE'], 'pytrace')
+
+    @mock.patch('djangorecipe.binscripts._fresh_coverage',
+                side_effect=lambda cov: cov)
+    def test_coverage_reports(self, fresh_coverage):
+        # All but the last report are generated in forked processes.
+        tmp_dir = tempfile.mkdtemp('djangorecipe-reports')
+
+        class Coverage(object):
+            def __getattr__(self, name):
+                def report():
+                    open(os.path.join(tmp_dir, name), 'w').close()
+                return report
+
+        try:
+            binscripts._coverage_reports(Coverage(),
+                                         'report html_report xml_report')
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['html_report', 'report', 'xml_report'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @mock.patch('djangorecipe.testmap.discover_tests',
+                return_value=['spamm.tests.A.test_a', 'eggs.tests.B.test_b'])
+    @mock.patch('djangorecipe.testmap.TestMap.changed_files')
+    @mock.patch('djangorecipe.binscripts._update_test_map')
+    @mock.patch('coverage.coverage')
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    def test_script_changed(self, mock_setdefault, execute_from_command_line,
+                            mock_coverage, update_test_map, changed_files,
+                            discover_tests):
+        tempdir = tempfile.mkdtemp('djangorecipe')
+        self.addCleanup(shutil.rmtree, tempdir)
+        test_map = os.path.join(tempdir, 'testmap.json')
+        mapping = testmap.TestMap(test_map)
+        mapping.tests = {'spamm.tests.A.test_a': ['/src/spamm/models.py'],
+                         'eggs.tests.B.test_b': ['/src/eggs/models.py']}
+        mapping.save()
+        changed_files.return_value = set(['/src/eggs/models.py'])
+        with mock.patch.object(sys, 'argv', ['bin/test', '--changed']):
+            binscripts.test('cheeseshop.development', '', 'spamm', 'eggs',
+                            test_map=test_map)
+        self.assertEqual(changed_files.call_args[0], ('all',))
+        self.assertEqual(execute_from_command_line.call_args[0],
+                         (['bin/test', 'test', 'eggs.tests.B.test_b'],))
+        self.assertEqual(mock_coverage.call_args[1],
+                         {'data_file': test_map + '.coverage'})
+        self.assertTrue(update_test_map.called)
+
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    def test_script_changed_invalid(self, mock_setdefault,
+                                    execute_from_command_line):
+        with mock.patch.object(sys, 'argv', ['bin/test', '--changed=svn']):
+            with mock.patch.object(sys, 'stderr'):
+                self.assertEqual(
+                    binscripts.test('cheeseshop.development', '', 'spamm',
+                                    test_map='.testmap.json'),
+                    2)
+        self.assertFalse(execute_from_command_line.called)
+
+    @mock.patch('djangorecipe.testing.test_command_options',
+                return_value={})
+    @mock.patch('djangorecipe.binscripts._update_test_map')
+    @mock.patch('djangorecipe.testing.run_workers', return_value=0)
+    @mock.patch('coverage.coverage')
+    @mock.patch('os.environ.setdefault')
+    def test_script_parallel_test_map(self, mock_setdefault, mock_coverage,
+                                      run_workers, update_test_map,
+                                      test_command_options):
+        tempdir = tempfile.mkdtemp('djangorecipe')
+        self.addCleanup(shutil.rmtree, tempdir)
+        test_map = os.path.join(tempdir, 'testmap.json')
+
+        def run(labels, arguments):
+            # What the workers would save.
+            testmap.save_ran(test_map, set(['spamm.tests.A.test_a']))
+            return 0
+
+        run_workers.side_effect = run
+        with mock.patch.object(sys, 'argv', ['bin/test']):
+            binscripts.test('cheeseshop.development', '', 'spamm', 'eggs',
+                            parallel='2', test_map=test_map)
+        self.assertEqual(update_test_map.call_args[0][2],
+                         set(['spamm.tests.A.test_a']))
+        self.assertEqual(os.listdir(tempdir), [])
+
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    def test_script_changed_without_test_map(self, mock_setdefault,
+                                             execute_from_command_line):
+        with mock.patch.object(sys, 'argv', ['bin/test', '--changed']):
+            with mock.patch.object(sys, 'stderr'):
+                self.assertEqual(
+                    binscripts.test('cheeseshop.development', '', 'spamm'),
+                    2)
+        self.assertFalse(execute_from_command_line.called)
+
+
+class TestTesting(unittest.TestCase):
+
+    def test_parse_workers(self):
+        self.assertEqual(testing.parse_workers(None), 1)
+        self.assertEqual(testing.parse_workers('3'), 3)
+        self.assertTrue(testing.parse_workers('auto') >= 1)
+
+    def test_pop_parallel_flag(self):
+        arguments = ['--verbose', '--test-parallel=3']
+        self.assertEqual(testing.pop_parallel_flag(arguments), '3')
+        self.assertEqual(arguments, ['--verbose'])
+        self.assertEqual(testing.pop_parallel_flag(['--test-parallel']),
+                         'auto')
+        self.assertEqual(testing.pop_parallel_flag([], default='2'), '2')
+
+    def test_parse_result(self):
+        self.assertEqual(testing.parse_result(
+            '..s\n-----\nRan 3 tests in 0.010s\n\nOK (skipped=1)\n'),
+            (3, {'skipped': 1}))
+        self.assertEqual(testing.parse_result(
+            'Ran 1 test in 0.1s\n\nFAILED (failures=1, errors=2)\n'),
+            (1, {'failures': 1, 'errors': 2}))
+        self.assertEqual(testing.parse_result('Ran 2 tests in 1s\n\nOK\n'),
+                         (2, {}))
+        self.assertEqual(testing.parse_result('ImportError: spamm\n'), None)
+
+    def test_summary(self):
+        self.assertEqual(testing.summary([
+            (1, ['a', 'c'], 0, (3, {'skipped': 1})),
+            (2, ['b'], 1, (2, {'failures': 1, 'errors': 1})),
+            (3, ['d'], 1, None)]), [
+            'Worker 1 (a c): OK',
+            'Worker 2 (b): FAILED (exit code 1)',
+            'Worker 3 (d): FAILED (exit code 1)',
+            'Worker 3 reported no test results',
+            'Ran 5 tests in 3 workers',
+            'FAILED (failures=1, errors=1, skipped=1)'])
+
+    def test_split_arguments(self):
+        options = {'-v': None, '--verbosity': None, '--failfast': 0,
+                   '--shuffle': '?'}
+        self.assertEqual(testing.split_arguments(
+            ['spamm', '-v', '2', '--failfast', 'eggs', '--verb=3'], options),
+            (['spamm', 'eggs'], ['-v', '2', '--failfast', '--verb=3']))
+        self.assertEqual(testing.split_arguments(
+            ['--verb', '2', '--shuffle', '--failfast', '--shuffle', '4',
+             '--', '-odd'], options),
+            (['-odd'], ['--verb', '2', '--shuffle', '--failfast',
+                        '--shuffle', '4']))
+
+    def test_test_command_options(self):
+        with mock.patch('django.conf.settings',
+                        mock.Mock(TEST_RUNNER='django.test.runner.'
+                                              'DiscoverRunner')):
+            options = testing.test_command_options()
+        self.assertEqual(options['--failfast'], 0)
+        self.assertEqual(options['--tag'], None)
+
+    def test_split_labels(self):
+        self.assertEqual(testing.split_labels(['a', 'b', 'c'], 2),
+                         [['a', 'c'], ['b']])
+        self.assertEqual(testing.split_labels(['a'], 4), [['a']])
+
+    def test_isolate_test_databases(self):
+        databases = {
+            'default': {'ENGINE': 'django.db.backends.postgresql',
+                        'NAME': 'shop'},
+            'memory': {'ENGINE': 'django.db.backends.sqlite3',
+                       'NAME': 'shop.db'}}
+        settings = mock.Mock(DATABASES=databases)
+        with mock.patch('django.conf.settings', settings):
+            testing.isolate_test_databases('3')
+        self.assertEqual(databases['default']['TEST']['NAME'], 'test_shop_3')
+        self.assertFalse('NAME' in databases['memory']['TEST'])
+
 
 class TestManageScript(ScriptTestCase):
 
@@ -111,6 +405,82 @@ class TestManageScript(ScriptTestCase):
             mock_setdefault.call_args,
             (('DJANGO_SETTINGS_MODULE', 'cheeseshop.development'), {}))
 
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('djangorecipe.forkserver.run', return_value=3)
+    def test_script_forkserver(self, run, mock_execute):
+        self.assertEqual(binscripts.manage('cheeseshop.development',
+                                           forkserver_directory='/parts'), 3)
+        self.assertEqual(run.call_args[0],
+                         ('/parts', 'cheeseshop.development', sys.argv))
+        self.assertFalse(mock_execute.called)
+
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    @mock.patch('djangorecipe.forkserver.run', return_value=None)
+    def test_script_forkserver_unavailable(self, run, mock_setdefault,
+                                           mock_execute):
+        binscripts.manage('cheeseshop.development',
+                          forkserver_directory='/parts')
+        self.assertTrue(mock_execute.called)
+
+    @mock.patch('djangorecipe.forkserver.serve', return_value=0)
+    def test_script_forkserver_serve(self, serve):
+        with mock.patch.dict(os.environ, {'DJANGORECIPE_FORKSERVER': 'serve'}):
+            binscripts.manage('cheeseshop.development',
+                              forkserver_directory='/parts',
+                              forkserver_timeout=60)
+        self.assertEqual(serve.call_args[0],
+                         ('/parts', 'cheeseshop.development', 60))
+
+    @mock.patch('django.setup')
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('djangorecipe.commands.answer', return_value=True)
+    @mock.patch('djangorecipe.commands.load_index')
+    def test_script_command_index(self, load_index, answer, mock_execute,
+                                  setup):
+        with mock.patch.dict(os.environ, {'DJANGO_AUTO_COMPLETE': '1'}):
+            self.assertEqual(binscripts.manage('cheeseshop.development',
+                                               command_index='/index.json'),
+                             0)
+        self.assertEqual(load_index.call_args[0],
+                         ('/index.json', 'cheeseshop.development'))
+        self.assertEqual(answer.call_args[0][0], load_index.return_value)
+        self.assertFalse(mock_execute.called)
+        self.assertFalse(setup.called)
+
+    @mock.patch('django.setup')
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('djangorecipe.commands.write_index')
+    @mock.patch('djangorecipe.commands.load_index', return_value=None)
+    def test_script_command_index_stale(self, load_index, write_index,
+                                        mock_execute, setup):
+        with mock.patch.object(sys, 'argv', ['bin/django', 'help']):
+            with mock.patch('djangorecipe.commands.answer',
+                            return_value=True) as answer:
+                binscripts.manage('cheeseshop.development',
+                                  command_index='/index.json')
+        self.assertTrue(setup.called)
+        self.assertEqual(write_index.call_args[0],
+                         ('/index.json', 'bin/django'))
+        self.assertEqual(answer.call_args[0][0], write_index.return_value)
+        self.assertFalse(mock_execute.called)
+        # Everything else goes to django.
+        with mock.patch.object(sys, 'argv', ['bin/django', 'migrate']):
+            binscripts.manage('cheeseshop.development',
+                              command_index='/index.json')
+        self.assertTrue(mock_execute.called)
+
+    @mock.patch('django.core.management.execute_from_command_line')
+    @mock.patch('os.environ.setdefault')
+    @mock.patch('djangorecipe.memory.install')
+    def test_script_memory_snapshots(self, install, mock_setdefault,
+                                     mock_execute):
+        binscripts.manage('cheeseshop.development',
+                          memory_snapshots='/memory', memory_frames=5)
+        self.assertEqual(install.call_args[0],
+                         ('/memory', 5, signal.SIGUSR2))
+        self.assertTrue(mock_execute.called)
+
 
 class TestWSGIScript(ScriptTestCase):
     # Note: don't test the logger part of wsgi(), because that overwrites
@@ -127,3 +497,87 @@ class TestWSGIScript(ScriptTestCase):
                  as patched_method:
                 binscripts.wsgi(settings_dotted_path, logfile=None)
                 self.assertTrue(patched_method.called)
+
+    def test_script_preload(self):
+        settings_dotted_path = 'cheeseshop.development'
+        with mock.patch('os.environ',
+                        {'DJANGO_SETTINGS_MODULE': settings_dotted_path}):
+            with mock.patch('django.core.wsgi.get_wsgi_application') \
+                 as patched_method:
+                with mock.patch('djangorecipe.preload.warm_up') as warm_up:
+                    binscripts.wsgi(settings_dotted_path, preload=True,
+                                    warmup_urls=['/'])
+                    self.assertEqual(
+                        warm_up.call_args[0],
+                        (patched_method.return_value, ['/']))
+
+    def test_script_metrics(self):
+        settings_dotted_path = 'cheeseshop.development'
+        with mock.patch('os.environ',
+                        {'DJANGO_SETTINGS_MODULE': settings_dotted_path}):
+            with mock.patch('django.core.wsgi.get_wsgi_application') \
+                 as patched_method:
+                with mock.patch('djangorecipe.metrics.instrument') \
+                     as instrument:
+                    application = binscripts.wsgi(
+                        settings_dotted_path, metrics='/metrics',
+                        metrics_url='/-/metrics')
+                    self.assertEqual(application, instrument.return_value)
+                    self.assertEqual(
+                        instrument.call_args[0],
+                        (patched_method.return_value, '/metrics',
+                         '/-/metrics'))
+
+
+    def test_script_profile(self):
+        settings_dotted_path = 'cheeseshop.development'
+        with mock.patch('os.environ',
+                        {'DJANGO_SETTINGS_MODULE': settings_dotted_path}):
+            with mock.patch('django.core.wsgi.get_wsgi_application') \
+                 as patched_method:
+                with mock.patch('djangorecipe.profiling.sample') as sample:
+                    application = binscripts.wsgi(
+                        settings_dotted_path, profile='/profiles',
+                        profile_every=10)
+                    self.assertEqual(application, sample.return_value)
+                    self.assertEqual(
+                        sample.call_args,
+                        mock.call(patched_method.return_value, '/profiles',
+                                  every=10, match=(), keep=100))
+
+    def test_script_recycle(self):
+        settings_dotted_path = 'cheeseshop.development'
+        with mock.patch('os.environ',
+                        {'DJANGO_SETTINGS_MODULE': settings_dotted_path}):
+            with mock.patch('django.core.wsgi.get_wsgi_application') \
+                 as patched_method:
+                with mock.patch('djangorecipe.recycle.recycle') as recycle:
+                    application = binscripts.wsgi(
+                        settings_dotted_path, recycle_max_requests=500,
+                        recycle_jitter=50, recycle_signal='INT')
+                    self.assertEqual(application, recycle.return_value)
+                    self.assertEqual(
+                        recycle.call_args,
+                        mock.call(patched_method.return_value, max_rss=0,
+                                  check_every=100, max_requests=500,
+                                  jitter=50, signum=signal.SIGINT))
+
+class TestASGIScript(ScriptTestCase):
+
+    def test_script_preload(self):
+        settings_dotted_path = 'cheeseshop.development'
+        with mock.patch('os.environ',
+                        {'DJANGO_SETTINGS_MODULE': settings_dotted_path}):
+            with mock.patch('django.core.asgi.get_asgi_application') \
+                 as patched_method:
+                with mock.patch('djangorecipe.preload.warm_up') as warm_up:
+                    application = binscripts.asgi(
+                        settings_dotted_path, preload=True,
+                        warmup_urls=['/'])
+                    self.assertEqual(application,
+                                     patched_method.return_value)
+                    self.assertEqual(
+                        warm_up.call_args[0],
+                        (patched_method.return_value, ['/']))
+                    self.assertEqual(warm_up.call_args[1]['send'],
+                                     preload.send_asgi_requests)
@@ -0,0 +1,89 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import mock
+
+from djangorecipe import server
+
+
+class TestServer(unittest.TestCase):
+
+    def test_parse_listen(self):
+        self.assertEqual(server.parse_listen('0.0.0.0:80'),
+                         (socket.AF_INET, ('0.0.0.0', 80)))
+        self.assertEqual(server.parse_listen('8000'),
+                         (socket.AF_INET, ('127.0.0.1', 8000)))
+        self.assertEqual(server.parse_listen('[::1]:8000'),
+                         (socket.AF_INET6, ('::1', 8000)))
+        self.assertEqual(server.parse_listen('unix:/tmp/django.sock'),
+                         (socket.AF_UNIX, '/tmp/django.sock'))
+
+    def test_inherited_sockets(self):
+        sock = server.create_socket('127.0.0.1:0')
+        self.addCleanup(sock.close)
+        fd = os.dup(sock.fileno())
+        environ = {server.FDS_ENV: '%s:%s' % (int(socket.AF_INET), fd)}
+        with mock.patch.dict('os.environ', environ):
+            inherited = server.inherited_sockets()
+            self.assertFalse(server.FDS_ENV in os.environ)
+        self.assertEqual(len(inherited), 1)
+        self.assertEqual(inherited[0].getsockname(), sock.getsockname())
+        inherited[0].close()
+        self.assertEqual(server.inherited_sockets(), [])
+
+    def test_unix_socket_request(self):
+        tempdir = tempfile.mkdtemp('djangorecipe')
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'django.sock')
+        listening = server.create_socket('unix:' + path)
+        self.addCleanup(listening.close)
+
+        def application(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [environ['REMOTE_ADDR'].encode('ascii')]
+
+        wsgi_server = server.Server(listening, application)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        client.connect(path)
+        client.sendall(b'GET / HTTP/1.0\r\n\r\n')
+        with mock.patch('sys.stderr'):
+            wsgi_server.handle_request()
+        response = client.makefile('rb').read()
+        self.assertTrue(response.startswith(b'HTTP/1.0 200 OK'))
+        self.assertTrue(response.endswith(b'127.0.0.1'))
+        self.assertEqual(wsgi_server.handled, 1)
+
+    def test_server_name(self):
+        listening = server.create_socket('127.0.0.1:0')
+        self.addCleanup(listening.close)
+        with mock.patch('socket.getfqdn') as getfqdn:
+            wsgi_server = server.Server(listening, None,
+                                        ('example.com', 8000))
+        self.assertFalse(getfqdn.called)
+        self.assertEqual(wsgi_server.server_name, 'example.com')
+        self.assertEqual(wsgi_server.server_port, 8000)
+
+    @mock.patch('djangorecipe.server.worker', side_effect=ValueError)
+    def test_worker_crash(self, worker):
+        listening = server.create_socket('127.0.0.1:0')
+        self.addCleanup(listening.close)
+        arbiter = server.Arbiter(None, [listening], workers=1)
+        with mock.patch('sys.stderr'):
+            arbiter._spawn()
+            pid = list(arbiter.children)[0]
+            status = os.waitpid(pid, 0)[1]
+        # The traceback is logged and the worker exits with an error.
+        self.assertEqual(os.WEXITSTATUS(status), 1)
+        with mock.patch('time.time', return_value=100):
+            with mock.patch('sys.stderr'):
+                arbiter._exited(pid, status)
+                self.assertEqual(arbiter.spawn_after, 100 + server.BACKOFF)
+                arbiter._exited(pid, status)
+                self.assertEqual(arbiter.spawn_after,
+                                 100 + 2 * server.BACKOFF)
+        arbiter._exited(pid, 0)
+        self.assertEqual(arbiter.failures, 0)
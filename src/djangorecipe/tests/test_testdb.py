@@ -0,0 +1,133 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from djangorecipe import testdb
+
+SETTINGS = """
+SECRET_KEY = 'snapshot'
+INSTALLED_APPS = ['cheese']
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3',
+                         'NAME': 'db.sqlite3'}}
+"""
+
+MIGRATION = """
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+    dependencies = []
+    operations = [
+        migrations.CreateModel(
+            name='Cheese',
+            fields=[('id', models.AutoField(primary_key=True)),
+                    ('name', models.CharField(max_length=20))]),
+        migrations.RunSQL(
+            "INSERT INTO cheese_cheese (name) VALUES ('stilton')"),
+    ]
+"""
+
+MODELS = """
+from django.db import models
+
+
+class Cheese(models.Model):
+    name = models.CharField(max_length=20)
+"""
+
+TESTS = """
+from django.test import TestCase
+
+from cheese.models import Cheese
+
+
+class CheeseTest(TestCase):
+
+    def test_migrated(self):
+        self.assertEqual(
+            list(Cheese.objects.values_list('name', flat=True)), ['stilton'])
+"""
+
+RUNNER = """
+import sys
+from django.core import management
+from djangorecipe import testdb
+testdb.install(sys.argv[1])
+management.execute_from_command_line(['test', 'test', 'cheese'])
+"""
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-testdb')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, contents):
+        filename = os.path.join(self.tmp_dir, name)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'w') as f:
+            f.write(contents)
+
+    def test_evict(self):
+        snapshots = testdb.Snapshots(self.tmp_dir, max_size=25)
+        now = time.time()
+        for age, name in enumerate(['c.sqlite3', 'b.sqlite3', 'a.sqlite3']):
+            self.write(name, '-' * 10)
+            os.utime(os.path.join(self.tmp_dir, name), (now - age, now - age))
+        self.write('.tmp-partial', '-' * 10)
+        snapshots.evict(keep=os.path.join(self.tmp_dir, 'a.sqlite3'))
+        # The oldest one is protected, the next oldest goes.
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['.tmp-partial', 'a.sqlite3', 'c.sqlite3'])
+
+    def test_no_limit(self):
+        snapshots = testdb.Snapshots(self.tmp_dir)
+        self.write('a.sqlite3', '-' * 10)
+        snapshots.evict()
+        self.assertEqual(os.listdir(self.tmp_dir), ['a.sqlite3'])
+
+    def run_tests(self, snapshot_dir):
+        env = dict(os.environ)
+        env['DJANGO_SETTINGS_MODULE'] = 'settings'
+        env['PYTHONPATH'] = os.pathsep.join([self.tmp_dir] + sys.path)
+        process = subprocess.Popen(
+            [sys.executable, '-c', RUNNER, snapshot_dir], cwd=self.tmp_dir,
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode('utf-8')
+        self.assertEqual(process.returncode, 0, output)
+        return output
+
+    def test_snapshot_round_trip(self):
+        self.write('settings.py', SETTINGS)
+        self.write('cheese/__init__.py', '')
+        self.write('cheese/models.py', MODELS)
+        self.write('cheese/tests.py', TESTS)
+        self.write('cheese/migrations/__init__.py', '')
+        self.write('cheese/migrations/0001_initial.py', MIGRATION)
+        snapshot_dir = os.path.join(self.tmp_dir, 'snapshots')
+
+        output = self.run_tests(snapshot_dir)
+        self.assertFalse('from snapshot' in output)
+        snapshots = os.listdir(snapshot_dir)
+        self.assertEqual(len(snapshots), 1)
+        self.assertTrue(snapshots[0].endswith('.sqlite3'))
+
+        output = self.run_tests(snapshot_dir)
+        self.assertTrue('from snapshot %s' % snapshots[0] in output)
+
+        # A changed migration means a new snapshot.
+        self.write('cheese/migrations/0001_initial.py',
+                   MIGRATION + '# changed\n')
+        output = self.run_tests(snapshot_dir)
+        self.assertFalse('from snapshot' in output)
+        self.assertEqual(len(os.listdir(snapshot_dir)), 2)
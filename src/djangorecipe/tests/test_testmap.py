@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from djangorecipe import testmap
+
+
+class FakeCoverageData(object):
+
+    def __init__(self, contexts):
+        self.contexts = contexts
+
+    def measured_files(self):
+        return list(self.contexts)
+
+    def contexts_by_lineno(self, filename):
+        return self.contexts[filename]
+
+
+class TestTestMap(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp('djangorecipe')
+        self.filename = os.path.join(self.tempdir, 'testmap.json')
+        self.models = os.path.join(self.tempdir, 'models.py')
+        self.views = os.path.join(self.tempdir, 'views.py')
+        for filename in [self.models, self.views]:
+            open(filename, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_collect_ran(self):
+        testmap.save_ran(self.filename, set(['app.tests.A.test_a']))
+        with open(self.filename + '.ran.1', 'w') as f:
+            f.write('["app.tests.B.test_b"]')
+        self.assertEqual(testmap.collect_ran(self.filename),
+                         set(['app.tests.A.test_a', 'app.tests.B.test_b']))
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         ['models.py', 'views.py'])
+        self.assertEqual(testmap.collect_ran(self.filename), set())
+
+    def test_pop_changed_flag(self):
+        arguments = ['--changed=git', '-v']
+        self.assertEqual(testmap.pop_changed_flag(arguments), 'git')
+        self.assertEqual(arguments, ['-v'])
+        self.assertEqual(testmap.pop_changed_flag(['--changed']), 'all')
+        self.assertEqual(testmap.pop_changed_flag([]), None)
+
+    def test_update_is_incremental(self):
+        mapping = testmap.TestMap(self.filename)
+        mapping.tests['old.test'] = [self.views]
+        mapping.update(FakeCoverageData({
+            self.models: {1: ['', 'app.T.test_a'], 2: ['app.T.test_b']},
+            self.views: {3: ['app.T.test_b']}}),
+            ran=['app.T.test_c'])
+        mapping.save()
+
+        mapping = testmap.TestMap(self.filename)
+        self.assertEqual(mapping.tests, {
+            'old.test': [self.views],
+            'app.T.test_a': [self.models],
+            'app.T.test_b': sorted([self.models, self.views]),
+            'app.T.test_c': []})
+        self.assertTrue(self.models in mapping.files)
+
+    def test_select(self):
+        mapping = testmap.TestMap(self.filename)
+        mapping.tests = {'app.T.test_a': [self.models],
+                         'app.T.test_b': [self.views]}
+        # New tests always run.
+        self.assertEqual(
+            mapping.select(['app.T.test_a', 'app.T.test_b', 'app.T.new'],
+                           set([self.views])),
+            ['app.T.test_b', 'app.T.new'])
+
+    def test_changed_files_mtime(self):
+        mapping = testmap.TestMap(self.filename)
+        mapping.files = {self.models: os.path.getmtime(self.models),
+                         self.views: 0}
+        self.assertEqual(mapping.changed_files('mtime'), set([self.views]))
+
+    @mock.patch('djangorecipe.testmap._git_changed_files',
+                side_effect=OSError)
+    def test_changed_files_without_git(self, git_changed_files):
+        mapping = testmap.TestMap(self.filename)
+        mapping.files = {self.views: 0}
+        self.assertEqual(mapping.changed_files('git'), set([self.views]))
+
+    def test_record_contexts(self):
+        cov = mock.Mock()
+
+        class Sample(unittest.TestCase):
+            def test_it(self):
+                pass
+
+        original_run = unittest.TestCase.run
+        try:
+            ran = testmap.record_contexts(cov)
+            Sample('test_it').run()
+        finally:
+            unittest.TestCase.run = original_run
+        test_id = Sample('test_it').id()
+        self.assertEqual(ran, set([test_id]))
+        self.assertEqual(cov.switch_context.call_args_list,
+                         [((test_id,), {}), (('',), {})])
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from djangorecipe import trace
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('djangorecipe-trace')
+        self.trace_file = os.path.join(self.tmp_dir, 'var', 'trace.json')
+        self.addCleanup(setattr, trace, '_tracer', None)
+        patcher = mock.patch('atexit.register')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_inactive(self):
+        with mock.patch.dict(os.environ, clear=True):
+            trace.enter()
+        self.assertFalse(trace.active())
+        with trace.phase('command'):
+            pass
+        self.assertEqual(trace.finish(), None)
+
+    def test_environ(self):
+        with mock.patch.dict(os.environ, {trace.ENVIRON: self.trace_file}):
+            trace.enter()
+        self.assertTrue(trace.active())
+        trace.finish(out=mock.Mock())
+
+    def test_trace(self):
+        module_file = os.path.join(self.tmp_dir, 'slow_trace_module.py')
+        with open(module_file, 'w') as f:
+            f.write('import time\ntime.sleep(0.05)\n')
+        sys.path.insert(0, self.tmp_dir)
+        self.addCleanup(sys.path.remove, self.tmp_dir)
+        self.addCleanup(sys.modules.pop, 'slow_trace_module', None)
+
+        trace.start(self.trace_file)
+        trace.enter()
+        with trace.phase('command'):
+            import slow_trace_module
+        out = mock.Mock()
+        self.assertEqual(trace.finish(out=out), self.trace_file)
+        self.assertFalse(trace.active())
+        self.assertFalse(any(isinstance(finder, trace.ImportTimer)
+                             for finder in sys.meta_path))
+        # The module got its real loader back.
+        self.assertFalse(isinstance(slow_trace_module.__loader__,
+                                    trace._TimedLoader))
+
+        events = json.load(open(self.trace_file))['traceEvents']
+        names = [event['name'] for event in events]
+        for name in ('initialization', 'command', 'total',
+                     'slow_trace_module'):
+            self.assertTrue(name in names)
+        imported = events[names.index('slow_trace_module')]
+        self.assertTrue(imported['args']['exclusive'] >= 50000)
+
+        summary = out.write.call_args_list[0][0][0]
+        self.assertTrue(summary.startswith('Slowest startup phases:'))
+        self.assertTrue('slow_trace_module' in summary)
+
+    def test_filename_substitution(self):
+        trace.start(os.path.join(self.tmp_dir, '%(script)s-%(pid)s.json'))
+        filename = trace.finish(out=mock.Mock())
+        self.assertEqual(
+            os.path.basename(filename),
+            '%s-%s.json' % (os.path.basename(sys.argv[0]), os.getpid()))
+
+    def test_summary_order(self):
+        events = [
+            {'name': 'a', 'cat': 'import', 'dur': 10,
+             'args': {'exclusive': 1}},
+            {'name': 'b', 'cat': 'import', 'dur': 5,
+             'args': {'exclusive': 5}},
+            {'name': 'setup', 'cat': 'phase', 'dur': 3, 'args': {}},
+            {'name': 'command', 'cat': 'phase', 'dur': 9, 'args': {}}]
+        lines = trace.summary(events).splitlines()
+        self.assertTrue(lines[1].endswith('command'))
+        self.assertTrue(lines[2].endswith('setup'))
+        self.assertTrue(lines[4].endswith(' b'))
+        self.assertTrue(lines[5].endswith(' a'))
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pkg_resources
+
+from djangorecipe import wscache
+
+
+class TestWorkingSetCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp('djangorecipe')
+        self.filename = os.path.join(self.tempdir, 'cache', 'ws.json')
+        self.ws = pkg_resources.WorkingSet()
+        self.ws.require(['setuptools'])
+        self._memory = dict(wscache._memory)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        wscache._memory.clear()
+        wscache._memory.update(self._memory)
+
+    def test_cache_key(self):
+        self.assertEqual(wscache.cache_key('Django', 'Django=1.8'),
+                         wscache.cache_key('Django', 'Django=1.8'))
+        self.assertNotEqual(wscache.cache_key('Django', 'Django=1.8'),
+                            wscache.cache_key('Django', 'Django=1.9'))
+
+    def test_in_process(self):
+        cache = wscache.WorkingSetCache(self.filename)
+        self.assertEqual(cache.get('key'), None)
+        cache.set('key', self.ws, disk=False)
+        self.assertTrue(cache.get('key') is self.ws)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_on_disk(self):
+        cache = wscache.WorkingSetCache(self.filename)
+        cache.set('key', self.ws)
+        wscache._memory.clear()
+        cached = cache.get('key')
+        self.assertEqual([dist.key for dist in cached],
+                         [dist.key for dist in self.ws])
+        self.assertEqual(cached.find(
+            pkg_resources.Requirement.parse('setuptools')).location,
+            self.ws.find(
+                pkg_resources.Requirement.parse('setuptools')).location)
+        # Disk access can be turned off.
+        wscache._memory.clear()
+        self.assertEqual(cache.get('key', disk=False), None)
+
+    def test_stale(self):
+        cache = wscache.WorkingSetCache(self.filename)
+        cache.set('key', [pkg_resources.Distribution(
+            location=os.path.join(self.tempdir, 'gone.egg'),
+            project_name='gone', version='1.0')])
+        wscache._memory.clear()
+        self.assertEqual(cache.get('key'), None)
+        self.assertFalse('key' in cache._load())
+
+    def test_eviction(self):
+        cache = wscache.WorkingSetCache(self.filename, max_entries=2)
+        for key in ['one', 'two', 'three']:
+            cache.set(key, [])
+        self.assertEqual(sorted(cache._load()), ['three', 'two'])
+
+    def test_develop_state(self):
+        self.assertEqual(wscache.develop_state(
+            os.path.join(self.tempdir, 'nothing')), '')
+        before = wscache.develop_state(self.tempdir)
+        project = os.path.join(self.tempdir, 'spam')
+        os.makedirs(os.path.join(project, 'spam.egg-info'))
+        requires = os.path.join(project, 'spam.egg-info', 'requires.txt')
+        with open(requires, 'w') as f:
+            f.write('Django\n')
+        egg_link = os.path.join(self.tempdir, 'spam.egg-link')
+        with open(egg_link, 'w') as f:
+            f.write(project + '\n.')
+        state = wscache.develop_state(self.tempdir)
+        self.assertNotEqual(state, before)
+        # Rewriting the same egg-link and metadata changes nothing.
+        for filename in (egg_link, requires):
+            os.utime(filename, (0, 0))
+        self.assertEqual(wscache.develop_state(self.tempdir), state)
+        # New requirements do.
+        with open(requires, 'w') as f:
+            f.write('Django\ngunicorn\n')
+        self.assertNotEqual(wscache.develop_state(self.tempdir), state)
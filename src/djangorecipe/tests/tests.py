@@ -3,11 +3,14 @@ import shutil
 import sys
 import tempfile
 import unittest
+import zipfile
 
 import mock
 import pkg_resources
+import zc.buildout.easy_install
 from zc.buildout import UserError
 
+from djangorecipe import wscache
 from djangorecipe.recipe import Recipe
 
 
@@ -68,6 +71,134 @@ class TestRecipe(BaseTestRecipe):
         self.recipe.install()
         self.recipe.update()
 
+    @mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                return_value=(None, []))
+    def test_working_set_cache(self, working_set):
+        self.recipe.get_working_set()
+        # Another part with the same eggs doesn't resolve them again.
+        Recipe(*self.recipe_initialisation).get_working_set()
+        self.assertEqual(working_set.call_count, 1)
+
+    @mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                return_value=(None, []))
+    def test_working_set_cache_eggs_changed(self, working_set):
+        self.recipe.get_working_set()
+        self.recipe.options['eggs'] = 'gunicorn'
+        self.recipe.get_working_set()
+        self.assertEqual(working_set.call_count, 2)
+
+    @mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                return_value=(None, []))
+    def test_working_set_cache_off(self, working_set):
+        self.recipe.options['working-set-cache'] = 'false'
+        self.recipe.get_working_set()
+        self.recipe.get_working_set()
+        # Not even the in-process cache is used.
+        self.assertEqual(working_set.call_count, 2)
+
+    def test_working_set_key_develop(self):
+        # buildout's develop step rewrites the egg-links every run, that
+        # doesn't change the key.
+        project = os.path.join(self.buildout_dir, 'spam')
+        os.mkdir(project)
+        with open(os.path.join(project, 'setup.py'), 'w') as f:
+            f.write("from setuptools import setup\n"
+                    "setup(name='spam', version='1.0', py_modules=['spam'])\n")
+        open(os.path.join(project, 'spam.py'), 'w').close()
+        os.mkdir(self.develop_eggs_dir)
+        keys = [self.recipe.get_working_set_key()]
+        for _ in range(2):
+            zc.buildout.easy_install.develop(project, self.develop_eggs_dir)
+            keys.append(self.recipe.get_working_set_key())
+        self.assertNotEqual(keys[0], keys[1])
+        self.assertEqual(keys[1], keys[2])
+
+    @mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                return_value=(None, []))
+    def test_install_writes_manifest(self, working_set):
+        paths = self.recipe.install()
+        manifest = os.path.join(self.parts_dir, 'django', 'manifest.json')
+        self.assertEqual(paths[-1], manifest)
+        self.assertTrue(os.path.join(self.bin_dir, 'django')
+                        in open(manifest).read())
+
+    @mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                return_value=(None, []))
+    def test_update_unchanged(self, working_set):
+        self.recipe.install()
+        with mock.patch.object(self.recipe, 'get_working_set') as get_ws:
+            self.recipe.update()
+            self.assertFalse(get_ws.called)
+
+    @mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                return_value=(None, []))
+    def test_update_changed_script(self, working_set):
+        self.recipe.install()
+        manage = os.path.join(self.bin_dir, 'django')
+        open(manage, 'a').write('# Manually edited\n')
+        self.recipe.update()
+        self.assertFalse('Manually edited' in open(manage).read())
+
+    def test_update_newest(self):
+        ws = pkg_resources.WorkingSet()
+        ws.require(['mock'])
+        with mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                        return_value=(None, ws)):
+            self.recipe.install()
+        self.recipe.buildout['buildout']['newest'] = 'true'
+        # A new buildout run.
+        wscache._memory.clear()
+        # A newer release of an unpinned egg would change the scripts.
+        with mock.patch.object(self.recipe, 'generate_scripts') as generate:
+            self.recipe.update()
+            self.assertTrue(generate.called)
+        # Not when every egg is pinned.
+        self.recipe.buildout['versions'] = dict(
+            (dist.project_name, dist.version) for dist in ws)
+        with mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                        return_value=(None, ws)):
+            self.recipe.install()
+        with mock.patch.object(self.recipe, 'generate_scripts') as generate:
+            self.recipe.update()
+            self.assertFalse(generate.called)
+
+    @mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                return_value=(None, []))
+    @mock.patch('djangorecipe.assets.run', return_value={
+        'setup': 0.5,
+        'steps': [{'step': 'collectstatic', 'skipped': False, 'output': '',
+                   'error': None, 'seconds': 2.0},
+                  {'step': 'templates', 'skipped': True, 'output': '',
+                   'error': None, 'seconds': 0.1}]})
+    def test_build_steps(self, run, working_set):
+        self.recipe.options['build-steps'] = 'collectstatic templates'
+        self.recipe.install()
+        with mock.patch.object(self.recipe.log, 'info') as info:
+            self.recipe.update()
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual(run.call_args[0][:2],
+                         (['collectstatic', 'templates'],
+                          'project.development'))
+        self.assertEqual(run.call_args[0][3], os.path.join(
+            self.parts_dir, 'django', 'build-steps.json'))
+        messages = [call[0][0] % call[0][1:] for call in info.call_args_list]
+        self.assertTrue('collectstatic took 2.00s' in messages)
+        self.assertTrue("templates skipped, its inputs didn't change "
+                        "(checked in 0.10s)" in messages)
+
+    @mock.patch('zc.recipe.egg.egg.Scripts.working_set',
+                return_value=(None, []))
+    @mock.patch('djangorecipe.assets.run', return_value={
+        'setup': 0.5,
+        'steps': [{'step': 'templates', 'skipped': False, 'output': '',
+                   'error': 'broken.html: Unclosed tag', 'seconds': 0.1}]})
+    def test_build_steps_failed(self, run, working_set):
+        self.recipe.options['build-steps'] = 'templates'
+        with mock.patch.object(self.recipe.log, 'error'):
+            self.assertRaises(UserError, self.recipe.run_build_steps)
+        self.recipe.options['build-steps'] = 'makemigrations'
+        self.assertRaises(UserError, self.recipe.run_build_steps)
+
     def test_create_file(self):
         # The create file helper should create a file at a certain
         # location unless it already exists. We will need a
@@ -196,6 +327,45 @@ class TestRecipeScripts(BaseTestRecipe):
 
         self.assertTrue("logfile='/foo'" in contents)
 
+    def test_contents_log_options_protocol_script_wsgi(self):
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['logfile'] = '/foo'
+        self.recipe.options['logfile-flush-interval'] = '2.5'
+        self.recipe.options['logfile-max-bytes'] = '1048576'
+        self.recipe.make_wsgi_script([], [])
+
+        wsgi_script = os.path.join(self.bin_dir, 'django.wsgi')
+        contents = open(wsgi_script).read()
+
+        self.assertTrue("logfile='/foo', flush_interval=2.5, "
+                        "max_bytes=1048576)" in contents)
+
+    def test_log_options_without_logfile(self):
+        # The buffering options only matter when there's a logfile.
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['logfile-max-bytes'] = '1048576'
+        self.recipe.make_wsgi_script([], [])
+
+        wsgi_script = os.path.join(self.bin_dir, 'django.wsgi')
+        self.assertFalse('max_bytes' in open(wsgi_script).read())
+
+    def test_log_options_must_be_numbers(self):
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['logfile'] = '/foo'
+        self.recipe.options['logfile-buffer-size'] = 'lots'
+        self.assertRaises(UserError, self.recipe.make_wsgi_script, [], [])
+
+    def test_contents_preload_protocol_script_wsgi(self):
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['wsgi-preload'] = 'true'
+        self.recipe.options['wsgi-warmup-urls'] = '/\nhttp://example.com/a/'
+        self.recipe.make_wsgi_script([], [])
+
+        wsgi_script = os.path.join(self.bin_dir, 'django.wsgi')
+        self.assertTrue("logfile='', preload=True, "
+                        "warmup_urls=['/', 'http://example.com/a/'])"
+                        in open(wsgi_script).read())
+
     def test_make_protocol_named_script_wsgi(self):
         # A wsgi-script name option is specified
         self.recipe.options['wsgi'] = 'true'
@@ -248,6 +418,333 @@ class TestRecipeScripts(BaseTestRecipe):
                         "logfile='')"
                         in open(wsgi_script).read())
 
+    def test_module_index_default(self):
+        self.assertEqual(self.recipe.create_module_index([]), [])
+        self.recipe.create_manage_script([], [])
+        manage = os.path.join(self.bin_dir, 'django')
+        self.assertFalse('pathindex' in open(manage).read())
+
+    def test_module_index(self):
+        ws = pkg_resources.WorkingSet()
+        ws.require(['setuptools'])
+        self.recipe.options['module-index'] = 'true'
+        self.recipe.options['initialization'] = 'import os\nassert True'
+        index_file = os.path.join(self.parts_dir, 'django',
+                                  'module-index.json')
+        self.assertEqual(self.recipe.create_module_index(ws), [index_file])
+        self.assertTrue('setuptools' in open(index_file).read())
+
+        self.recipe.create_manage_script([], ws)
+        manage = os.path.join(self.bin_dir, 'django')
+        contents = open(manage).read()
+        self.assertTrue(
+            "djangorecipe.pathindex.install(%r)" % index_file in contents)
+        # The user's own initialization still comes last.
+        self.assertTrue('import os\nassert True\n\nimport djangorecipe'
+                        in contents)
+
+    def test_compile_bytecode(self):
+        project = os.path.join(self.buildout_dir, 'project')
+        develop = os.path.join(self.buildout_dir, 'src', 'spam')
+        for directory in (project, develop, self.parts_dir):
+            os.makedirs(directory)
+        for directory in (project, develop, self.parts_dir,
+                          self.buildout_dir):
+            with open(os.path.join(directory, 'module.py'), 'w') as f:
+                f.write('x = 1\n')
+        os.mkdir(self.develop_eggs_dir)
+        with open(os.path.join(self.develop_eggs_dir, 'spam.egg-link'),
+                  'w') as f:
+            f.write('src/spam\n.')
+        self.assertEqual([os.path.relpath(path, self.buildout_dir) for path
+                          in self.recipe.get_compile_directories()],
+                         ['project', os.path.join('src', 'spam')])
+
+        self.recipe.options['compile-bytecode'] = 'true'
+        with mock.patch.object(self.recipe.log, 'info') as info:
+            self.recipe.compile_bytecode()
+        self.assertEqual(info.call_args[0][1:3], (2, 2))
+        with mock.patch.object(self.recipe.log, 'info') as info:
+            self.recipe.compile_bytecode()
+        self.assertEqual(info.call_args[0][1:3], (0, 2))
+
+    def test_compile_exclude(self):
+        # A develop egg in the buildout directory itself.
+        for directory in ('project', 'node_modules', 'venv'):
+            os.makedirs(os.path.join(self.buildout_dir, directory))
+            with open(os.path.join(self.buildout_dir, directory,
+                                   'module.py'), 'w') as f:
+                f.write('x = 1\n')
+        os.mkdir(self.develop_eggs_dir)
+        with open(os.path.join(self.develop_eggs_dir, 'spam.egg-link'),
+                  'w') as f:
+            f.write('.\n.')
+        self.recipe.options['compile-bytecode'] = 'true'
+        self.recipe.options['compile-exclude'] = '\n  node_modules\n  venv'
+        with mock.patch.object(self.recipe.log, 'info') as info:
+            self.recipe.compile_bytecode()
+        self.assertEqual(info.call_args[0][1:3], (1, 1))
+
+    @mock.patch('djangorecipe.bytecode.compile_sources')
+    def test_compile_bytecode_disabled(self, compile_sources):
+        # Off by default.
+        self.recipe.compile_bytecode()
+        self.assertFalse(compile_sources.called)
+
+    def test_compile_workers_number(self):
+        self.recipe.options['compile-bytecode'] = 'true'
+        self.recipe.options['compile-workers'] = 'many'
+        self.assertRaises(UserError, self.recipe.compile_bytecode)
+
+    def test_asgi_script(self):
+        self.recipe.options['asgi'] = 'true'
+        self.recipe.options['asgi-preload'] = 'true'
+        self.recipe.options['initialization'] = 'import os'
+        self.recipe.options['deploy-script-extra'] = '# extra'
+        script = os.path.join(self.bin_dir, 'django_asgi.py')
+        self.assertEqual(self.recipe.make_asgi_script([], []), [script])
+        contents = open(script).read()
+        self.assertTrue("application = djangorecipe.binscripts.asgi("
+                        "'project.development', logfile='', preload=True)"
+                        in contents)
+        self.assertTrue('import os' in contents)
+        self.assertTrue(contents.endswith('# extra'))
+        # The wsgi template is left alone.
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.make_wsgi_script([], [])
+        self.assertFalse('preload' in open(
+            os.path.join(self.bin_dir, 'django.wsgi')).read())
+
+    def test_asgi_script_name(self):
+        self.recipe.options['asgi'] = 'true'
+        self.recipe.options['asgi-script'] = 'asgi_app.py'
+        self.assertEqual(self.recipe.make_asgi_script([], []),
+                         [os.path.join(self.bin_dir, 'asgi_app.py')])
+
+    def test_wsgi_metrics(self):
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['wsgi-metrics'] = 'true'
+        self.recipe.options['wsgi-metrics-url'] = '/-/metrics'
+        self.recipe.make_wsgi_script([], [])
+        self.assertTrue(
+            "wsgi('project.development', logfile='', metrics=%r, "
+            "metrics_url='/-/metrics')" % os.path.join(
+                self.parts_dir, 'django', 'metrics',
+                'project.development.metrics')
+            in open(os.path.join(self.bin_dir, 'django.wsgi')).read())
+
+    def test_wsgi_profile(self):
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['wsgi-profile'] = 'true'
+        self.recipe.make_wsgi_script([], [])
+        self.assertTrue(
+            "profile=%r, profile_every=100, profile_keep=100)" % os.path.join(
+                self.parts_dir, 'django', 'profiles')
+            in open(os.path.join(self.bin_dir, 'django.wsgi')).read())
+        self.recipe.options['wsgi-profile-match'] = '/api/\nX-Profile: 1'
+        self.recipe.options['wsgi-profile-keep'] = '20'
+        self.recipe.make_wsgi_script([], [])
+        self.assertTrue(
+            "profile_every=1, profile_keep=20, profile_match=['/api/', "
+            "'X-Profile: 1'])"
+            in open(os.path.join(self.bin_dir, 'django.wsgi')).read())
+
+    def test_wsgi_profile_invalid(self):
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['wsgi-profile'] = 'true'
+        self.recipe.options['wsgi-profile-sample'] = '0'
+        self.assertRaises(UserError, self.recipe.make_wsgi_script, [], [])
+        self.recipe.options['wsgi-profile-sample'] = '10'
+        self.recipe.options['wsgi-profile-match'] = 'api'
+        self.assertRaises(UserError, self.recipe.make_wsgi_script, [], [])
+
+    def test_wsgi_recycle(self):
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.make_wsgi_script([], [])
+        script = os.path.join(self.bin_dir, 'django.wsgi')
+        self.assertFalse('recycle' in open(script).read())
+        self.recipe.options['wsgi-recycle-memory'] = '512'
+        self.recipe.options['wsgi-recycle-requests'] = '1000'
+        self.recipe.options['wsgi-recycle-jitter'] = '100'
+        self.recipe.options['wsgi-recycle-signal'] = 'int'
+        self.recipe.make_wsgi_script([], [])
+        self.assertTrue(
+            "recycle_max_rss=536870912, recycle_check_every=100, "
+            "recycle_max_requests=1000, recycle_jitter=100, "
+            "recycle_signal='INT')" in open(script).read())
+
+    def test_wsgi_recycle_invalid(self):
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['wsgi-recycle-memory'] = '1GB'
+        self.assertRaises(UserError, self.recipe.make_wsgi_script, [], [])
+        self.recipe.options['wsgi-recycle-memory'] = '1024'
+        self.recipe.options['wsgi-recycle-signal'] = 'stop please'
+        self.assertRaises(UserError, self.recipe.make_wsgi_script, [], [])
+
+    def test_dispatch_script(self):
+        self.recipe.options['dispatch'] = (
+            'shop.example.com sites.shop\n/blog sites.blog')
+        self.recipe.options['dispatch-workers'] = '2'
+        script = os.path.join(self.bin_dir, 'django-dispatch.wsgi')
+        self.assertEqual(self.recipe.make_dispatch_script([], []), [script])
+        self.assertTrue(
+            "application = djangorecipe.binscripts.dispatch("
+            "[('shop.example.com', 'sites.shop'), ('/blog', 'sites.blog')], "
+            "python=%r, workers=2, idle_timeout=600)" % sys.executable
+            in open(script).read())
+        # The site workers run the initialization code too.
+        self.recipe.options['initialization'] = 'import os'
+        self.recipe.make_dispatch_script([], [])
+        self.assertTrue("idle_timeout=600, initialization='import os')"
+                        in open(script).read())
+
+    def test_dispatch_invalid(self):
+        self.assertEqual(self.recipe.make_dispatch_script([], []), [])
+        self.recipe.options['dispatch'] = 'shop.example.com'
+        self.assertRaises(UserError, self.recipe.make_dispatch_script, [], [])
+        self.recipe.options['dispatch'] = 'shop.example.com sites.shop'
+        self.recipe.options['dispatch-idle-timeout'] = 'never'
+        self.assertRaises(UserError, self.recipe.make_dispatch_script, [], [])
+
+    def test_forkserver(self):
+        self.recipe.options['forkserver'] = 'true'
+        self.recipe.options['forkserver-timeout'] = '60'
+        self.recipe.create_manage_script([], [])
+        self.assertTrue(
+            "djangorecipe.binscripts.manage('project.development', "
+            "forkserver_directory=%r, forkserver_timeout=60)"
+            % os.path.join(self.parts_dir, 'django')
+            in open(os.path.join(self.bin_dir, 'django')).read())
+
+    @mock.patch('djangorecipe.commands.build', return_value=None)
+    def test_command_index(self, build):
+        self.recipe.options['command-index'] = 'true'
+        index_file = os.path.join(self.parts_dir, 'django',
+                                  'commands-project.development.json')
+        self.assertEqual(self.recipe.create_command_index([], []),
+                         [index_file])
+        self.assertEqual(build.call_args[0][:3],
+                         (index_file, 'django', 'project.development'))
+        self.recipe.create_manage_script([], [])
+        self.assertTrue(
+            "manage('project.development', command_index=%r)" % index_file
+            in open(os.path.join(self.bin_dir, 'django')).read())
+
+    @mock.patch('djangorecipe.commands.build', return_value='No settings')
+    def test_command_index_failed(self, build):
+        self.assertEqual(self.recipe.create_command_index([], []), [])
+        self.assertFalse(build.called)
+        self.recipe.options['command-index'] = 'true'
+        with mock.patch.object(self.recipe.log, 'warning') as warning:
+            self.assertEqual(self.recipe.create_command_index([], []), [])
+        self.assertTrue(warning.called)
+
+    def test_forkserver_timeout_number(self):
+        self.recipe.options['forkserver'] = 'true'
+        self.recipe.options['forkserver-timeout'] = 'forever'
+        self.assertRaises(UserError, self.recipe.create_manage_script,
+                          [], [])
+
+    def test_memory_snapshots(self):
+        self.recipe.options['memory-snapshots'] = 'true'
+        self.recipe.options['memory-snapshot-frames'] = '10'
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.create_manage_script([], [])
+        self.recipe.make_wsgi_script([], [])
+        arguments = ("memory_snapshots=%r, memory_frames=10, "
+                     "memory_signal='USR2')" % os.path.join(
+                         self.parts_dir, 'django', 'memory'))
+        self.assertTrue(
+            "manage('project.development', %s" % arguments
+            in open(os.path.join(self.bin_dir, 'django')).read())
+        self.assertTrue(
+            arguments in open(os.path.join(self.bin_dir,
+                                           'django.wsgi')).read())
+
+    def test_memory_snapshots_invalid(self):
+        self.recipe.options['memory-snapshots'] = 'true'
+        self.recipe.options['memory-snapshot-signal'] = 'SIGUSR1'
+        self.assertTrue("memory_signal='USR1'"
+                        in self.recipe.get_memory_arguments())
+        self.recipe.options['memory-snapshot-signal'] = 'spam'
+        self.assertRaises(UserError, self.recipe.create_manage_script,
+                          [], [])
+        self.recipe.options['memory-snapshot-signal'] = 'USR2'
+        self.recipe.options['memory-snapshot-frames'] = '0'
+        self.assertRaises(UserError, self.recipe.create_manage_script,
+                          [], [])
+
+    def test_get_signal(self):
+        self.recipe.options['memory-snapshot-signal'] = 'sigusr1'
+        self.assertEqual(
+            self.recipe.get_signal('memory-snapshot-signal', 'USR2'), 'USR1')
+        self.recipe.options['memory-snapshot-signal'] = '_IGN'
+        self.assertRaises(UserError, self.recipe.get_signal,
+                          'memory-snapshot-signal', 'USR2')
+        # Older pythons don't have signal.Signals, just integers.
+        with mock.patch('djangorecipe.recipe.signal') as signal_module:
+            signal_module.SIGHUP = 1
+            self.assertEqual(
+                self.recipe.get_signal('wsgi-recycle-signal', 'HUP'), 'HUP')
+
+    def test_bundle_default(self):
+        self.assertEqual(self.recipe.create_bundle([], []), [])
+
+    def test_bundle(self):
+        os.mkdir(os.path.join(self.buildout_dir, 'project'))
+        with open(os.path.join(self.buildout_dir, 'project', 'urls.py'),
+                  'w') as f:
+            f.write('urlpatterns = []\n')
+        with open(os.path.join(self.buildout_dir, 'project', '__init__.py'),
+                  'w') as f:
+            f.write('')
+        self.recipe.options['bundle'] = 'true'
+        self.recipe.options['wsgi'] = 'true'
+        bundle_file = os.path.join(self.parts_dir, 'django', 'django.pyz')
+        self.assertEqual(
+            self.recipe.create_bundle(self.recipe.get_extra_paths(), []),
+            [bundle_file, os.path.join(self.bin_dir, 'django-bundle'),
+             os.path.join(self.bin_dir, 'django-bundle.wsgi')])
+        # The project stays on disk, for settings that use __file__.
+        self.assertFalse('project/urls.py' in
+                         zipfile.ZipFile(bundle_file).namelist())
+        # The scripts import from the bundle, not from the eggs.
+        contents = open(os.path.join(self.bin_dir, 'django-bundle')).read()
+        self.assertTrue("sys.path[0:0] = [\n  %r,\n  %r,\n  ]" %
+                        (bundle_file, self.buildout_dir) in contents)
+        self.assertTrue("djangorecipe.binscripts.manage('project.development')"
+                        in contents)
+
+    def test_startup_trace(self):
+        trace_file = os.path.join(self.buildout_dir, 'var', 'trace.json')
+        self.recipe.options['startup-trace'] = trace_file
+        self.recipe.options['initialization'] = 'import os'
+        self.recipe.create_manage_script([], [])
+        contents = open(os.path.join(self.bin_dir, 'django')).read()
+        # Tracing starts before the user's initialization.
+        self.assertTrue("import djangorecipe.trace\n"
+                        "djangorecipe.trace.start(%r)\n"
+                        "import os" % trace_file in contents)
+
+    def test_server_script_default(self):
+        self.assertEqual(self.recipe.create_server_script([], []), [])
+
+    def test_server_script(self):
+        self.recipe.options['server'] = 'true'
+        self.recipe.options['server-listen'] = '0.0.0.0:80\nunix:/tmp/s'
+        self.recipe.options['server-workers'] = '4'
+        self.recipe.create_server_script([], [])
+        script = os.path.join(self.bin_dir, 'django-serve')
+        self.assertTrue(
+            "djangorecipe.binscripts.serve('project.development', "
+            "logfile='', listen=['0.0.0.0:80', 'unix:/tmp/s'], workers=4, "
+            "max_requests=0)" in open(script).read())
+
+    def test_server_script_invalid_workers(self):
+        self.recipe.options['server'] = 'true'
+        self.recipe.options['server-workers'] = 'many'
+        self.assertRaises(UserError, self.recipe.create_server_script, [], [])
+
     def test_create_scripts_with_settings(self):
         # easy_install is available. It isn't useful, but it is a good
         # example.
@@ -287,6 +784,116 @@ class TestRecipeScripts(BaseTestRecipe):
         self.assertEquals([], result)
 
 
+    def test_create_scripts_with_settings_batched(self):
+        ws = pkg_resources.WorkingSet()
+        ws.require(['pip'])
+        self.recipe.options['scripts-with-settings'] = (
+            'pip\nconsole_scripts:pip3 other.settings')
+        with mock.patch('zc.buildout.easy_install.scripts',
+                        return_value=['some-path']) as scripts:
+            created = self.recipe.create_scripts_with_settings([], ws)
+        self.assertEqual(created, ['some-path', 'some-path'])
+        # One call per settings module.
+        self.assertEqual(scripts.call_count, 2)
+        self.assertEqual([name for name, module, attrs in
+                          scripts.call_args_list[0][0][0]],
+                         ['pip3-with-settings'])
+        self.assertTrue(
+            "os.environ['DJANGO_SETTINGS_MODULE'] = 'other.settings'"
+            in scripts.call_args_list[0][1]['initialization'])
+
+    def test_create_scripts_with_settings_per_script(self):
+        ws = pkg_resources.WorkingSet()
+        ws.require(['pip'])
+        self.recipe.options['scripts-with-settings'] = 'pip other.settings'
+        created = os.path.join(self.bin_dir, 'pip-with-settings')
+        self.assertEqual(self.recipe.create_scripts_with_settings([], ws),
+                         [created])
+        self.assertTrue(
+            "os.environ['DJANGO_SETTINGS_MODULE'] = 'other.settings'"
+            in open(created).read())
+
+    def test_create_scripts_with_settings_other_group(self):
+        ws = pkg_resources.WorkingSet()
+        ws.require(['pip'])
+        self.recipe.options['scripts-with-settings'] = 'gui_scripts:pip'
+        self.assertRaises(UserError,
+                          self.recipe.create_scripts_with_settings, [], ws)
+
+    def test_create_scripts_with_settings_duplicate(self):
+        ws = pkg_resources.WorkingSet()
+        ws.require(['pip'])
+        self.recipe.options['scripts-with-settings'] = (
+            'pip\nconsole_scripts:pip other.settings')
+        self.assertRaises(UserError,
+                          self.recipe.create_scripts_with_settings, [], ws)
+
+    def test_create_scripts_with_settings_invalid(self):
+        self.recipe.options['scripts-with-settings'] = 'pip some settings'
+        self.assertRaises(UserError,
+                          self.recipe.create_scripts_with_settings, [], [])
+
+    def test_settings_matrix(self):
+        ws = pkg_resources.WorkingSet()
+        ws.require(['pip'])
+        self.recipe.options['settings-matrix'] = (
+            'shop-a tenants.shop_a\n'
+            'shop-b tenants.shop_b')
+        self.recipe.options['wsgi'] = 'true'
+        self.recipe.options['asgi'] = 'true'
+        self.recipe.options['scripts-with-settings'] = 'pip'
+        created = self.recipe.create_matrix_scripts([self.buildout_dir], ws)
+        self.assertEqual(sorted(os.path.basename(path) for path in created), [
+            'django-shop-a', 'django-shop-a.wsgi', 'django-shop-b',
+            'django-shop-b.wsgi', 'django_shop_a_asgi.py',
+            'django_shop_b_asgi.py', 'pip-with-settings-shop-a',
+            'pip-with-settings-shop-b'])
+        manage = open(os.path.join(self.bin_dir, 'django-shop-b')).read()
+        self.assertTrue("djangorecipe.binscripts.manage('tenants.shop_b')"
+                        in manage)
+        self.assertTrue("wsgi('tenants.shop_a', logfile='')" in open(
+            os.path.join(self.bin_dir, 'django-shop-a.wsgi')).read())
+        self.assertTrue(
+            "os.environ['DJANGO_SETTINGS_MODULE'] = 'tenants.shop_a'"
+            in open(os.path.join(self.bin_dir,
+                                 'pip-with-settings-shop-a')).read())
+        # The same sys.path as the regular scripts.
+        self.recipe.create_manage_script([self.buildout_dir], ws)
+        regular = open(os.path.join(self.bin_dir, 'django')).read()
+        self.assertEqual(regular.replace('project.development',
+                                         'tenants.shop_b'), manage)
+
+    def test_settings_matrix_batched(self):
+        ws = pkg_resources.WorkingSet()
+        ws.require(['pip'])
+        self.recipe.options['settings-matrix'] = (
+            'a tenants.a\nb tenants.b\nc tenants.c')
+        with mock.patch('zc.buildout.easy_install.get_pth_paths',
+                        return_value=[]) as get_pth_paths:
+            self.recipe.create_matrix_scripts([], ws)
+        # The eggs are scanned once, not for every script.
+        self.assertEqual(get_pth_paths.call_count, len(list(ws)))
+
+    def test_settings_matrix_realpath(self):
+        ws = pkg_resources.WorkingSet()
+        self.recipe.options['settings-matrix'] = 'a tenants.a'
+        realpath = zc.buildout.easy_install.realpath
+        self.recipe.create_matrix_scripts([], ws)
+        self.assertTrue(zc.buildout.easy_install.realpath is realpath)
+        # Also when generating the scripts fails.
+        with mock.patch.object(self.recipe, '_create_matrix_scripts',
+                               side_effect=UserError('Oops')):
+            self.assertRaises(UserError, self.recipe.create_matrix_scripts,
+                              [], ws)
+        self.assertTrue(zc.buildout.easy_install.realpath is realpath)
+
+    def test_settings_matrix_invalid(self):
+        self.recipe.options['settings-matrix'] = 'shop-a'
+        self.assertRaises(UserError, self.recipe.get_settings_matrix)
+        self.recipe.options['settings-matrix'] = 'a one\na two'
+        self.assertRaises(UserError, self.recipe.get_settings_matrix)
+
+
 class TestTesTRunner(BaseTestRecipe):
 
     def test_create_test_runner(self):
@@ -365,6 +972,62 @@ class TestTesTRunner(BaseTestRecipe):
         self.recipe.create_test_runner([recipe_dir], [])
         self.assertTrue("', 'report html_report xml_report', '"
                         in open(testrunner).read())
+        # Only the project is measured by default.
+        self.assertTrue(
+            "coverage_source=[%r]" % os.path.join(self.buildout_dir,
+                                                  'project')
+            in open(testrunner).read())
+
+    def test_coverage_source_and_tracer(self):
+        self.recipe.options['coverage'] = 'true'
+        self.recipe.options['test'] = 'knight'
+        self.recipe.options['coverage-source'] = 'all'
+        self.recipe.options['coverage-tracer'] = 'fastest'
+        self.recipe.create_test_runner([], [])
+        testrunner = os.path.join(self.bin_dir, 'test')
+        self.assertTrue("coverage_source=None, coverage_core='fastest'"
+                        in open(testrunner).read())
+        self.recipe.options['coverage-tracer'] = 'turbo'
+        self.assertRaises(UserError, self.recipe.create_test_runner, [], [])
+
+    def test_test_parallel(self):
+        self.recipe.options['test'] = 'knight spamm'
+        self.recipe.options['test-parallel'] = '4'
+        self.recipe.create_test_runner([], [])
+        testrunner = os.path.join(self.bin_dir, 'test')
+        self.assertTrue("'knight', 'spamm', parallel='4')"
+                        in open(testrunner).read())
+
+    def test_test_parallel_invalid(self):
+        self.recipe.options['test'] = 'knight'
+        self.recipe.options['test-parallel'] = 'many'
+        self.assertRaises(UserError, self.recipe.create_test_runner, [], [])
+
+    def test_test_map(self):
+        self.recipe.options['test'] = 'knight'
+        self.recipe.options['test-map'] = 'true'
+        self.recipe.create_test_runner([], [])
+        testrunner = os.path.join(self.bin_dir, 'test')
+        self.assertTrue(
+            "test_map=%r" % os.path.join(self.buildout_dir, '.testmap.json')
+            in open(testrunner).read())
+
+    def test_test_snapshots(self):
+        self.recipe.options['test'] = 'knight'
+        self.recipe.options['test-snapshots'] = 'true'
+        self.recipe.options['test-snapshots-size'] = '10'
+        self.recipe.create_test_runner([], [])
+        testrunner = os.path.join(self.bin_dir, 'test')
+        self.assertTrue(
+            "test_snapshots=%r, test_snapshots_size=10485760" % os.path.join(
+                self.recipe.options['location'], 'test-snapshots')
+            in open(testrunner).read())
+
+    def test_test_snapshots_size_invalid(self):
+        self.recipe.options['test'] = 'knight'
+        self.recipe.options['test-snapshots'] = 'true'
+        self.recipe.options['test-snapshots-size'] = '1G'
+        self.assertRaises(UserError, self.recipe.create_test_runner, [], [])
 
     def test_relative_paths_true(self):
         recipe = Recipe(
@@ -0,0 +1,281 @@
+"""Startup timeline of the generated scripts.
+
+Tracing is enabled by the ``startup-trace`` option (the generated script
+then calls ``start()`` before the ``initialization`` code) or by setting the
+``DJANGORECIPE_TRACE`` environment variable to a filename (tracing then
+starts when ``djangorecipe.binscripts`` takes over).
+
+Recorded are the startup phases (interpreter start and sys.path setup,
+``initialization``, importing the settings, ``django.setup()`` and running
+the command or loading the wsgi application) and the duration of every
+import. The result is written in the Chrome trace event format (load it in
+``chrome://tracing`` or https://ui.perfetto.dev) and a summary of the
+slowest phases and imports is printed on stderr.
+
+"""
+import atexit
+import json
+import os
+import sys
+import time
+
+ENVIRON = 'DJANGORECIPE_TRACE'
+
+
+class _Tracer(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.start_time = time.time()
+        self.events = []
+        self.finished = False
+        self.entered = False
+        self.import_timer = ImportTimer(self)
+
+    def add(self, name, category, start, end, **args):
+        self.events.append({'name': name, 'cat': category, 'ph': 'X',
+                            'ts': int((start - self.start_time) * 1e6),
+                            'dur': int((end - start) * 1e6),
+                            'pid': os.getpid(), 'tid': 0,
+                            'args': args})
+
+    def write(self):
+        filename = self.filename % {'pid': os.getpid(),
+                                    'script': os.path.basename(sys.argv[0])}
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.events,
+                       'displayTimeUnit': 'ms'}, f, indent=1)
+        return filename
+
+
+_tracer = None
+
+
+class _NoPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _Phase(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _tracer is not None:
+            _tracer.add(self.name, 'phase', self.start, time.time())
+        return False
+
+
+def process_start_time():
+    """Return when this process started (Linux only), None if unknown."""
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name (field 2) can contain spaces, the start time
+            # (in clock ticks after boot) is the 20th field after it.
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        ticks = os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, IndexError, ValueError, AttributeError):
+        return None
+    return time.time() - (uptime - float(fields[19]) / ticks)
+
+
+def active():
+    return _tracer is not None and not _tracer.finished
+
+
+def start(filename):
+    """Start tracing, the trace is written to ``filename`` at exit.
+
+    ``filename`` may contain ``%(pid)s`` and ``%(script)s``.
+
+    """
+    global _tracer
+    if _tracer is not None:
+        return
+    _tracer = _Tracer(filename)
+    started = process_start_time()
+    if started is not None and started < _tracer.start_time:
+        _tracer.add('interpreter startup and sys.path', 'phase', started,
+                    _tracer.start_time)
+    _tracer.import_timer.install()
+    atexit.register(finish)
+
+
+def enter():
+    """Called by the binscripts: the ``initialization`` code is done."""
+    if _tracer is None and os.environ.get(ENVIRON):
+        start(os.environ[ENVIRON])
+    if _tracer is None or _tracer.entered:
+        return
+    _tracer.entered = True
+    _tracer.add('initialization', 'phase', _tracer.start_time, time.time())
+
+
+def phase(name):
+    """Return a context manager that records a phase, if tracing."""
+    if _tracer is None:
+        return _NO_PHASE
+    return _Phase(name)
+
+
+def setup_django():
+    """Import the settings and run django.setup(), as separate phases.
+
+    Django would do both itself anyway; this just makes them show up on the
+    timeline.
+
+    """
+    if _tracer is None:
+        return
+    with phase('settings'):
+        from django.conf import settings
+        settings.INSTALLED_APPS
+    import django
+    if hasattr(django, 'setup'):
+        with phase('django.setup'):
+            django.setup()
+
+
+def finish(out=None):
+    """Stop tracing, write the trace file and print a summary."""
+    if _tracer is None or _tracer.finished:
+        return None
+    _tracer.finished = True
+    _tracer.import_timer.uninstall()
+    _tracer.add('total', 'phase', _tracer.start_time, time.time())
+    filename = _tracer.write()
+    out = out or sys.stderr
+    out.write(summary(_tracer.events))
+    out.write('Startup trace written to %s\n' % filename)
+    return filename
+
+
+def summary(events, limit=15):
+    phases = sorted((event for event in events if event['cat'] == 'phase'),
+                    key=lambda event: -event['dur'])
+    imports = sorted((event for event in events if event['cat'] == 'import'),
+                     key=lambda event: -event['args']['exclusive'])
+    lines = ['Slowest startup phases:']
+    for event in phases[:limit]:
+        lines.append('  %9.1fms  %s' % (event['dur'] / 1000.0,
+                                         event['name']))
+    lines.append('Slowest imports (self / cumulative):')
+    for event in imports[:limit]:
+        lines.append('  %9.1fms %9.1fms  %s' % (
+            event['args']['exclusive'] / 1000.0, event['dur'] / 1000.0,
+            event['name']))
+    return '\n'.join(lines) + '\n'
+
+
+class _TimedLoader(object):
+    """Wraps a loader to time ``exec_module``.
+
+    Everything but exec_module and create_module goes to the real loader.
+    The module gets the real loader as its __loader__.
+
+    """
+
+    def __init__(self, loader, timer, fullname, find_time):
+        self.loader = loader
+        self.timer = timer
+        self.fullname = fullname
+        self.find_time = find_time
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        if hasattr(self.loader, 'create_module'):
+            return self.loader.create_module(spec)
+        return None
+
+    def exec_module(self, module):
+        spec = getattr(module, '__spec__', None)
+        if spec is not None:
+            spec.loader = self.loader
+        try:
+            module.__loader__ = self.loader
+        except AttributeError:
+            pass
+        self.timer.enter()
+        start = time.time()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timer.leave(self.fullname, start, self.find_time)
+
+
+class ImportTimer(object):
+    """Meta path finder that times the finding and executing of modules."""
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.finding = set()
+        # Time spent in nested imports, per level of import nesting.
+        self.nested = []
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname in self.finding:
+            return None
+        self.finding.add(fullname)
+        start = time.time()
+        try:
+            spec = None
+            for finder in sys.meta_path:
+                if finder is self:
+                    continue
+                find_spec = getattr(finder, 'find_spec', None)
+                if find_spec is None:
+                    # An old-style finder: let the import system handle it.
+                    return None
+                spec = find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+        finally:
+            self.finding.discard(fullname)
+        if (spec is None or spec.loader is None or
+                not hasattr(spec.loader, 'exec_module')):
+            return spec
+        spec.loader = _TimedLoader(spec.loader, self, fullname,
+                                   time.time() - start)
+        return spec
+
+    def invalidate_caches(self):
+        pass
+
+    def enter(self):
+        self.nested.append(0.0)
+
+    def leave(self, fullname, start, find_time):
+        end = time.time()
+        nested = self.nested.pop()
+        cumulative = end - start + find_time
+        if self.nested:
+            self.nested[-1] += cumulative
+        self.tracer.add(fullname, 'import', start - find_time, end,
+                        exclusive=int((cumulative - nested) * 1e6),
+                        find=int(find_time * 1e6))
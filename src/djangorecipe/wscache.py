@@ -0,0 +1,175 @@
+"""Cache for resolved working sets.
+
+Resolving the ``eggs`` of a part is the slowest bit of running the recipe
+and buildouts with several djangorecipe parts resolve the same set over and
+over. Resolved working sets are remembered in-process and in a json file,
+keyed by a hash of everything that influences the resolution. On a hit the
+distributions are loaded straight from their recorded locations. When any of
+them is gone the entry is stale and dropped.
+
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+import pkg_resources
+
+CACHE_VERSION = 1
+
+# In-process cache, shared by all parts: {key: working set}.
+_memory = {}
+
+
+def cache_key(*parts):
+    """Return a hash of the given (string) parts."""
+    digest = hashlib.sha1()
+    for part in parts + (sys.executable, sys.version):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+# The metadata files of a develop egg that influence the resolution.
+METADATA_FILES = ('PKG-INFO', 'METADATA', 'requires.txt', 'entry_points.txt')
+
+
+def _file_hash(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return ''
+
+
+def _metadata_state(directory):
+    """Return [(filename, hash)] of the metadata files in a directory."""
+    state = []
+    for name in sorted(os.listdir(directory)):
+        if name in METADATA_FILES:
+            filename = os.path.join(directory, name)
+            state.append((filename, _file_hash(filename)))
+    return state
+
+
+def develop_state(directory):
+    """Return a string describing the develop eggs in a directory.
+
+    Used for the develop-eggs directory. buildout's ``develop`` step
+    rewrites the egg-links (and the develop eggs' metadata) on every run,
+    so this looks at contents, not modification times: the develop paths in
+    the egg-links and the metadata of the develop eggs.
+
+    """
+    if not os.path.isdir(directory):
+        return ''
+    state = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            if name.endswith(('.egg-info', '.dist-info')):
+                state.extend(_metadata_state(path))
+            else:
+                # An egg built by another recipe isn't rebuilt every run.
+                state.append((path, str(os.path.getmtime(path))))
+            continue
+        state.append((path, _file_hash(path)))
+        if not name.endswith('.egg-link'):
+            continue
+        with open(path) as f:
+            location = f.readline().strip()
+        if not os.path.isdir(location):
+            continue
+        for egg_info in sorted(os.listdir(location)):
+            if egg_info.endswith('.egg-info'):
+                egg_info = os.path.join(location, egg_info)
+                if os.path.isdir(egg_info):
+                    state.extend(_metadata_state(egg_info))
+    return '\n'.join('%s:%s' % item for item in state)
+
+
+def _find_distribution(key, version, location):
+    if not os.path.exists(location):
+        return None
+    for dist in pkg_resources.find_distributions(location, only=True):
+        if dist.key == key and dist.version == version:
+            return dist
+    return None
+
+
+class WorkingSetCache(object):
+    """Working sets in a json file, at most ``max_entries`` of them.
+
+    The least recently used entries are evicted first.
+
+    """
+
+    def __init__(self, filename, max_entries=16):
+        self.filename = filename
+        self.max_entries = max_entries
+
+    def _load(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if data.get('version') != CACHE_VERSION:
+            return {}
+        return data['entries']
+
+    def _save(self, entries):
+        if len(entries) > self.max_entries:
+            by_use = sorted(entries, key=lambda key: entries[key]['used'])
+            for key in by_use[:len(entries) - self.max_entries]:
+                del entries[key]
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.filename, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'entries': entries}, f,
+                      indent=1, sort_keys=True)
+
+    def get(self, key, disk=True, accept=None):
+        """Return the cached working set, None when missing or stale.
+
+        With ``disk=False`` only the in-process cache is used. ``accept``
+        is called with the [(key, version, location)] of an entry on disk,
+        which is only used when it returns true.
+
+        """
+        if key in _memory:
+            return _memory[key]
+        if not disk:
+            return None
+        entries = self._load()
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if accept is not None and not accept(entry['dists']):
+            return None
+        ws = pkg_resources.WorkingSet([])
+        for dist_key, version, location in entry['dists']:
+            dist = _find_distribution(dist_key, version, location)
+            if dist is None:
+                # Stale: an egg was removed or replaced.
+                del entries[key]
+                self._save(entries)
+                return None
+            ws.add(dist, entry=location)
+        entry['used'] = time.time()
+        self._save(entries)
+        _memory[key] = ws
+        return ws
+
+    def set(self, key, ws, disk=True):
+        _memory[key] = ws
+        if not disk:
+            return
+        entries = self._load()
+        entries[key] = {
+            'dists': [(dist.key, dist.version, dist.location)
+                      for dist in ws],
+            'used': time.time()}
+        self._save(entries)